@@ -1,11 +1,23 @@
 import abc
+import collections
+import concurrent.futures
 import copy
 import dataclasses
 import datetime
 import functools
+import hashlib
+import itertools
 import json
 import logging
+import lxml.etree
+import math
+import os
+import queue
 import requests
+import requests.adapters
+import sqlite3
+import tempfile
+import threading
 import time
 import warnings
 
@@ -130,6 +142,125 @@ class URLItem(Item):
 		return self._url
 
 
+class DedupFilter:
+	'''An abstract base class for filters that recognise keys (e.g. item IDs) seen before
+
+	Scrapers that need to skip duplicates accept a filter so that the memory used (or the persistence across runs) can be chosen by the caller. All implementations are safe to use from multiple threads.
+	'''
+
+	@abc.abstractmethod
+	def add(self, key):
+		'''Record key and return whether it was new'''
+
+	def flush(self):
+		'''Persist the keys recorded so far, for filters that store them'''
+
+		pass
+
+	def close(self):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		self.close()
+
+
+class SetDedupFilter(DedupFilter):
+	'''Exact filter remembering every key; memory grows with the number of keys'''
+
+	def __init__(self):
+		self._keys = set()
+		self._lock = threading.Lock()
+
+	def add(self, key):
+		with self._lock:
+			if key in self._keys:
+				return False
+			self._keys.add(key)
+			return True
+
+
+class LRUDedupFilter(DedupFilter):
+	'''Exact filter for the maxSize most recently seen keys; older keys are forgotten and would be reported as new again'''
+
+	def __init__(self, maxSize):
+		self._keys = collections.OrderedDict()
+		self._maxSize = maxSize
+		self._lock = threading.Lock()
+
+	def add(self, key):
+		with self._lock:
+			if key in self._keys:
+				self._keys.move_to_end(key)
+				return False
+			self._keys[key] = None
+			if len(self._keys) > self._maxSize:
+				self._keys.popitem(last = False)
+			return True
+
+
+class BloomDedupFilter(DedupFilter):
+	'''Probabilistic filter with fixed memory, sized for capacity keys at a false positive rate of errorRate
+
+	A false positive means that a new key is reported as seen, i.e. the item is dropped. Keys are compared by their string representation.
+	'''
+
+	def __init__(self, capacity, errorRate = 0.001):
+		self._size = max(8, math.ceil(-capacity * math.log(errorRate) / math.log(2) ** 2))
+		self._hashCount = max(1, round(self._size / capacity * math.log(2)))
+		self._bits = bytearray((self._size + 7) // 8)
+		self._lock = threading.Lock()
+
+	def add(self, key):
+		digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size = 16).digest()
+		h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+		new = False
+		with self._lock:
+			for i in range(self._hashCount):
+				bit = (h1 + i * h2) % self._size
+				if not self._bits[bit >> 3] & (1 << (bit & 7)):
+					self._bits[bit >> 3] |= 1 << (bit & 7)
+					new = True
+		return new
+
+
+class SQLiteDedupFilter(DedupFilter):
+	'''Exact filter stored in an SQLite database, for skipping items already retrieved by previous runs
+
+	namespace separates the keys of different uses of the same database. Additions are committed every 1000 keys, on flush, and on close.
+	'''
+
+	def __init__(self, path, namespace = ''):
+		self._namespace = namespace
+		self._lock = threading.Lock()
+		self._uncommitted = 0
+		self._connection = sqlite3.connect(path, check_same_thread = False)
+		self._connection.execute('CREATE TABLE IF NOT EXISTS seen (namespace TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (namespace, key)) WITHOUT ROWID')
+
+	def add(self, key):
+		with self._lock:
+			cursor = self._connection.execute('INSERT OR IGNORE INTO seen (namespace, key) VALUES (?, ?)', (self._namespace, str(key)))
+			if cursor.rowcount != 1:
+				return False
+			self._uncommitted += 1
+			if self._uncommitted >= 1000:
+				self._connection.commit()
+				self._uncommitted = 0
+			return True
+
+	def flush(self):
+		with self._lock:
+			self._connection.commit()
+			self._uncommitted = 0
+
+	def close(self):
+		with self._lock:
+			self._connection.commit()
+			self._connection.close()
+
+
 class ScraperException(Exception):
 	pass
 
@@ -139,10 +270,11 @@ class Scraper:
 
 	name = None
 
-	def __init__(self, *, retries = 3, proxies = None):
+	def __init__(self, *, retries = 3, proxies = None, rateLimiter = None, session = None):
 		self._retries = retries
 		self._proxies = proxies
-		self._session = requests.Session()
+		self._rateLimiter = rateLimiter
+		self._session = session if session is not None else requests.Session()
 
 	@abc.abstractmethod
 	def get_items(self):
@@ -162,18 +294,20 @@ class Scraper:
 	def entity(self):
 		return self._get_entity()
 
-	def _request(self, method, url, params = None, data = None, headers = None, timeout = 10, responseOkCallback = None, allowRedirects = True, proxies = None):
+	def _request(self, method, url, params = None, data = None, headers = None, timeout = 10, responseOkCallback = None, allowRedirects = True, proxies = None, stream = False):
 		proxies = proxies or self._proxies or {}
 		for attempt in range(self._retries + 1):
 			# The request is newly prepared on each retry because of potential cookie updates.
 			req = self._session.prepare_request(requests.Request(method, url, params = params, data = data, headers = headers))
-			environmentSettings = self._session.merge_environment_settings(req.url, proxies, None, None, None)
+			environmentSettings = self._session.merge_environment_settings(req.url, proxies, stream, None, None)
 			logger.debug(f'Retrieving {req.url}')
 			logger.debug(f'... with headers: {headers!r}')
 			if data:
 				logger.debug(f'... with data: {data!r}')
 			if environmentSettings:
 				logger.debug(f'... with environmentSettings: {environmentSettings!r}')
+			if self._rateLimiter is not None:
+				self._rateLimiter.wait()
 			try:
 				r = self._session.send(req, allow_redirects = allowRedirects, timeout = timeout, **environmentSettings)
 			except requests.exceptions.RequestException as exc:
@@ -200,6 +334,8 @@ class Scraper:
 					logger.debug(f'{req.url} retrieved successfully{msg}')
 					return r
 				else:
+					if stream:
+						r.close()
 					if attempt < self._retries:
 						retrying = ', retrying'
 						level = logging.INFO
@@ -217,6 +353,31 @@ class Scraper:
 			raise ScraperException(msg)
 		raise RuntimeError('Reached unreachable code')
 
+	def _iter_pages(self, page, next_page, fetch_page, *, pipeline = False):
+		'''Iterate over page and the pages following it.
+
+		next_page(page) must cheaply extract whatever fetch_page needs to retrieve the following page (e.g. a URL) or return None at the end of pagination.
+		The caller processes each yielded page before requesting the next one from the iterator. With pipeline, the next page is already retrieved in a background thread while that happens.'''
+
+		if not pipeline:
+			while page is not None:
+				nextPage = next_page(page)
+				yield page
+				page = fetch_page(nextPage) if nextPage is not None else None
+			return
+
+		with concurrent.futures.ThreadPoolExecutor(max_workers = 1) as executor:
+			future = None
+			try:
+				while page is not None:
+					nextPage = next_page(page)
+					future = executor.submit(fetch_page, nextPage) if nextPage is not None else None
+					yield page
+					page = future.result() if future is not None else None
+			finally:
+				if future is not None:
+					future.cancel()
+
 	def _get(self, *args, **kwargs):
 		return self._request('GET', *args, **kwargs)
 
@@ -236,6 +397,237 @@ class Scraper:
 		return cls(*args, **kwargs, retries = argparseArgs.retries)
 
 
+def _iter_in_background(iterable, readAhead):
+	'''Consume iterable in a background thread, staying at most readAhead items ahead of the caller.
+
+	Exceptions raised by iterable are re-raised in the caller. Closing the returned generator stops the background thread once it finishes producing its current item and closes iterable.'''
+
+	results = queue.Queue()
+	permits = threading.Semaphore(readAhead)
+	stop = threading.Event()
+	end = object()
+
+	def produce():
+		it = iter(iterable)
+		try:
+			while True:
+				permits.acquire()
+				if stop.is_set():
+					break
+				try:
+					item = next(it)
+				except StopIteration:
+					results.put((end, None))
+					break
+				except BaseException as e:
+					results.put((None, e))
+					break
+				results.put((item, None))
+		finally:
+			if hasattr(it, 'close'):
+				it.close()
+
+	thread = threading.Thread(target = produce, daemon = True)
+	thread.start()
+	try:
+		while True:
+			item, exc = results.get()
+			if exc is not None:
+				raise exc
+			if item is end:
+				break
+			permits.release()
+			yield item
+	finally:
+		stop.set()
+		permits.release()
+
+
+def _map_ordered(fn, iterable, workers):
+	'''Like map(fn, iterable), but with up to workers calls of fn running concurrently in threads.
+
+	Results are yielded in the order of iterable. iterable is consumed lazily, and calls are only started for the workers items following the one last yielded. Exceptions raised by fn are re-raised in the caller when its result is reached.'''
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+		it = iter(iterable)
+		futures = collections.deque(executor.submit(fn, arg) for arg in itertools.islice(it, workers))
+		try:
+			while futures:
+				result = futures.popleft().result()
+				for arg in itertools.islice(it, 1):
+					futures.append(executor.submit(fn, arg))
+				yield result
+		finally:
+			for future in futures:
+				future.cancel()
+
+
+def _iter_merged(iterables, workers, bufferSize = 100):
+	'''Consume the iterables concurrently in up to workers threads, yielding their items in the order in which they are produced.
+
+	iterables is consumed lazily; the next iterable is only started once a thread becomes free. At most bufferSize items are buffered.
+	An exception raised by one of the iterables is re-raised in the caller. When that happens or the returned generator is closed, the threads stop once they have produced their current item.'''
+
+	results = queue.Queue(bufferSize)
+	stop = threading.Event()
+	end = object()
+
+	def put(result):
+		while not stop.is_set():
+			try:
+				results.put(result, timeout = 0.1)
+			except queue.Full:
+				continue
+			return True
+		return False
+
+	def consume(iterable):
+		try:
+			for item in iterable:
+				if not put((item, None)):
+					return
+		except BaseException as e:
+			put((None, e))
+		else:
+			put((end, None))
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+		it = iter(iterables)
+		running = 0
+		for iterable in itertools.islice(it, workers):
+			executor.submit(consume, iterable)
+			running += 1
+		try:
+			while running:
+				item, exc = results.get()
+				if exc is not None:
+					raise exc
+				if item is end:
+					running -= 1
+					for iterable in itertools.islice(it, 1):
+						executor.submit(consume, iterable)
+						running += 1
+					continue
+				yield item
+		finally:
+			stop.set()
+
+
+class _SpillableQueue:
+	'''A FIFO queue of JSON-serialisable items that keeps at most memoryLimit of them in memory and spills the rest to a temporary file
+
+	Items come back from the file as their JSON round trip, e.g. tuples as lists.'''
+
+	def __init__(self, memoryLimit):
+		self._memoryLimit = memoryLimit
+		self._head = collections.deque()
+		self._file = None
+		self._readPosition = 0
+		self._spilled = 0
+
+	def __len__(self):
+		return len(self._head) + self._spilled
+
+	def put(self, item):
+		if not self._spilled and len(self._head) < self._memoryLimit:
+			self._head.append(item)
+			return
+		if self._file is None:
+			self._file = tempfile.TemporaryFile('w+', encoding = 'utf-8')
+		self._file.seek(0, os.SEEK_END)
+		self._file.write(json.dumps(item) + '\n')
+		self._spilled += 1
+
+	def get(self):
+		if not self._head and self._spilled:
+			self._file.seek(self._readPosition)
+			count = min(self._spilled, self._memoryLimit)
+			for _ in range(count):
+				self._head.append(json.loads(self._file.readline()))
+			self._readPosition = self._file.tell()
+			self._spilled -= count
+			if not self._spilled:
+				self.close()
+		return self._head.popleft()
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+			self._readPosition = 0
+
+
+def _pooled_session(poolSize):
+	'''Create a session that keeps up to poolSize connections per host, for sharing between scrapers used concurrently'''
+
+	session = requests.Session()
+	adapter = requests.adapters.HTTPAdapter(pool_connections = poolSize, pool_maxsize = poolSize)
+	session.mount('https://', adapter)
+	session.mount('http://', adapter)
+	return session
+
+
+class _RateLimiter:
+	'''Spaces out calls to wait so that at most rate of them happen per second, across all threads sharing the object'''
+
+	def __init__(self, rate):
+		self._interval = 1 / rate
+		self._lock = threading.Lock()
+		self._next = 0
+
+	def wait(self):
+		with self._lock:
+			now = time.monotonic()
+			slot = max(now, self._next)
+			self._next = slot + self._interval
+		if slot > now:
+			time.sleep(slot - now)
+
+
+def _iter_html_elements(r, predicate, *, chunkSize = 16384):
+	'''Parse the HTML body of the response r incrementally while it is being downloaded, yielding the elements for which predicate(element) is true as soon as their end tag is parsed.
+
+	The element is only complete at that point; its ancestors are not, and its following siblings do not exist yet. Once the caller resumes the iteration, the element is cleared and everything preceding it is removed from the tree, so memory use is bounded by the largest matched element rather than the page size. Matched elements must therefore not contain each other.
+	r should have been retrieved with stream = True; it is closed when the iteration ends.'''
+
+	parser = lxml.etree.HTMLPullParser(events = ('end',), encoding = r.encoding)
+
+	def events():
+		for chunk in r.iter_content(chunk_size = chunkSize):
+			parser.feed(chunk)
+			yield from parser.read_events()
+		parser.close()
+		yield from parser.read_events()
+
+	try:
+		for _, element in events():
+			if not predicate(element):
+				continue
+			yield element
+			element.clear()
+			while element.getprevious() is not None:
+				del element.getparent()[0]
+	finally:
+		r.close()
+
+
+def _cache_dir():
+	'''Return the directory for snscrape's cache files, creating it if necessary'''
+
+	cacheHome = os.environ.get('XDG_CACHE_HOME')
+	if not cacheHome or not os.path.isabs(cacheHome):
+		# This should be ${HOME}/.cache, but the HOME environment variable may not exist on non-POSIX-compliant systems.
+		# On POSIX-compliant systems, the XDG Base Directory specification is followed exactly since ~ expands to $HOME if it is present.
+		cacheHome = os.path.join(os.path.expanduser('~'), '.cache')
+	dir = os.path.join(cacheHome, 'snscrape')
+	if not os.path.isdir(dir):
+		# os.makedirs does not apply mode recursively anymore. https://bugs.python.org/issue42367
+		# This ensures that the XDG_CACHE_HOME is created with the right permissions.
+		os.makedirs(os.path.dirname(dir), mode = 0o700, exist_ok = True)
+		os.makedirs(dir, mode = 0o700, exist_ok = True)
+	return dir
+
+
 def nonempty_string(name):
 	def f(s):
 		s = s.strip()
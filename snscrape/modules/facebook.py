@@ -13,6 +13,8 @@ import urllib.parse
 
 
 _logger = logging.getLogger(__name__)
+_nextPageLinkPattern = re.compile(r'^/pages_reaction_units/more/\?page_id=')
+_spuriousForLoopPattern = re.compile(r'^for \(;;\);')
 
 
 @dataclasses.dataclass
@@ -158,9 +160,10 @@ class _FacebookCommonScraper(snscrape.base.Scraper):
 
 
 class _FacebookUserAndCommunityScraper(_FacebookCommonScraper):
-	def __init__(self, username, **kwargs):
+	def __init__(self, username, *, pipeline = False, **kwargs):
 		super().__init__(**kwargs)
 		self._username = username
+		self._pipeline = pipeline
 		self._headers = {'User-Agent': 'Mozilla/5.0 (X11; Linux i686; rv:78.0) Gecko/20100101 Firefox/78.0', 'Accept-Language': 'en-US,en;q=0.5'}
 		self._initialPage = None
 		self._initialPageSoup = None
@@ -176,41 +179,44 @@ class _FacebookUserAndCommunityScraper(_FacebookCommonScraper):
 		return self._initialPage, self._initialPageSoup
 
 	def get_items(self):
-		nextPageLinkPattern = re.compile(r'^/pages_reaction_units/more/\?page_id=')
-		spuriousForLoopPattern = re.compile(r'^for \(;;\);')
-
 		r, soup = self._initial_page()
 		if r.status_code == 404:
 			_logger.warning('User does not exist')
 			return
-		yield from self._soup_to_items(soup, self._baseUrl, 'user')
+		for soup in self._iter_pages(soup, self._next_page_url, self._get_page, pipeline = self._pipeline):
+			yield from self._soup_to_items(soup, self._baseUrl, 'user')
 
-		while (nextPageLink := soup.find('a', ajaxify = nextPageLinkPattern)):
-			_logger.info('Retrieving next page')
+	def _next_page_url(self, soup):
+		if (nextPageLink := soup.find('a', ajaxify = _nextPageLinkPattern)):
+			return urllib.parse.urljoin(self._baseUrl, nextPageLink.get('ajaxify')) + '&__a=1'
+		return None
 
-			# The web app sends a bunch of additional parameters. Most of them would be easy to add, but there's also __dyn, which is a compressed list of the "modules" loaded in the browser.
-			# Reproducing that would be difficult to get right, especially as Facebook's codebase evolves, so it's just not sent at all here.
-			r = self._get(urllib.parse.urljoin(self._baseUrl, nextPageLink.get('ajaxify')) + '&__a=1', headers = self._headers)
-			if r.status_code != 200:
-				raise snscrape.base.ScraperException(f'Got status code {r.status_code}')
-			response = json.loads(spuriousForLoopPattern.sub('', r.text))
-			assert 'domops' in response
-			assert len(response['domops']) == 1
-			assert len(response['domops'][0]) == 4
-			assert response['domops'][0][0] == 'replace', f'{response["domops"][0]} is not "replace"'
-			assert response['domops'][0][1] in ('#www_pages_reaction_see_more_unitwww_pages_home', '#www_pages_reaction_see_more_unitwww_pages_community_tab')
-			assert response['domops'][0][2] == False
-			assert '__html' in response['domops'][0][3]
-			soup = bs4.BeautifulSoup(response['domops'][0][3]['__html'], 'lxml')
-			yield from self._soup_to_items(soup, self._baseUrl, 'user')
+	def _get_page(self, url):
+		_logger.info('Retrieving next page')
+
+		# The web app sends a bunch of additional parameters. Most of them would be easy to add, but there's also __dyn, which is a compressed list of the "modules" loaded in the browser.
+		# Reproducing that would be difficult to get right, especially as Facebook's codebase evolves, so it's just not sent at all here.
+		r = self._get(url, headers = self._headers)
+		if r.status_code != 200:
+			raise snscrape.base.ScraperException(f'Got status code {r.status_code}')
+		response = json.loads(_spuriousForLoopPattern.sub('', r.text))
+		assert 'domops' in response
+		assert len(response['domops']) == 1
+		assert len(response['domops'][0]) == 4
+		assert response['domops'][0][0] == 'replace', f'{response["domops"][0]} is not "replace"'
+		assert response['domops'][0][1] in ('#www_pages_reaction_see_more_unitwww_pages_home', '#www_pages_reaction_see_more_unitwww_pages_community_tab')
+		assert response['domops'][0][2] == False
+		assert '__html' in response['domops'][0][3]
+		return bs4.BeautifulSoup(response['domops'][0][3]['__html'], 'lxml')
 
 	@classmethod
 	def _cli_setup_parser(cls, subparser):
+		subparser.add_argument('--pipeline', action = 'store_true', default = False, help = 'Retrieve the next page in the background while processing the current one')
 		subparser.add_argument('username', type = snscrape.base.nonempty_string('username'), help = 'A Facebook username or user ID')
 
 	@classmethod
 	def _cli_from_args(cls, args):
-		return cls._cli_construct(args, args.username)
+		return cls._cli_construct(args, args.username, pipeline = args.pipeline)
 
 
 class FacebookUserScraper(_FacebookUserAndCommunityScraper):
@@ -311,7 +317,6 @@ class FacebookGroupScraper(_FacebookCommonScraper):
 
 		pageletDataPattern = re.compile(r'"GroupEntstreamPagelet",\{.*?\}(?=,\{)')
 		pageletDataPrefixLength = len('"GroupEntstreamPagelet",')
-		spuriousForLoopPattern = re.compile(r'^for \(;;\);')
 
 		baseUrl = f'https://upload.facebook.com/groups/{self._group}/?sorting_setting=CHRONOLOGICAL'
 		r = self._get(baseUrl, headers = headers)
@@ -348,7 +353,7 @@ class FacebookGroupScraper(_FacebookCommonScraper):
 			  )
 			if r.status_code != 200:
 				raise snscrape.base.ScraperException(f'Got status code {r.status_code}')
-			obj = json.loads(spuriousForLoopPattern.sub('', r.text))
+			obj = json.loads(_spuriousForLoopPattern.sub('', r.text))
 			if obj['payload'] == '':
 				# End of pagination
 				break
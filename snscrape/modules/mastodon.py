@@ -1,19 +1,29 @@
-__all__ = ['Toot', 'Boost', 'Attachment', 'Poll', 'PollOption', 'User', 'CustomEmoji', 'MastodonProfileScraper', 'MastodonTootScraperMode', 'MastodonTootScraper']
+__all__ = ['Toot', 'Boost', 'Attachment', 'Poll', 'PollOption', 'User', 'CustomEmoji', 'MastodonProfileScraper', 'MastodonProfilesScraper', 'MastodonTootScraperMode', 'MastodonTootScraper']
 
 
 import bs4
 import dataclasses
 import datetime
 import enum
+import filelock
+import itertools
 import json
 import logging
+import lxml.etree
+import os
+import re
+import requests
 import snscrape.base
+import threading
 import time
 import typing
 import urllib.parse
 
 
 _logger = logging.getLogger(__name__)
+_API_PAGE_SIZE = 40 # Maximum for account statuses
+_DEFAULT_REQUEST_INTERVAL = 3 # Seconds between requests to an instance whose rate limit is not known
+_RATE_LIMIT_RESERVE = 0.1 # Fraction of the rate limit below which the remaining requests are spread out until the reset
 
 
 @dataclasses.dataclass
@@ -91,140 +101,438 @@ class CustomEmoji:
 	staticUrl: str
 
 
+class _ApiUnavailable(Exception):
+	pass
+
+
+class _InstanceRateLimiter:
+	'''Spends an instance's request budget as advertised in the X-RateLimit-* headers of its responses
+
+	While more than a tenth of the limit remains, requests are not delayed. Below that, the remaining requests are spread evenly until the reset time, and with none left, requests wait for the reset.
+	Until the first response with these headers, one request is made every 3 seconds.'''
+
+	def __init__(self, limit = None, remaining = None, reset = None):
+		self._lock = threading.Lock()
+		self.limit = limit
+		self.remaining = remaining
+		self.reset = reset # Unix timestamp
+		self._next = 0.0
+
+	def wait(self):
+		with self._lock:
+			now = time.time()
+			if self.reset is not None and now >= self.reset:
+				self.remaining = self.limit
+				self.reset = None
+			slot = max(now, self._next)
+			if self.limit is None:
+				interval = _DEFAULT_REQUEST_INTERVAL
+			elif self.remaining is None or self.reset is None or self.remaining > self.limit * _RATE_LIMIT_RESERVE:
+				interval = 0
+			elif self.remaining > 0:
+				# Spread from the slot rather than from now so that the queued requests do not overshoot the reset
+				interval = max(self.reset - slot, 0) / self.remaining
+			else:
+				interval = 0
+				slot = max(slot, self.reset)
+			self._next = slot + interval
+			if self.remaining:
+				self.remaining -= 1
+		if slot > now:
+			time.sleep(slot - now)
+
+	def response_ok(self, r):
+		'''Callback for Scraper._request: learns from the headers of r and waits for the reset on a 429 before retrying'''
+		self.update(r)
+		if r.status_code == 429:
+			with self._lock:
+				self.remaining = 0
+				if self.reset is None or self.reset <= time.time():
+					retryAfter = r.headers.get('Retry-After', '')
+					self.reset = time.time() + (int(retryAfter) if retryAfter.isdigit() else 60)
+				delay = self.reset - time.time()
+			_logger.info(f'Rate-limited, waiting {delay:.0f} seconds')
+			time.sleep(delay)
+			return False, 'rate-limited'
+		return True, None
+
+	def update(self, r):
+		try:
+			limit = int(r.headers['X-RateLimit-Limit'])
+			remaining = int(r.headers['X-RateLimit-Remaining'])
+			reset = r.headers['X-RateLimit-Reset']
+		except (KeyError, ValueError):
+			return
+		if reset.isdigit(): # Not Mastodon, but some other software uses seconds, either relative or as a timestamp
+			reset = int(reset) + (time.time() if int(reset) < 1e9 else 0)
+		else:
+			try:
+				reset = datetime.datetime.strptime(reset[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo = datetime.timezone.utc).timestamp()
+			except ValueError:
+				return
+		with self._lock:
+			# Responses to concurrent requests can arrive out of order; within a window, the lowest remaining count is the most recent one.
+			if self.reset is not None and abs(reset - self.reset) < 1 and self.remaining is not None:
+				remaining = min(remaining, self.remaining)
+			if self.limit is None: # Drop the default spacing
+				self._next = 0.0
+			self.limit = limit
+			self.remaining = remaining
+			self.reset = reset
+
+
+class _RateLimitStore:
+	'''The rate limiters of all instances, optionally persisted to a JSON file so that later runs continue with the learned budgets'''
+
+	def __init__(self, file = None):
+		self._file = file
+		self._lock = threading.Lock()
+		self._limiters = {}
+		self._state = {}
+		self._lastSave = time.time()
+		if file is not None:
+			self._fileLock = filelock.FileLock(f'{file}.lock')
+			self._state = self._read()
+
+	@classmethod
+	def _cli_default(cls):
+		return cls(os.path.join(snscrape.base._cache_dir(), 'mastodon-rate-limits.json'))
+
+	def _read(self):
+		with self._fileLock:
+			if not os.path.exists(self._file):
+				return {}
+			with open(self._file, 'r') as fp:
+				try:
+					return json.load(fp)
+				except json.JSONDecodeError as e:
+					_logger.warning(f'Malformed rate limit file {self._file}: {e!s}')
+					return {}
+
+	def limiter(self, domain):
+		with self._lock:
+			if domain not in self._limiters:
+				self._limiters[domain] = _InstanceRateLimiter(**self._state.get(domain, {}))
+			return self._limiters[domain]
+
+	def save(self, *, force = False):
+		'''Write the learned limits to the file, at most every 10 seconds unless force is true'''
+		if self._file is None or (not force and time.time() - self._lastSave < 10):
+			return
+		with self._lock:
+			self._lastSave = time.time()
+			limiters = dict(self._limiters)
+		with self._fileLock:
+			state = self._read() # Keep the domains of other processes
+			state.update({domain: {'limit': l.limit, 'remaining': l.remaining, 'reset': l.reset} for domain, l in limiters.items() if l.limit is not None})
+			with open(f'{self._file}.tmp', 'w') as fp:
+				json.dump(state, fp)
+			os.replace(f'{self._file}.tmp', self._file)
+
+
+class _Bs4Nodes:
+	'''Read access to the nodes of a parsed page, so that the same extraction works on bs4 tags and lxml elements
+
+	find returns the first descendant with the tag name (any if None), the class, and the attribute values given, or None; children yields the strings and elements directly within node.'''
+
+	@staticmethod
+	def find(node, name, class_ = None, attrs = None):
+		kwargs = {'class_': class_} if class_ is not None else {} # class_ = None would only match tags without a class
+		return node.find(name, attrs = attrs or {}, **kwargs)
+
+	@staticmethod
+	def find_all(node, name):
+		return node.find_all(name)
+
+	@staticmethod
+	def name(node):
+		return node.name
+
+	@staticmethod
+	def attr(node, attr):
+		return node[attr]
+
+	@staticmethod
+	def classes(node):
+		return node.get('class', [])
+
+	@staticmethod
+	def text(node):
+		return node.text
+
+	@staticmethod
+	def children(node):
+		for child in node.children:
+			yield str(child) if isinstance(child, bs4.element.NavigableString) else child
+
+
+class _LxmlNodes:
+	'''Like _Bs4Nodes, for lxml elements'''
+
+	@staticmethod
+	def find(node, name, class_ = None, attrs = None):
+		for element in node.iterdescendants(name):
+			if not isinstance(element.tag, str): # Comments and processing instructions
+				continue
+			if class_ is not None and class_ not in element.get('class', '').split():
+				continue
+			if attrs and any(element.get(k) != v for k, v in attrs.items()):
+				continue
+			return element
+		return None
+
+	@staticmethod
+	def find_all(node, name):
+		return list(node.iterdescendants(name))
+
+	@staticmethod
+	def name(node):
+		return node.tag
+
+	@staticmethod
+	def attr(node, attr):
+		return node.attrib[attr]
+
+	@staticmethod
+	def classes(node):
+		return node.get('class', '').split()
+
+	@staticmethod
+	def text(node):
+		return ''.join(node.itertext())
+
+	@staticmethod
+	def children(node):
+		if node.text:
+			yield node.text
+		for child in node:
+			if isinstance(child.tag, str):
+				yield child
+			if child.tail:
+				yield child.tail
+
+
 class _MastodonCommonScraper(snscrape.base.Scraper):
-	def __init__(self, **kwargs):
+	def __init__(self, *, rateLimits = None, **kwargs):
 		super().__init__(**kwargs)
 		self._headers = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:52.0) Gecko/20100101 Firefox/52.0', 'Accept-Language': 'en-US,en;q=0.5'}
-		self._lastRequest = 0
+		self._rateLimits = rateLimits if rateLimits is not None else _RateLimitStore()
 
-	def _rate_limited_get(self, *args, **kwargs):
-		if (diff := time.time() - self._lastRequest) < 3:
-			time.sleep(3 - diff)
-		self._lastRequest = time.time()
-		return self._get(*args, **kwargs)
+	def _rate_limited_get(self, url, **kwargs):
+		limiter = self._rateLimits.limiter(urllib.parse.urlparse(url).netloc)
+		limiter.wait()
+		r = self._get(url, responseOkCallback = limiter.response_ok, **kwargs)
+		self._rateLimits.save()
+		return r
+
+	def get_items(self):
+		try:
+			yield from self._get_items()
+		finally:
+			self._rateLimits.save(force = True)
 
-	def _entries_to_items(self, entries, url):
+	def _entries_to_items(self, entries, url, *, nodes = _Bs4Nodes):
 		for entry in entries:
-			if entry.find('a', class_ = 'load-more'):
+			if nodes.find(entry, 'a', 'load-more') is not None:
 				continue
 
 			tootKwargs = {}
 
-			info = entry.find('div', class_ = 'status__info')
-			if not info: # Before 2.5.0 (commit bb71538b)
-				info = entry.find('div', class_ = 'status__header')
-			if not info: # Detailed status (i.e. toot page rather than timeline)?
-				info = entry.find('div', class_ = 'detailed-status__meta')
-			link = info.find('a', class_ = 'status__relative-time')
-			if not link: # Detailed status?
-				link = info.find('a', class_ = 'detailed-status__datetime')
-			tootKwargs['url'] = link['href']
+			info = nodes.find(entry, 'div', 'status__info')
+			if info is None: # Before 2.5.0 (commit bb71538b)
+				info = nodes.find(entry, 'div', 'status__header')
+			if info is None: # Detailed status (i.e. toot page rather than timeline)?
+				info = nodes.find(entry, 'div', 'detailed-status__meta')
+			link = nodes.find(info, 'a', 'status__relative-time')
+			if link is None: # Detailed status?
+				link = nodes.find(info, 'a', 'detailed-status__datetime')
+			tootKwargs['url'] = nodes.attr(link, 'href')
 			tootKwargs['id'] = tootKwargs['url'].rsplit('/', 1)[1]
-			tootKwargs['date'] = datetime.datetime.strptime(info.find('data', class_ = 'dt-published')['value'], '%Y-%m-%dT%H:%M:%S+00:00').replace(tzinfo = datetime.timezone.utc)
+			tootKwargs['date'] = datetime.datetime.strptime(nodes.attr(nodes.find(info, 'data', 'dt-published'), 'value'), '%Y-%m-%dT%H:%M:%S+00:00').replace(tzinfo = datetime.timezone.utc)
 
 			userKwargs = {}
-			userLink = info.find('a', class_ = 'status__display-name')
-			if not userLink: # Detailed status?
-				userLink = entry.find('a', class_ = 'detailed-status__display-name')
-			userNameSpan = userLink.find('span', class_ = 'display-name')
-			userKwargs['account'] = userNameSpan.find('span').text.strip()
+			userLink = nodes.find(info, 'a', 'status__display-name')
+			if userLink is None: # Detailed status?
+				userLink = nodes.find(entry, 'a', 'detailed-status__display-name')
+			userNameSpan = nodes.find(userLink, 'span', 'display-name')
+			userKwargs['account'] = nodes.text(nodes.find(userNameSpan, 'span')).strip()
 			if userKwargs['account'].count('@') == 1: # Ancient versions don't include the instance for posts from accounts on the instance itself
-				userKwargs['account'] = self._url_to_account(userLink['href'])
-			userKwargs['_url'] = urllib.parse.urljoin(url, userLink['href'])
-			userKwargs['displayName'], userKwargs['displayNameWithCustomEmojis'] = self._display_name(userNameSpan.find('strong'), url)
-			userKwargs['avatarUrl'] = urllib.parse.urljoin(url, userLink.find('img', class_ = 'u-photo')['src'])
+				userKwargs['account'] = self._url_to_account(nodes.attr(userLink, 'href'))
+			userKwargs['_url'] = urllib.parse.urljoin(url, nodes.attr(userLink, 'href'))
+			userKwargs['displayName'], userKwargs['displayNameWithCustomEmojis'] = self._display_name(nodes.find(userNameSpan, 'strong'), url, nodes = nodes)
+			userKwargs['avatarUrl'] = urllib.parse.urljoin(url, nodes.attr(nodes.find(userLink, 'img', 'u-photo'), 'src'))
 			tootKwargs['user'] = User(**userKwargs)
 
-			content = entry.find('div', class_ = 'status__content')
-			if not content.find(class_ = 'status__content__spoiler-link'):
-				tootKwargs['text'] = '\n\n'.join(p.text for p in content.find_all('p'))
+			content = nodes.find(entry, 'div', 'status__content')
+			if nodes.find(content, None, 'status__content__spoiler-link') is None:
+				tootKwargs['text'] = '\n\n'.join(nodes.text(p) for p in nodes.find_all(content, 'p'))
 			else:
-				tootKwargs['text'] = content.find('span', class_ = 'p-summary').text
-				tootKwargs['spoilerText'] = '\n\n'.join(p.text for p in content.find('div', class_ = 'e-content').find_all('p'))
+				tootKwargs['text'] = nodes.text(nodes.find(content, 'span', 'p-summary'))
+				tootKwargs['spoilerText'] = '\n\n'.join(nodes.text(p) for p in nodes.find_all(nodes.find(content, 'div', 'e-content'), 'p'))
 
-			if (attachmentsDiv := entry.find('div', class_ = 'attachment-list')):
+			if (attachmentsDiv := nodes.find(entry, 'div', 'attachment-list')) is not None:
 				attachments = []
-				for a in attachmentsDiv.find_all('a'):
-					attachments.append(Attachment(url = urllib.parse.urljoin(url, a['href']), name = a.text.strip()))
+				for a in nodes.find_all(attachmentsDiv, 'a'):
+					attachments.append(Attachment(url = urllib.parse.urljoin(url, nodes.attr(a, 'href')), name = nodes.text(a).strip()))
 				tootKwargs['attachments'] = attachments
-			elif (mediaGalleryDiv := entry.find('div', attrs = {'data-component': 'MediaGallery'})): # Before 2.7.0 (https://github.com/mastodon/mastodon/issues/6714)
-				o = json.loads(mediaGalleryDiv['data-props'])
+			elif (mediaGalleryDiv := nodes.find(entry, 'div', attrs = {'data-component': 'MediaGallery'})) is not None: # Before 2.7.0 (https://github.com/mastodon/mastodon/issues/6714)
+				o = json.loads(nodes.attr(mediaGalleryDiv, 'data-props'))
 				attachments = []
 				for medium in o['media']:
 					attachments.append(Attachment(url = urllib.parse.urljoin(url, medium['url']), name = medium['url'].rsplit('/', 1)[-1].strip()))
 				tootKwargs['attachments'] = attachments
-			elif (attachmentsDiv := entry.find('div', class_ = 'status__attachments')): # Before 2.3.0 (commit 2bbf987a)
+			elif (attachmentsDiv := nodes.find(entry, 'div', 'status__attachments')) is not None: # Before 2.3.0 (commit 2bbf987a)
 				attachments = []
-				for a in attachmentsDiv.find_all('a'):
-					attachments.append(Attachment(url = urllib.parse.urljoin(url, a['href']), name = a['href'].rsplit('/', 1)[1]))
+				for a in nodes.find_all(attachmentsDiv, 'a'):
+					attachments.append(Attachment(url = urllib.parse.urljoin(url, nodes.attr(a, 'href')), name = nodes.attr(a, 'href').rsplit('/', 1)[1]))
 				tootKwargs['attachments'] = attachments
 
-			links = []
-			mentionedUsers = []
-			hashtags = []
-			for a in content.find_all('a'):
-				cls = a.get('class', [])
-				if 'mention' in cls and 'u-url' in cls:
-					mentionUrl = urllib.parse.urljoin(url, a['href'])
-					mentionedUsers.append(User(account = self._url_to_account(mentionUrl), _url = mentionUrl))
-				elif 'mention' in cls and 'hashtag' in cls:
-					hashtags.append(a.text.strip())
-				else:
-					links.append(urllib.parse.urljoin(url, a['href']))
-			if links:
-				tootKwargs['links'] = links
-			if mentionedUsers:
-				tootKwargs['mentionedUsers'] = mentionedUsers
-			if hashtags:
-				tootKwargs['hashtags'] = hashtags
-
-			if (pollDiv := entry.find('div', attrs = {'data-component': 'Poll'})):
-				o = json.loads(pollDiv['data-props'])
-				pollKwargs = {}
-				pollKwargs['id'] = o['poll']['id']
-				pollKwargs['expirationDate'] = datetime.datetime.strptime(o['poll']['expires_at'], '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo = datetime.timezone.utc)
-				pollKwargs['multiple'] = o['poll']['multiple']
-				pollKwargs['options'] = [PollOption(title = op['title'], votesCount = op['votes_count']) for op in o['poll']['options']]
-				pollKwargs['votesCount'] = o['poll']['votes_count']
-				if 'voters_count' in o['poll']: # 3.0.0 (commit 3babf846)
-					pollKwargs['votersCount'] = o['poll']['voters_count']
-				tootKwargs['poll'] = Poll(**pollKwargs)
+			tootKwargs.update(self._content_links(content, url, nodes = nodes))
+
+			if (pollDiv := nodes.find(entry, 'div', attrs = {'data-component': 'Poll'})) is not None:
+				tootKwargs['poll'] = self._poll(json.loads(nodes.attr(pollDiv, 'data-props'))['poll'])
 
 			toot = Toot(**tootKwargs)
 
 			# Boosts
-			prepend = entry.find('div', class_ = 'status__prepend')
-			if not prepend: # Before 2.5.0 (commit bb71538b)
-				prepend = entry.find('div', class_ = 'pre-header')
-			if prepend and prepend.find('i', class_ = 'fa-retweet'): # Is a boost
+			prepend = nodes.find(entry, 'div', 'status__prepend')
+			if prepend is None: # Before 2.5.0 (commit bb71538b)
+				prepend = nodes.find(entry, 'div', 'pre-header')
+			if prepend is not None and nodes.find(prepend, 'i', 'fa-retweet') is not None: # Is a boost
 				userKwargs = {}
-				userLink = prepend.find('a', class_ = 'status__display-name')
+				userLink = nodes.find(prepend, 'a', 'status__display-name')
 				# The user is always on this instance since that's the only place where boosts are shown, hence there is no explicit account span. Reconstruct from URL.
-				userUrl = urllib.parse.urljoin(url, userLink['href'])
+				userUrl = urllib.parse.urljoin(url, nodes.attr(userLink, 'href'))
 				assert userUrl.count('/') == 3 and userUrl.count('/@') == 1
 				userKwargs['account'] = '@'.join(reversed(userUrl.split('/')[2:]))
-				userKwargs['displayName'], userKwargs['displayNameWithCustomEmojis'] = self._display_name(userLink.find('strong'), url)
+				userKwargs['displayName'], userKwargs['displayNameWithCustomEmojis'] = self._display_name(nodes.find(userLink, 'strong'), url, nodes = nodes)
 				toot = Boost(user = User(**userKwargs), toot = toot)
 
 			yield toot
 
-	def _display_name(self, strong, url):
+	def _content_links(self, content, url, *, nodes = _Bs4Nodes):
+		'''Extract the links, mentioned users, and hashtags from a toot's content element as Toot kwargs'''
+		links = []
+		mentionedUsers = []
+		hashtags = []
+		for a in nodes.find_all(content, 'a'):
+			cls = nodes.classes(a)
+			if 'mention' in cls and 'u-url' in cls:
+				mentionUrl = urllib.parse.urljoin(url, nodes.attr(a, 'href'))
+				mentionedUsers.append(User(account = self._url_to_account(mentionUrl), _url = mentionUrl))
+			elif 'mention' in cls and 'hashtag' in cls:
+				hashtags.append(nodes.text(a).strip())
+			else:
+				links.append(urllib.parse.urljoin(url, nodes.attr(a, 'href')))
+		kwargs = {}
+		if links:
+			kwargs['links'] = links
+		if mentionedUsers:
+			kwargs['mentionedUsers'] = mentionedUsers
+		if hashtags:
+			kwargs['hashtags'] = hashtags
+		return kwargs
+
+	def _poll(self, o):
+		pollKwargs = {}
+		pollKwargs['id'] = o['id']
+		pollKwargs['expirationDate'] = datetime.datetime.strptime(o['expires_at'], '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo = datetime.timezone.utc)
+		pollKwargs['multiple'] = o['multiple']
+		pollKwargs['options'] = [PollOption(title = op['title'], votesCount = op['votes_count']) for op in o['options']]
+		pollKwargs['votesCount'] = o['votes_count']
+		if 'voters_count' in o: # 3.0.0 (commit 3babf846)
+			pollKwargs['votersCount'] = o['voters_count']
+		return Poll(**pollKwargs)
+
+	def _get_api(self, domain, path, params = None):
+		'''Retrieve a REST API endpoint and return the status code and decoded JSON.
+
+		Raises _ApiUnavailable if the response is not usable, e.g. because the instance predates the endpoint or requires authentication; the HTML pages should be scraped instead then.'''
+		r = self._rate_limited_get(f'https://{domain}{path}', params = params, headers = self._headers)
+		if r.status_code in (401, 403, 404, 410, 422) or r.status_code == 200:
+			try:
+				obj = r.json()
+			except ValueError:
+				raise _ApiUnavailable(f'non-JSON response with status code {r.status_code}')
+			if r.status_code in (200, 404):
+				return r.status_code, obj
+			raise _ApiUnavailable(f'status code {r.status_code}')
+		raise snscrape.base.ScraperException(f'Got status code {r.status_code}')
+
+	def _api_account_to_user(self, account, domain, *, full = True):
+		userKwargs = {}
+		userKwargs['account'] = f'@{account["acct"]}' if '@' in account['acct'] else f'@{account["acct"]}@{domain}'
+		userKwargs['displayName'], userKwargs['displayNameWithCustomEmojis'] = self._api_display_name(account, domain)
+		if full: # Boosting users only have an account and display name in the HTML version
+			userKwargs['avatarUrl'] = account['avatar']
+			userKwargs['_url'] = account['url']
+		return User(**userKwargs)
+
+	def _api_display_name(self, account, domain):
+		displayName = account['display_name'] or account['username']
+		emojis = {f':{emoji["shortcode"]}:': emoji for emoji in account.get('emojis') or []} # Custom emojis since 2.4.0
+		if not emojis:
+			return displayName, None
+		outFull = []
+		hasCustomEmoji = False
+		for part in re.split('(:[A-Za-z0-9_]+:)', displayName):
+			if part in emojis:
+				hasCustomEmoji = True
+				outFull.append(CustomEmoji(shortName = part, url = emojis[part]['url'], staticUrl = emojis[part]['static_url']))
+			elif part:
+				outFull.append(part)
+		return displayName, outFull if hasCustomEmoji else None
+
+	def _api_status_to_item(self, status, domain):
+		if status.get('reblog'):
+			return Boost(user = self._api_account_to_user(status['account'], domain, full = False), toot = self._api_status_to_item(status['reblog'], domain))
+
+		tootKwargs = {}
+		tootKwargs['url'] = status['url'] or status['uri']
+		tootKwargs['id'] = tootKwargs['url'].rsplit('/', 1)[1]
+		# The HTML version only has second precision
+		tootKwargs['date'] = datetime.datetime.strptime(status['created_at'][:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo = datetime.timezone.utc)
+		tootKwargs['user'] = self._api_account_to_user(status['account'], domain)
+
+		content = bs4.BeautifulSoup(status['content'], 'lxml')
+		paragraphs = '\n\n'.join(p.text for p in content.find_all('p'))
+		if status.get('spoiler_text'):
+			tootKwargs['text'] = status['spoiler_text']
+			tootKwargs['spoilerText'] = paragraphs
+		else:
+			tootKwargs['text'] = paragraphs
+
+		if status.get('media_attachments'):
+			attachments = []
+			for medium in status['media_attachments']:
+				mediumUrl = medium.get('remote_url') or medium['url']
+				attachments.append(Attachment(url = mediumUrl, name = mediumUrl.rsplit('/', 1)[-1].strip()))
+			tootKwargs['attachments'] = attachments
+
+		tootKwargs.update(self._content_links(content, tootKwargs['url']))
+
+		if status.get('poll'):
+			tootKwargs['poll'] = self._poll(status['poll'])
+
+		return Toot(**tootKwargs)
+
+	def _display_name(self, strong, url, *, nodes = _Bs4Nodes):
 		outPlain = []
 		outFull = []
 		hasCustomEmoji = False
-		for child in strong.children:
-			if isinstance(child, bs4.element.NavigableString):
-				outPlain.append(str(child))
-				outFull.append(str(child))
-			elif child.name == 'img' and 'custom-emoji' in child.get('class', []):
+		for child in nodes.children(strong):
+			if isinstance(child, str):
+				outPlain.append(child)
+				outFull.append(child)
+			elif nodes.name(child) == 'img' and 'custom-emoji' in nodes.classes(child):
 				hasCustomEmoji = True
-				outPlain.append(child['alt'])
-				outFull.append(CustomEmoji(shortName = child['alt'], url = urllib.parse.urljoin(url, child['data-original']), staticUrl = urllib.parse.urljoin(url, child['data-static'])))
-			elif child.name == 'img' and 'emojione' in child.get('class', []):
+				outPlain.append(nodes.attr(child, 'alt'))
+				outFull.append(CustomEmoji(shortName = nodes.attr(child, 'alt'), url = urllib.parse.urljoin(url, nodes.attr(child, 'data-original')), staticUrl = urllib.parse.urljoin(url, nodes.attr(child, 'data-static'))))
+			elif nodes.name(child) == 'img' and 'emojione' in nodes.classes(child):
 				# Version 2.0.0 (which first added custom emojis) to 2.9.4: no data-* attributes, only gets one of the URLs with no (easy, reliable) way of knowing which it is.
 				hasCustomEmoji = True
-				outPlain.append(child['alt'])
-				outFull.append(CustomEmoji(shortName = child['alt'], url = urllib.parse.urljoin(url, child['src'])))
+				outPlain.append(nodes.attr(child, 'alt'))
+				outFull.append(CustomEmoji(shortName = nodes.attr(child, 'alt'), url = urllib.parse.urljoin(url, nodes.attr(child, 'src'))))
 			else:
 				_logger.warning(f'Unexpected display name child: {child!r}')
 		return ''.join(outPlain), outFull if hasCustomEmoji else None
@@ -245,8 +553,13 @@ class _MastodonCommonScraper(snscrape.base.Scraper):
 class MastodonProfileScraper(_MastodonCommonScraper):
 	name = 'mastodon-profile'
 
-	def __init__(self, account, **kwargs):
+	def __init__(self, account, *, pipeline = False, stream = False, api = False, **kwargs):
 		super().__init__(**kwargs)
+		if pipeline and stream:
+			raise ValueError('pipeline and stream are mutually exclusive')
+		self._pipeline = pipeline
+		self._stream = stream
+		self._api = api
 		if account.startswith('@') and account.count('@') == 2:
 			account, domain = account[1:].split('@')
 			url = f'https://{domain}/@{account}'
@@ -254,46 +567,186 @@ class MastodonProfileScraper(_MastodonCommonScraper):
 			url = account
 		self._url = url
 
-	def get_items(self):
-		initial = True
-		while True:
-			if initial:
-				r = self._rate_limited_get(f'{self._url}/with_replies', headers = self._headers)
-				if r.status_code not in (200, 404):
-					raise snscrape.base.ScraperException(f'Got status code {r.status_code}')
-				if r.status_code == 404: # Possibly an old instance where with_replies doesn't exist, try without that.
-					r = self._rate_limited_get(self._url, headers = self._headers)
-					if r.status_code not in (200, 404):
-						raise snscrape.base.ScraperException(f'Got status code {r.status_code}')
-					if r.status_code == 404:
-						_logger.warning('Account does not exist')
-						return
-					_logger.warning('Old Mastodon instance, cannot retrieve reply toots')
-				initial = False
-			else:
-				r = self._rate_limited_get(url, headers = self._headers)
-				if r.status_code != 200:
-					raise snscrape.base.ScraperException(f'Got status code {r.status_code}')
-			soup = bs4.BeautifulSoup(r.text, 'lxml')
+	def _get_items(self):
+		if self._api:
+			# Falling back is only possible before the first toot; the HTML pages would start over from the newest one.
+			yielded = False
+			try:
+				for item in self._api_items():
+					yielded = True
+					yield item
+				return
+			except _ApiUnavailable as e:
+				if yielded:
+					raise snscrape.base.ScraperException(f'REST API became unavailable during pagination: {e}') from e
+				_logger.info(f'REST API not available ({e}), falling back to HTML pages')
+
+		r = self._get_first_page_response(f'{self._url}/with_replies')
+		if r.status_code == 404: # Possibly an old instance where with_replies doesn't exist, try without that.
+			r.close()
+			r = self._get_first_page_response(self._url)
+			if r.status_code == 404:
+				r.close()
+				_logger.warning('Account does not exist')
+				return
+			_logger.warning('Old Mastodon instance, cannot retrieve reply toots')
+
+		if self._stream:
+			yield from self._stream_items(r)
+			return
 
+		for r, soup in self._iter_pages((r, bs4.BeautifulSoup(r.text, 'lxml')), self._next_page_url, self._get_page, pipeline = self._pipeline):
 			yield from self._entries_to_items(soup.find('div', class_ = 'activity-stream').find_all('div', class_ = 'entry'), r.url)
 
-			nextA = soup.find('a', class_ = 'load-more', href = lambda x: '?max_id=' in x or '&max_id=' in x)
-			if not nextA: # Before 2.5.0 (commit bb71538b)
-				paginationDiv = soup.find('div', class_ = 'pagination')
-				if paginationDiv:
-					nextA = paginationDiv.find('a', class_ = 'next')
-			if not nextA: # End of pagination
+	def _api_items(self):
+		parsed = urllib.parse.urlparse(self._url)
+		domain, acct = parsed.netloc, parsed.path.rstrip('/')
+		if not acct.startswith('/@') or '/' in acct[1:]:
+			raise _ApiUnavailable('profile URL without account name')
+		status, account = self._get_api(domain, '/api/v1/accounts/lookup', params = {'acct': acct[2:]}) # Since 3.4.0
+		if status == 404:
+			# Older versions route this to accounts#show with id=lookup, which is a 404 as well, so let the HTML pages decide whether the account exists.
+			raise _ApiUnavailable('account lookup not found')
+		params = {'limit': _API_PAGE_SIZE}
+		status, statuses = self._get_api(domain, f'/api/v1/accounts/{account["id"]}/statuses', params = params)
+		while statuses:
+			yield from (self._api_status_to_item(s, domain) for s in statuses)
+			params['max_id'] = statuses[-1]['id']
+			status, statuses = self._get_api(domain, f'/api/v1/accounts/{account["id"]}/statuses', params = params)
+
+	def _next_page_url(self, page):
+		r, soup = page
+		nextA = soup.find('a', class_ = 'load-more', href = lambda x: '?max_id=' in x or '&max_id=' in x)
+		if not nextA: # Before 2.5.0 (commit bb71538b)
+			paginationDiv = soup.find('div', class_ = 'pagination')
+			if paginationDiv:
+				nextA = paginationDiv.find('a', class_ = 'next')
+		if not nextA: # End of pagination
+			return None
+		return urllib.parse.urljoin(r.url, nextA['href'])
+
+	def _get_page(self, url):
+		r = self._get_page_response(url)
+		return r, bs4.BeautifulSoup(r.text, 'lxml')
+
+	def _get_first_page_response(self, url):
+		r = self._rate_limited_get(url, headers = self._headers, stream = self._stream)
+		if r.status_code not in (200, 404):
+			r.close()
+			raise snscrape.base.ScraperException(f'Got status code {r.status_code}')
+		return r
+
+	def _get_page_response(self, url, *, stream = False):
+		r = self._rate_limited_get(url, headers = self._headers, stream = stream)
+		if r.status_code != 200:
+			r.close()
+			raise snscrape.base.ScraperException(f'Got status code {r.status_code}')
+		return r
+
+	def _stream_items(self, r):
+		# Each entry is converted and yielded as soon as its end tag has been received; the next page link is only known at the end of the page.
+		while r is not None:
+			nextHref = None
+			paginationHref = None
+			try:
+				for element in snscrape.base._iter_html_elements(r, _is_stream_element):
+					if 'pagination' in element.get('class').split(): # Before 2.5.0 (commit bb71538b)
+						if paginationHref is None and (nextA := _first_next_link(element)):
+							paginationHref = nextA[0].get('href')
+						continue
+					if (loadMoreA := _first_load_more_link(element)):
+						if nextHref is None:
+							nextHref = loadMoreA[0].get('href')
+						continue
+					yield from self._entries_to_items([element], r.url, nodes = _LxmlNodes)
+			finally:
+				r.close()
+			if not (nextHref := nextHref or paginationHref):
 				break
-			url = urllib.parse.urljoin(r.url, nextA['href'])
+			r = self._get_page_response(urllib.parse.urljoin(r.url, nextHref), stream = True)
 
 	@classmethod
 	def _cli_setup_parser(cls, subparser):
+		group = subparser.add_mutually_exclusive_group(required = False)
+		group.add_argument('--pipeline', action = 'store_true', default = False, help = 'Retrieve the next page in the background while processing the current one')
+		group.add_argument('--stream', action = 'store_true', default = False, help = 'Parse pages incrementally while they are being downloaded and emit each toot as soon as it has been received')
+		subparser.add_argument('--api', action = 'store_true', default = False, help = 'Use the REST API, falling back to the HTML pages if it is not available')
 		subparser.add_argument('account', type = snscrape.base.nonempty_string('account'), help = 'A Mastodon account. This can be either a URL to the profile page or a string of the form @account@instance.example.org')
 
 	@classmethod
 	def _cli_from_args(cls, args):
-		return cls._cli_construct(args, args.account)
+		return cls._cli_construct(args, args.account, pipeline = args.pipeline, stream = args.stream, api = args.api, rateLimits = _RateLimitStore._cli_default())
+
+
+class MastodonProfilesScraper(_MastodonCommonScraper):
+	'''Retrieve the toots of many accounts, possibly on different instances
+
+	The accounts are grouped by instance. Up to workers instances are scraped concurrently, each with its own session and rate limiter, and the accounts of one instance one after another. Toots are yielded as they are retrieved, so accounts on different instances are interleaved.
+	An account that cannot be retrieved is logged and skipped; after three consecutive such accounts, the remaining ones on that instance are skipped as well.'''
+
+	name = 'mastodon-profiles'
+
+	def __init__(self, accounts, *, workers = 8, api = False, **kwargs):
+		super().__init__(**kwargs)
+		if workers < 1:
+			raise ValueError('workers must be positive')
+		self._instances = {}
+		for account in accounts:
+			if not (account.startswith('@') and account.count('@') == 2):
+				raise ValueError(f'invalid account {account!r}, must be of the form @account@instance.example.org')
+			self._instances.setdefault(account.split('@')[2].lower(), []).append(account)
+		self._workers = workers
+		self._api = api
+
+	def _get_items(self):
+		_logger.info(f'Retrieving {sum(map(len, self._instances.values()))} accounts on {len(self._instances)} instances')
+		yield from snscrape.base._iter_merged((self._instance_items(domain, accounts) for domain, accounts in self._instances.items()), self._workers)
+
+	def _instance_items(self, domain, accounts):
+		with requests.Session() as session:
+			failures = 0
+			for i, account in enumerate(accounts):
+				scraper = MastodonProfileScraper(account, api = self._api, rateLimits = self._rateLimits, retries = self._retries, proxies = self._proxies, session = session)
+				try:
+					yield from scraper._get_items()
+				except Exception as e: # Not only ScraperException: a malformed page or response of one account must not end the other instances' threads
+					_logger.error(f'Could not retrieve {account}: {type(e).__name__}: {e}')
+					failures += 1
+					if failures >= 3 and i + 1 < len(accounts):
+						_logger.error(f'Skipping the remaining {len(accounts) - i - 1} accounts on {domain}')
+						return
+				else:
+					failures = 0
+
+	@classmethod
+	def _cli_setup_parser(cls, subparser):
+		subparser.add_argument('--workers', type = int, default = 8, help = 'Number of instances to scrape concurrently')
+		subparser.add_argument('--api', action = 'store_true', default = False, help = 'Use the REST API, falling back to the HTML pages if it is not available')
+		subparser.add_argument('--accounts-file', dest = 'accountsFile', metavar = 'FILE', help = 'Read further accounts from this file, one per line')
+		subparser.add_argument('accounts', nargs = '*', metavar = 'account', help = 'A Mastodon account of the form @account@instance.example.org')
+
+	@classmethod
+	def _cli_from_args(cls, args):
+		accounts = list(args.accounts)
+		if args.accountsFile:
+			with open(args.accountsFile, 'r') as fp:
+				accounts.extend(line.strip() for line in fp if line.strip())
+		if not accounts:
+			raise ValueError('no accounts given')
+		return cls._cli_construct(args, accounts, workers = args.workers, api = args.api, rateLimits = _RateLimitStore._cli_default())
+
+
+_first_load_more_link = lxml.etree.XPath("(.//a[contains(concat(' ', normalize-space(@class), ' '), ' load-more ') and (contains(@href, '?max_id=') or contains(@href, '&max_id='))])[1]")
+_first_next_link = lxml.etree.XPath("(.//a[contains(concat(' ', normalize-space(@class), ' '), ' next ') and @href])[1]")
+
+
+def _is_stream_element(element):
+	if element.tag != 'div':
+		return False
+	classes = element.get('class', '').split()
+	if 'pagination' in classes:
+		return True
+	return 'entry' in classes and any('activity-stream' in ancestor.get('class', '').split() for ancestor in element.iterancestors('div'))
 
 
 class MastodonTootScraperMode(enum.Enum):
@@ -310,12 +763,20 @@ class MastodonTootScraperMode(enum.Enum):
 class MastodonTootScraper(_MastodonCommonScraper):
 	name = 'mastodon-toot'
 
-	def __init__(self, url, *, mode = MastodonTootScraperMode.SINGLE, **kwargs):
+	def __init__(self, url, *, mode = MastodonTootScraperMode.SINGLE, api = False, **kwargs):
 		super().__init__(**kwargs)
 		self._url = url
 		self._mode = mode
+		self._api = api
+
+	def _get_items(self):
+		if self._api:
+			try:
+				yield from self._api_items()
+				return
+			except _ApiUnavailable as e:
+				_logger.info(f'REST API not available ({e}), falling back to HTML page')
 
-	def get_items(self):
 		r = self._rate_limited_get(self._url, headers = self._headers)
 		if r.status_code == 404:
 			_logger.warning('Toot does not exist')
@@ -330,11 +791,28 @@ class MastodonTootScraper(_MastodonCommonScraper):
 		elif self._mode is MastodonTootScraperMode.THREAD:
 			yield from self._entries_to_items(soup.find('div', class_ = 'activity-stream').find_all('div', class_ = 'entry'), r.url)
 
+	def _api_items(self):
+		parsed = urllib.parse.urlparse(self._url)
+		domain, statusId = parsed.netloc, parsed.path.rstrip('/').rsplit('/', 1)[-1]
+		if not statusId.isdigit():
+			raise _ApiUnavailable('toot URL without numeric ID')
+		status, obj = self._get_api(domain, f'/api/v1/statuses/{statusId}')
+		if status == 404:
+			_logger.warning('Toot does not exist')
+			return
+		if self._mode is MastodonTootScraperMode.SINGLE:
+			yield self._api_status_to_item(obj, domain)
+		elif self._mode is MastodonTootScraperMode.THREAD:
+			_, context = self._get_api(domain, f'/api/v1/statuses/{statusId}/context')
+			for s in itertools.chain(context['ancestors'], [obj], context['descendants']):
+				yield self._api_status_to_item(s, domain)
+
 	@classmethod
 	def _cli_setup_parser(cls, subparser):
+		subparser.add_argument('--api', action = 'store_true', default = False, help = 'Use the REST API, falling back to the HTML page if it is not available')
 		subparser.add_argument('--thread', action = 'store_true', help = 'Collect thread around the toot referenced by the URL')
 		subparser.add_argument('url', type = snscrape.base.nonempty_string('url'), help = 'A URL for a toot')
 
 	@classmethod
 	def _cli_from_args(cls, args):
-		return cls._cli_construct(args, args.url, mode = MastodonTootScraperMode._cli_from_args(args))
+		return cls._cli_construct(args, args.url, mode = MastodonTootScraperMode._cli_from_args(args), api = args.api, rateLimits = _RateLimitStore._cli_default())
@@ -1,9 +1,11 @@
 __all__ = ['Submission', 'Comment', 'RedditUserScraper', 'RedditSubredditScraper', 'RedditSearchScraper', 'RedditSubmissionScraper']
 
 
+import concurrent.futures
 import dataclasses
 import datetime
 import logging
+import math
 import re
 import snscrape.base
 import snscrape.version
@@ -13,6 +15,7 @@ import typing
 
 
 _logger = logging.getLogger(__name__)
+_API_READ_AHEAD = 2000 # Items, i.e. two pages of search results
 
 
 # Most of these fields should never be None, but due to broken data, they sometimes are anyway...
@@ -50,35 +53,20 @@ class Comment(snscrape.base.Item):
 		return self.url
 
 
-def _cmp_id(id1, id2):
-	'''Compare two Reddit IDs. Returns -1 if id1 is less than id2, 0 if they are equal, and 1 if id1 is greater than id2.
-
-	id1 and id2 may have prefixes like t1_, but if included, they must be present on both and equal.'''
-
-	if id1.startswith('t') and '_' in id1:
-		prefix, id1 = id1.split('_', 1)
-		if not id2.startswith(f'{prefix}_'):
-			raise ValueError('id2 must have the same prefix as id1')
-		_, id2 = id2.split('_', 1)
-	if id1.strip(string.ascii_lowercase + string.digits) != '':
-		raise ValueError('invalid characters in id1')
-	if id2.strip(string.ascii_lowercase + string.digits) != '':
-		raise ValueError('invalid characters in id2')
-	if len(id1) < len(id2):
-		return -1
-	if len(id1) > len(id2):
-		return 1
-	if id1 < id2:
-		return -1
-	if id1 > id2:
-		return 1
-	return 0
-
-
 class _RedditPushshiftScraper(snscrape.base.Scraper):
-	def __init__(self, **kwargs):
+	def __init__(self, *, dedupFilter = None, **kwargs):
 		super().__init__(**kwargs)
 		self._headers = {'User-Agent': f'snscrape/{snscrape.version.__version__}'}
+		self._dedupFilter = dedupFilter
+
+	def _filter_seen(self, items):
+		# Skip items already recorded by the caller-supplied filter, e.g. a persistent one from previous runs
+		if self._dedupFilter is None:
+			yield from items
+			return
+		for item in items:
+			if self._dedupFilter.add(item.id):
+				yield item
 
 	def _handle_rate_limiting(self, r):
 		if r.status_code == 429:
@@ -95,6 +83,11 @@ class _RedditPushshiftScraper(snscrape.base.Scraper):
 			raise snscrape.base.ScraperException(f'Got status code {r.status_code}')
 		return r.json()
 
+	@staticmethod
+	def _api_obj_id(d):
+		# Integer ID for skipping items already yielded at a page boundary, the same in the sequential and sharded retrieval
+		return int(d['id'], 36)
+
 	def _api_obj_to_item(self, d):
 		cls = Submission if 'title' in d else Comment
 
@@ -135,22 +128,28 @@ class _RedditPushshiftScraper(snscrape.base.Scraper):
 
 
 class _RedditPushshiftSearchScraper(_RedditPushshiftScraper):
-	def __init__(self, name, *, submissions = True, comments = True, before = None, after = None, **kwargs):
+	def __init__(self, name, *, submissions = True, comments = True, before = None, after = None, workers = 1, **kwargs):
 		super().__init__(**kwargs)
 		self._name = name
 		self._submissions = submissions
 		self._comments = comments
 		self._before = before
 		self._after = after
+		self._workers = workers
 
 		if not type(self)._validationFunc(self._name):
 			raise ValueError(f'invalid {type(self).name.split("-", 1)[1]} name')
 		if not self._submissions and not self._comments:
 			raise ValueError('At least one of submissions and comments must be True')
+		if self._workers < 1:
+			raise ValueError('workers must be positive')
 
 	def _iter_api(self, url, params = None):
-		'''Iterate through the Pushshift API using the 'before' parameter and yield the items.'''
-		lowestIdSeen = None
+		'''Iterate through the Pushshift API using the 'before' parameter and yield the items.
+
+		Since 'before' has a granularity of seconds, each page after the first starts with the last second of the previous one again. The items from that second which were already yielded are skipped by their ID.'''
+		boundary = None # Creation time of the oldest items yielded so far
+		boundaryIds = set() # Integer IDs of the items yielded with that creation time
 		if params is None:
 			params = {}
 		if self._before is not None:
@@ -159,24 +158,112 @@ class _RedditPushshiftSearchScraper(_RedditPushshiftScraper):
 			params['after'] = self._after
 		params['sort'] = 'desc'
 		while True:
-			obj = self._get_api(url, params = params)
-			if not obj['data'] or (lowestIdSeen is not None and all(_cmp_id(d['id'], lowestIdSeen) >= 0 for d in obj['data'])): # end of pagination
+			data = self._get_api(url, params = params)['data']
+			if not data:
+				break
+			yielded = False
+			for d in data:
+				id_ = self._api_obj_id(d)
+				if d['created_utc'] == boundary and id_ in boundaryIds:
+					continue
+				yield self._api_obj_to_item(d)
+				yielded = True
+				if d['created_utc'] != boundary:
+					boundary = d['created_utc']
+					boundaryIds = set()
+				boundaryIds.add(id_)
+			if yielded:
+				params['before'] = boundary + 1
+			elif 'size' in params and len(data) >= int(params['size']):
+				# A full page of nothing new: the boundary second has more items than fit on a page, and the rest of them cannot be retrieved
+				_logger.warning(f'More than {params["size"]} results at {boundary}, some may be missing')
+				params['before'] = boundary
+			else: # end of pagination
 				break
-			for d in obj['data']:
-				if lowestIdSeen is None or _cmp_id(d['id'], lowestIdSeen) == -1:
-					yield self._api_obj_to_item(d)
-					lowestIdSeen = d['id']
-			params['before'] = obj["data"][-1]["created_utc"] + 1
+
+	def _iter_api_sharded(self, url, params):
+		'''Like _iter_api, but split the time range into windows that are retrieved concurrently.
+
+		The first window covers the whole range. Whenever a window's page is full, the rest of that window is split into up to self._workers windows, sized by the item density observed on the page such that each is expected to fit on one page.
+		The windows' items are yielded in depth-first order, i.e. newest first. Windows are submitted lazily in that order, with at most self._workers of them retrieved or holding a page that has not been yielded yet.
+		Without an after bound, the lower end of the range is the creation time of the oldest item, retrieved with an ascending query in parallel to the first window.'''
+
+		size = int(params['size'])
+		before = self._before if self._before is not None else int(time.time()) + 1
+		with concurrent.futures.ThreadPoolExecutor(max_workers = self._workers) as executor:
+			def submit(after, before):
+				windowParams = params.copy()
+				if after is not None:
+					windowParams['after'] = after
+				windowParams['before'] = before
+				windowParams['sort'] = 'desc'
+				return executor.submit(self._get_api, url, params = windowParams)
+
+			if self._after is not None:
+				lowerFuture = None
+				after = self._after
+			else:
+				lowerFuture = executor.submit(self._get_api, url, params = {**params, 'before': before, 'sort': 'asc', 'size': '1'})
+				after = None
+			stack = [[None, after, before, frozenset()]] # Windows as [future or None if not submitted yet, after, before, IDs to skip], the next to yield at the end
+			inFlight = 0
+			try:
+				while stack:
+					# The window popped last was consumed, so there is a free slot for the one at the top at least
+					for window in reversed(stack[-self._workers:]):
+						if inFlight >= self._workers:
+							break
+						if window[0] is None:
+							window[0] = submit(window[1], window[2])
+							inFlight += 1
+					future, after, before, skipIds = stack.pop()
+					data = future.result()['data']
+					inFlight -= 1
+					for d in data:
+						if self._api_obj_id(d) not in skipIds:
+							yield self._api_obj_to_item(d)
+					if len(data) < size:
+						continue
+
+					# The page is full; the rest of the window is the inclusive range of seconds from lowest to boundary.
+					# The boundary second may have more items than those on this page, so it is retrieved again, skipping the ones already yielded.
+					boundary = data[-1]['created_utc']
+					boundaryIds = frozenset(self._api_obj_id(d) for d in data if d['created_utc'] == boundary)
+					if after is None:
+						lowerData = lowerFuture.result()['data']
+						if not lowerData:
+							continue
+						after = lowerData[0]['created_utc'] - 1
+					lowest = after + 1
+					if boundary == data[0]['created_utc']:
+						_logger.warning(f'More than {size} results at {boundary}, some may be missing')
+						boundary -= 1
+						boundaryIds = frozenset()
+					if boundary < lowest:
+						continue
+					density = len(data) / (before - boundary)
+					count = max(1, min(self._workers, math.ceil((boundary - lowest + 1) * density / size), boundary - lowest + 1))
+					edges = [boundary + 1 - (boundary - lowest + 1) * i // count for i in range(count + 1)]
+					_logger.debug(f'Splitting {lowest} to {boundary} into {count} windows')
+					children = [[None, lo - 1, hi, boundaryIds if i == 0 else frozenset()] for i, (hi, lo) in enumerate(zip(edges, edges[1:]))]
+					stack.extend(reversed(children))
+			finally:
+				for future, *_ in stack:
+					if future is not None:
+						future.cancel()
 
 	def _iter_api_submissions_and_comments(self, params: dict):
 		# Retrieve both submissions and comments, interleave the results to get a reverse-chronological order
+		# Both streams are retrieved concurrently in background threads, each buffering up to two pages ahead of the merge below.
+		# They are stopped when this generator is closed and drops its references to them.
 		params['size'] = '1000'
+		iterApi = self._iter_api_sharded if self._workers > 1 else self._iter_api
 		if self._submissions:
-			submissionsIter = self._iter_api('https://api.pushshift.io/reddit/search/submission/', params.copy()) # Pass copies to prevent the two iterators from messing each other up by using the same dict
+			submissionsIter = snscrape.base._iter_in_background(iterApi('https://api.pushshift.io/reddit/search/submission/', params.copy()), _API_READ_AHEAD) # Pass copies to prevent the two iterators from messing each other up by using the same dict
 		else:
 			submissionsIter = iter(())
 		if self._comments:
-			commentsIter = self._iter_api('https://api.pushshift.io/reddit/search/comment/', params.copy())
+			commentsIter = snscrape.base._iter_in_background(iterApi('https://api.pushshift.io/reddit/search/comment/', params.copy()), _API_READ_AHEAD)
 		else:
 			commentsIter = iter(())
 
@@ -215,7 +302,7 @@ class _RedditPushshiftSearchScraper(_RedditPushshiftScraper):
 					break
 
 	def get_items(self):
-		yield from self._iter_api_submissions_and_comments({type(self)._apiField: self._name})
+		yield from self._filter_seen(self._iter_api_submissions_and_comments({type(self)._apiField: self._name}))
 
 	@classmethod
 	def _cli_setup_parser(cls, subparser):
@@ -223,13 +310,14 @@ class _RedditPushshiftSearchScraper(_RedditPushshiftScraper):
 		subparser.add_argument('--no-comments', dest = 'noComments', action = 'store_true', default = False, help = 'Don\'t list comments')
 		subparser.add_argument('--before', metavar = 'TIMESTAMP', type = int, help = 'Fetch results before a Unix timestamp')
 		subparser.add_argument('--after', metavar = 'TIMESTAMP', type = int, help = 'Fetch results after a Unix timestamp')
+		subparser.add_argument('--workers', type = int, default = 1, help = 'Split the time range into windows and retrieve up to this many of them concurrently, separately for submissions and comments')
 		name = cls.name.split('-', 1)[1]
 		subparser.add_argument(name, type = snscrape.base.nonempty_string(name))
 
 	@classmethod
 	def _cli_from_args(cls, args):
 		name = cls.name.split('-', 1)[1]
-		return cls._cli_construct(args, getattr(args, name), submissions = not args.noSubmissions, comments = not args.noComments, before = args.before, after = args.after)
+		return cls._cli_construct(args, getattr(args, name), submissions = not args.noSubmissions, comments = not args.noComments, before = args.before, after = args.after, workers = args.workers)
 
 
 class RedditUserScraper(_RedditPushshiftSearchScraper):
@@ -251,13 +339,22 @@ class RedditSearchScraper(_RedditPushshiftSearchScraper):
 
 
 class RedditSubmissionScraper(_RedditPushshiftScraper):
+	'''Retrieve a submission and its comments
+
+	The comments are retrieved in batches of 500, up to workers batches concurrently. By default, they are yielded in the order returned by Pushshift.
+	With treeOrder, each comment is only yielded after its parent, as soon as that has been yielded; comments whose parent is missing are yielded at the end, again followed by their replies.'''
+
 	name = 'reddit-submission'
 
-	def __init__(self, submissionId, **kwargs):
+	def __init__(self, submissionId, *, workers = 1, treeOrder = False, **kwargs):
 		if (submissionId[3:] if submissionId.startswith('t3_') else submissionId).strip(string.ascii_lowercase + string.digits) != '':
 			raise ValueError('invalid submissionId')
+		if workers < 1:
+			raise ValueError('workers must be positive')
 		super().__init__(**kwargs)
 		self._submissionId = submissionId
+		self._workers = workers
+		self._treeOrder = treeOrder
 
 	def get_items(self):
 		obj = self._get_api(f'https://api.pushshift.io/reddit/search/submission/?ids={self._submissionId}')
@@ -265,21 +362,56 @@ class RedditSubmissionScraper(_RedditPushshiftScraper):
 			return
 		if len(obj['data']) != 1:
 			raise snscrape.base.ScraperException(f'Got {len(obj["data"])} results instead of 1')
-		yield self._api_obj_to_item(obj['data'][0])
+		submission = self._api_obj_to_item(obj['data'][0])
+		yield from self._filter_seen([submission])
 
 		obj = self._get_api(f'https://api.pushshift.io/reddit/submission/comment_ids/{self._submissionId}')
 		if not obj['data']:
 			return
 		commentIds = obj['data']
-		for i in range(0, len(commentIds), 500):
-			ids = commentIds[i : i + 500]
-			obj = self._get_api(f'https://api.pushshift.io/reddit/comment/search?ids={",".join(ids)}')
-			yield from map(self._api_obj_to_item, obj['data'])
+		batches = (commentIds[i : i + 500] for i in range(0, len(commentIds), 500))
+		comments = (comment for batch in snscrape.base._map_ordered(self._get_comments, batches, self._workers) for comment in batch)
+		if self._treeOrder:
+			comments = _iter_tree_order(submission.id, comments)
+		yield from self._filter_seen(comments)
+
+	def _get_comments(self, ids):
+		obj = self._get_api(f'https://api.pushshift.io/reddit/comment/search?ids={",".join(ids)}')
+		return list(map(self._api_obj_to_item, obj['data']))
 
 	@classmethod
 	def _cli_setup_parser(cls, subparser):
+		subparser.add_argument('--workers', type = int, default = 1, help = 'Retrieve up to this many batches of comments concurrently')
+		subparser.add_argument('--tree-order', dest = 'treeOrder', action = 'store_true', default = False, help = 'Output each comment after its parent')
 		subparser.add_argument('submissionId', type = snscrape.base.nonempty_string('submissionId'))
 
 	@classmethod
 	def _cli_from_args(cls, args):
-		return cls._cli_construct(args, args.submissionId)
+		return cls._cli_construct(args, args.submissionId, workers = args.workers, treeOrder = args.treeOrder)
+
+
+def _iter_tree_order(rootId, comments):
+	'''Yield comments such that each comes after its parent, holding back those whose parent has not been yielded yet. Comments whose parent never appears are yielded at the end, in the order in which those parents were first referenced.'''
+
+	yielded = {rootId}
+	waiting = {} # parentId -> list of comments
+	def release(comment):
+		stack = [comment]
+		while stack:
+			comment = stack.pop()
+			yield comment
+			yielded.add(comment.id)
+			stack.extend(reversed(waiting.pop(comment.id, ())))
+
+	for comment in comments:
+		if comment.parentId in yielded:
+			yield from release(comment)
+		else:
+			waiting.setdefault(comment.parentId, []).append(comment)
+
+	waitingIds = {comment.id for children in waiting.values() for comment in children}
+	for parentId in [parentId for parentId in waiting if parentId not in waitingIds]:
+		if parentId is not None:
+			_logger.warning(f'Parent {parentId} of {len(waiting[parentId])} comments not found')
+		for comment in waiting.pop(parentId):
+			yield from release(comment)
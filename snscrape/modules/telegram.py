@@ -1,11 +1,20 @@
-__all__ = ['LinkPreview', 'TelegramPost', 'Channel', 'TelegramChannelScraper']
+__all__ = ['LinkPreview', 'TelegramPost', 'Channel', 'MessageIdGap', 'TelegramChannelScraper', 'TelegramChannelsScraper', 'TelegramPostScraper', 'TelegramGapScraper']
 
+import abc
 import bs4
+import concurrent.futures
+import contextlib
+import copy
 import dataclasses
 import datetime
+import functools
+import json
 import logging
 import re
+import sqlite3
 
+import lxml.etree
+import lxml.html
 import markdownify
 
 import snscrape.base
@@ -15,6 +24,9 @@ import urllib.parse
 _logger = logging.getLogger(__name__)
 _SINGLE_MEDIA_LINK_PATTERN = re.compile(r'^https://t\.me/[^/]+/\d+\?single$')
 _STYLE_MEDIA_URL_PATTERN = re.compile(r'url\(\'(.*?)\'\)')
+_BACKFILL_RANGE_SIZE = 1000
+_POST_REFERENCE_PATTERN = re.compile(r'^(?:(?:https?://)?t\.me/(?:s/)?)?([A-Za-z0-9_]+)/(\d+)/?(?:[?#].*)?$')
+_HYDRATION_WINDOW_SIZE = 20
 
 
 @dataclasses.dataclass
@@ -74,6 +86,15 @@ class TelegramPost(snscrape.base.Item):
         return self.url
 
 
+@dataclasses.dataclass
+class MessageIdGap:
+    '''A run of message IDs missing from an archive, split into the IDs of posts found when it was filled and the IDs without a post'''
+    first: int
+    last: int
+    recovered: typing.List[int]
+    deleted: typing.List[int]
+
+
 class Medium:
     pass
 
@@ -103,17 +124,717 @@ class Gif(Medium):
     url: typing.Optional[str] = None
 
 
-class TelegramChannelScraper(snscrape.base.Scraper):
-    name = 'telegram-channel'
+class _UnsupportedMarkup(Exception):
+    pass
+
+
+_MD_NEWLINE_WHITESPACE = re.compile(r'[\t \r\n]*[\r\n][\t \r\n]*')
+_MD_WHITESPACE = re.compile(r'[\t ]+')
+_MD_EXTRACT_NEWLINES = re.compile(r'^(\n*)((?:.*[^\n])?)(\n*)$', flags=re.DOTALL)
+_MD_LINE_WITH_CONTENT = re.compile(r'^(.*)', flags=re.MULTILINE)
+_MD_PRE_LSTRIP = re.compile(r'^[ \n]*\n')
+_MD_PRE_RSTRIP = re.compile(r'[ \n]*$')
+_MD_BACKTICK_RUNS = re.compile(r'`+')
+_MD_INLINE_MARKUP = {'b': '**', 'strong': '**', 'i': '*', 'em': '*', 's': '~~', 'del': '~~'}
+_MD_PASSTHROUGH_TAGS = {'u', 'ins', 'span', 'tg-spoiler', 'tg-emoji'}
+_MD_BLOCK_TAGS = {'div', 'p', 'blockquote'}  # Whitespace inside and around these is dropped, around pre as well
+_MD_SUPPORTED_TAGS = _MD_INLINE_MARKUP.keys() | _MD_PASSTHROUGH_TAGS | _MD_BLOCK_TAGS | {'a', 'br', 'code', 'pre'}
+
+
+def _md_chomp(text):
+    prefix = ' ' if text and text[0] == ' ' else ''
+    suffix = ' ' if text and text[-1] == ' ' else ''
+    return prefix, suffix, text.strip()
+
+
+class _MarkdownConverter:
+    '''Converts a post's text div to Markdown directly on the parsed tree
+
+    The output is that of markdownify.markdownify(html, heading_style='ATX') (as of markdownify 1.2) on the serialised div, with the tree walked once instead of serialising and re-parsing it.
+    Only the markup occurring in Telegram posts is handled natively; anything else is converted by markdownify.
+    Subclasses adapt this to a tree implementation by providing _tag, _get, _children, and _serialise.'''
+
+    def markdown(self, message):
+        try:
+            return self._process_tag(message, self._tag(message), False, False).strip('\n')
+        except _UnsupportedMarkup as e:
+            _logger.debug(f'Converting post text with markdownify due to unsupported markup: {e}')
+            return markdownify.markdownify(self._serialise(message), heading_style="ATX")
+
+    def _is_block_outside(self, node):
+        return node is not None and not isinstance(node, str) and (self._tag(node) in _MD_BLOCK_TAGS or self._tag(node) == 'pre')
+
+    def _process_tag(self, node, name, inPre, noFormat):
+        if name not in _MD_SUPPORTED_TAGS:
+            raise _UnsupportedMarkup(f'<{name}>')
+        removeInside = name in _MD_BLOCK_TAGS
+        childInPre = inPre or name == 'pre'
+        childNoFormat = noFormat or name in ('pre', 'code')
+        children = list(self._children(node))
+        strings = []
+        for i, child in enumerate(children):
+            prev = children[i - 1] if i > 0 else None
+            next_ = children[i + 1] if i + 1 < len(children) else None
+            if isinstance(child, str):
+                if child.strip() == '' and (
+                        (removeInside and (prev is None or next_ is None)) or self._is_block_outside(prev) or self._is_block_outside(next_)):
+                    continue
+                s = self._process_text(child, prev, next_, removeInside, childInPre, childNoFormat)
+            else:
+                s = self._process_tag(child, self._tag(child), childInPre, childNoFormat)
+            if s:
+                strings.append(s)
+
+        if not childInPre:
+            # Collapse newlines at child boundaries
+            collapsed = ['']
+            for s in strings:
+                leading, content, trailing = _MD_EXTRACT_NEWLINES.match(s).groups()
+                if collapsed[-1] and leading:
+                    leading = '\n' * min(2, max(len(collapsed.pop()), len(leading)))
+                collapsed.extend((leading, content, trailing))
+            strings = collapsed
+        return self._convert_tag(node, name, ''.join(strings), noFormat)
+
+    def _process_text(self, text, prev, next_, parentIsBlock, inPre, noFormat):
+        if not inPre:
+            text = _MD_WHITESPACE.sub(' ', _MD_NEWLINE_WHITESPACE.sub('\n', text))
+        if not noFormat:
+            text = text.replace('*', r'\*').replace('_', r'\_')
+        if self._is_block_outside(prev) or (parentIsBlock and prev is None):
+            text = text.lstrip(' \t\r\n')
+        if self._is_block_outside(next_) or (parentIsBlock and next_ is None):
+            text = text.rstrip()
+        return text
+
+    def _convert_tag(self, node, name, text, noFormat):
+        if name in _MD_INLINE_MARKUP:
+            if noFormat:
+                return text
+            prefix, suffix, text = _md_chomp(text)
+            if not text:
+                return ''
+            markup = _MD_INLINE_MARKUP[name]
+            return f'{prefix}{markup}{text}{markup}{suffix}'
+        if name == 'a':
+            if noFormat:
+                return text
+            prefix, suffix, text = _md_chomp(text)
+            if not text:
+                return ''
+            href = self._get(node, 'href')
+            title = self._get(node, 'title')
+            if text.replace(r'\_', '_') == href and not title:
+                return f'<{href}>'
+            titlePart = ' "{}"'.format(title.replace('"', r'\"')) if title else ''
+            return f'{prefix}[{text}]({href}{titlePart}){suffix}' if href else text
+        if name == 'br':
+            return '  \n' + text
+        if name == 'code':
+            if noFormat:
+                return text
+            prefix, suffix, text = _md_chomp(text)
+            if not text:
+                return ''
+            maxBackticks = max((len(run) for run in _MD_BACKTICK_RUNS.findall(text)), default=0)
+            delimiter = '`' * (maxBackticks + 1)
+            if maxBackticks > 0:
+                text = f' {text} '
+            return f'{prefix}{delimiter}{text}{delimiter}{suffix}'
+        if name == 'pre':
+            if not text:
+                return ''
+            text = _MD_PRE_RSTRIP.sub('', _MD_PRE_LSTRIP.sub('', text))
+            return f'\n\n```\n{text}\n```\n\n'
+        if name == 'blockquote':
+            text = text.strip(' \t\r\n')
+            if not text:
+                return '\n'
+            text = _MD_LINE_WITH_CONTENT.sub(lambda m: '> ' + m.group(1) if m.group(1) else '>', text)
+            return f'\n{text}\n\n'
+        if name == 'p':
+            text = text.strip(' \t\r\n')
+            return f'\n\n{text}\n\n' if text else ''
+        if name == 'div':
+            text = text.strip()
+            return f'\n\n{text}\n\n' if text else ''
+        return text
+
+
+class _Bs4MarkdownConverter(_MarkdownConverter):
+    @staticmethod
+    def _tag(node):
+        return node.name
+
+    @staticmethod
+    def _get(node, attr):
+        return node.get(attr)
+
+    @staticmethod
+    def _children(node):
+        for child in node.children:
+            if isinstance(child, bs4.element.Tag):
+                yield child
+            elif type(child) is bs4.element.NavigableString:
+                if child:
+                    yield str(child)
+            else:
+                raise _UnsupportedMarkup(type(child).__name__)
+
+    @staticmethod
+    def _serialise(node):
+        return str(node)
+
+
+class _LxmlMarkdownConverter(_MarkdownConverter):
+    @staticmethod
+    def _tag(node):
+        return node.tag
+
+    @staticmethod
+    def _get(node, attr):
+        return node.get(attr)
+
+    @staticmethod
+    def _children(node):
+        if node.text:
+            yield node.text
+        for child in node:
+            if not isinstance(child.tag, str):
+                raise _UnsupportedMarkup(repr(child))
+            yield child
+            if child.tail:
+                yield child.tail
+
+    @staticmethod
+    def _serialise(node):
+        return lxml.html.tostring(node, encoding='unicode', with_tail=False)
+
+
+_bs4MarkdownConverter = _Bs4MarkdownConverter()
+_lxmlMarkdownConverter = _LxmlMarkdownConverter()
+
+
+class _PageParser(abc.ABC):
+    '''A parser backend for /s/ channel pages.
+
+    parse turns a response into a document, which the other methods then extract posts and pagination links from.
+    If stream is true, the page is requested with a streamed response body.'''
+
+    stream = False
+
+    @abc.abstractmethod
+    def parse(self, r):
+        pass
+
+    @abc.abstractmethod
+    def page_to_items(self, scraper, doc, pageUrl):
+        pass
+
+    @abc.abstractmethod
+    def first_post_href(self, doc):
+        pass
+
+    @abc.abstractmethod
+    def older_page_href(self, doc):
+        pass
+
+    @abc.abstractmethod
+    def canonical_href(self, doc):
+        pass
+
+
+class _Bs4PageParser(_PageParser):
+    '''The reference backend, BeautifulSoup over the decoded page text'''
+
+    def parse(self, r):
+        return bs4.BeautifulSoup(r.text, 'lxml')
+
+    def page_to_items(self, scraper, doc, pageUrl):
+        return scraper._soup_to_items(doc, pageUrl)
+
+    def first_post_href(self, doc):
+        if (a := doc.find('a', attrs={'class': 'tgme_widget_message_date'}, href=True)):
+            return a['href']
+        return None
+
+    def older_page_href(self, doc):
+        if (a := doc.find('a', attrs={'class': 'tme_messages_more', 'data-before': True})):
+            return a['href']
+        return None
+
+    def canonical_href(self, doc):
+        return doc.find('link', attrs={'rel': 'canonical'}, href=True)['href']
+
+
+def _xpath_has_class(className):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {className} ')"
+
+
+def _xpath_first(tag, className, extra=''):
+    return lxml.etree.XPath(f'(.//{tag}[{_xpath_has_class(className)}{extra}])[1]')
+
+
+class _LxmlPageParser(_PageParser):
+    '''A backend using lxml directly on the raw response bytes with XPath expressions compiled once
+
+    It produces the same items as the BeautifulSoup backend, except that the html post format is serialised by lxml (e.g. <br> instead of <br/>).'''
+
+    _posts = lxml.etree.XPath(f"//div[{_xpath_has_class('tgme_widget_message')} and @data-post]")
+    _firstPostHref = lxml.etree.XPath(f"(//a[{_xpath_has_class('tgme_widget_message_date')} and @href])[1]/@href")
+    _olderPageHref = lxml.etree.XPath(f"(//a[{_xpath_has_class('tme_messages_more')} and @data-before])[1]/@href")
+    _canonicalHref = lxml.etree.XPath("(//link[contains(concat(' ', normalize-space(@rel), ' '), ' canonical ') and @href])[1]/@href")
+    _date = _xpath_first('a', 'tgme_widget_message_date')
+
+    def parse(self, r):
+        return lxml.html.document_fromstring(r.content, parser=_lxml_html_parser(r.encoding))
+
+    def page_to_items(self, scraper, doc, pageUrl):
+        for post in reversed(self._posts(doc)):
+            yield self._post_to_item(scraper, post, pageUrl)
+
+    def first_post_href(self, doc):
+        return next(iter(self._firstPostHref(doc)), None)
+
+    def older_page_href(self, doc):
+        return next(iter(self._olderPageHref(doc)), None)
+
+    def canonical_href(self, doc):
+        return self._canonicalHref(doc)[0]
+
+    def _post_to_item(self, scraper, post, pageUrl):
+        return _post_to_item(_LxmlPostNodes(post), scraper._format, pageUrl)
+
+
+class _StreamedPage:
+    '''A /s/ page which is parsed incrementally as its response body is consumed
+
+    The navigation links precede the posts, so they are all known once the first post has been parsed. Pagination needs them before the items are extracted; the first post is read ahead for that and kept as a copy, no other post is.'''
+
+    def __init__(self, parser, r):
+        self._parser = parser
+        self._elements = snscrape.base._iter_html_elements(r, parser._is_page_element)
+        self._headRead = False
+        self._firstPost = None
+        self.firstPostHref = None
+        self.olderPageHref = None
+        self.canonicalHref = None
+
+    def _next_post(self):
+        for element in self._elements:
+            if element.tag == 'div':
+                if self.firstPostHref is None and (dateA := next(iter(self._parser._date(element)), None)) is not None:
+                    self.firstPostHref = dateA.get('href')
+                return element
+            if element.tag == 'a':
+                if self.olderPageHref is None:
+                    self.olderPageHref = element.attrib['href']
+            elif self.canonicalHref is None:
+                self.canonicalHref = element.attrib['href']
+        return None
+
+    def read_head(self):
+        '''Read up to and including the first post'''
+        if not self._headRead:
+            self._headRead = True
+            if (post := self._next_post()) is not None:
+                self._firstPost = copy.deepcopy(post)
+
+    def posts(self):
+        self.read_head()
+        if self._firstPost is not None:
+            yield self._firstPost
+            self._firstPost = None
+        while (post := self._next_post()) is not None:
+            yield post
+
+
+class _StreamingPageParser(_LxmlPageParser):
+    '''The lxml backend over a pull parser fed from the streamed response
+
+    Each post is converted as soon as its end tag has been received and then discarded, so the parse tree never holds more than one post and the navigation links.
+    Posts appear oldest first on a page but are yielded newest first, so the first item of a page is only yielded once the whole page has been received; until then, its items are collected.
+    Where the link to the older page is missing, it is derived from the ID of the first post on the page, which is the oldest one.'''
+
+    stream = True
+
+    @staticmethod
+    def _is_page_element(element):
+        classes = element.get('class', '').split()
+        if element.tag == 'div':
+            return 'tgme_widget_message' in classes and element.get('data-post') is not None
+        if element.tag == 'a':
+            return 'tme_messages_more' in classes and element.get('data-before') is not None and element.get('href') is not None
+        if element.tag == 'link':
+            return 'canonical' in element.get('rel', '').split() and element.get('href') is not None
+        return False
+
+    def parse(self, r):
+        return _StreamedPage(self, r)
+
+    def page_to_items(self, scraper, doc, pageUrl):
+        items = [self._post_to_item(scraper, post, pageUrl) for post in doc.posts()]
+        yield from reversed(items)
+
+    def first_post_href(self, doc):
+        doc.read_head()
+        return doc.firstPostHref
+
+    def older_page_href(self, doc):
+        doc.read_head()
+        if doc.olderPageHref is None and doc.firstPostHref is not None:
+            return f'?before={doc.firstPostHref.split("/")[-1]}'
+        return doc.olderPageHref
+
+    def canonical_href(self, doc):
+        doc.read_head()
+        return doc.canonicalHref
+
+
+class _PostNodes(abc.ABC):
+    '''The nodes of a post which items are extracted from, as collected by a parser backend, and how to read them
+
+    date is the date link in the footer and time its first time element with a datetime. forwardedFrom, message, linkPreview, and views are the first such node in the post or None.
+    links are all links of the post in document order. voicePlayers and videoPlayers are _Player objects with the first nodes of each kind within the player; linkPreviewParts is a _LinkPreview when there is a linkPreview.
+    _post_to_item only reads the nodes through the methods here, so the extraction is shared by the backends.'''
+
+    class _Player:
+        def __init__(self):
+            self.audio = None
+            self.i = None
+            self.video = None
+            self.time = None
+            self.bar = None
+            self.bars = []
+
+    class _LinkPreview:
+        def __init__(self):
+            self.siteName = None
+            self.title = None
+            self.description = None
+            self.image = None
+
+    @staticmethod
+    def get(node, attr, default=None):
+        return node.get(attr, default)
+
+    @staticmethod
+    def attr(node, attr):
+        if (value := node.get(attr)) is None:
+            raise KeyError(attr)
+        return value
+
+    @staticmethod
+    @abc.abstractmethod
+    def text(node):
+        pass
+
+    @staticmethod
+    @abc.abstractmethod
+    def parent_classes(node):
+        pass
+
+    @abc.abstractmethod
+    def content(self, postFormat):
+        '''The message in the post format; only called if there is a message'''
+        pass
+
+
+class _Bs4PostNodes(_PostNodes):
+    '''The nodes collected in a single traversal of a BeautifulSoup post subtree
+
+    Where the extraction needs the first matching node (in document order) within the post or within a container such as a video player, that is what is recorded here.'''
+
+    def __init__(self, post):
+        self.links = []
+        self.footer = None
+        self.date = None
+        self.time = None
+        self.forwardedFrom = None
+        self.message = None
+        self.voicePlayers = []
+        self.videoPlayers = []
+        self.linkPreview = None
+        self.linkPreviewParts = None
+        self.views = None
+        self._visit(post, None, None)
+
+    def _visit(self, tag, container, player):
+        # container is the innermost element that nodes are looked up in: the footer, the date link, a player, a voice player's bar, or the link preview.
+        # player is the voice or video player the tag is in, if any.
+        for node in tag.contents:
+            if not isinstance(node, bs4.element.Tag):
+                continue
+            name = node.name
+            classes = node.get('class', ())
+            inner = container
+            innerPlayer = player
+            if name == 'a':
+                self.links.append(node)
+                if self.forwardedFrom is None and 'tgme_widget_message_forwarded_from_name' in classes:
+                    self.forwardedFrom = node
+                if 'tgme_widget_message_voice_player' in classes:
+                    inner = innerPlayer = _PostNodes._Player()
+                    self.voicePlayers.append(innerPlayer)
+                elif 'tgme_widget_message_video_player' in classes:
+                    inner = innerPlayer = _PostNodes._Player()
+                    self.videoPlayers.append(innerPlayer)
+                elif self.linkPreview is None and 'tgme_widget_message_link_preview' in classes:
+                    self.linkPreview = node
+                    inner = self.linkPreviewParts = _PostNodes._LinkPreview()
+                elif self.date is None and container is not None and container is self.footer and 'tgme_widget_message_date' in classes:
+                    self.date = inner = node
+            elif name == 'div':
+                if self.message is None and 'tgme_widget_message_text' in classes:
+                    self.message = node
+                if isinstance(container, _PostNodes._LinkPreview):
+                    if container.siteName is None and 'link_preview_site_name' in classes:
+                        container.siteName = node
+                    if container.title is None and 'link_preview_title' in classes:
+                        container.title = node
+                    if container.description is None and 'link_preview_description' in classes:
+                        container.description = node
+                if self.footer is None and 'tgme_widget_message_footer' in classes:
+                    self.footer = inner = node
+                elif player is not None and player.bar is None and 'bar' in classes:
+                    player.bar = inner = node
+            elif name == 'span':
+                if self.views is None and 'tgme_widget_message_views' in classes:
+                    self.views = node
+            elif name == 'time':
+                if player is not None and player.time is None:
+                    player.time = node
+                if self.time is None and container is not None and container is self.date and node.get('datetime') is not None:
+                    self.time = node
+            elif name == 'i':
+                if player is not None and player.i is None:
+                    player.i = node
+                if isinstance(container, _PostNodes._LinkPreview) and container.image is None and 'link_preview_image' in classes:
+                    container.image = node
+            elif name == 'audio':
+                if player is not None and player.audio is None:
+                    player.audio = node
+            elif name == 'video':
+                if player is not None and player.video is None:
+                    player.video = node
+            elif name == 's':
+                if player is not None and player.bar is not None and container is player.bar:
+                    player.bars.append(node)
+            self._visit(node, inner, innerPlayer)
+
+    @staticmethod
+    def text(node):
+        return node.text
+
+    @staticmethod
+    def parent_classes(node):
+        return node.parent.attrs.get('class', [])
+
+    def content(self, postFormat):
+        if postFormat == 'text':
+            return self.message.get_text(separator="\n")
+        if postFormat == 'html':
+            return str(self.message)
+        return _bs4MarkdownConverter.markdown(self.message)
+
+
+class _LxmlPostNodes(_PostNodes):
+    '''The nodes of an lxml post element, looked up with XPath expressions compiled once'''
+
+    _footer = _xpath_first('div', 'tgme_widget_message_footer')
+    _date = _xpath_first('a', 'tgme_widget_message_date')
+    _forwardedFromName = _xpath_first('a', 'tgme_widget_message_forwarded_from_name')
+    _text = _xpath_first('div', 'tgme_widget_message_text')
+    _voicePlayers = lxml.etree.XPath(f".//a[{_xpath_has_class('tgme_widget_message_voice_player')}]")
+    _videoPlayers = lxml.etree.XPath(f".//a[{_xpath_has_class('tgme_widget_message_video_player')}]")
+    _bar = _xpath_first('div', 'bar')
+    _linkPreview = _xpath_first('a', 'tgme_widget_message_link_preview')
+    _linkPreviewSiteName = _xpath_first('div', 'link_preview_site_name')
+    _linkPreviewTitle = _xpath_first('div', 'link_preview_title')
+    _linkPreviewDescription = _xpath_first('div', 'link_preview_description')
+    _linkPreviewImage = _xpath_first('i', 'link_preview_image')
+    _views = _xpath_first('span', 'tgme_widget_message_views')
+
+    def __init__(self, post):
+        first = self._first
+        footer = first(self._footer, post)
+        self.date = None if footer is None else first(self._date, footer)
+        self.time = None if self.date is None else next((t for t in self.date.iter('time') if t.get('datetime') is not None), None)
+        self.forwardedFrom = first(self._forwardedFromName, post)
+        self.message = first(self._text, post)
+        self.links = list(post.iter('a'))
+        self.voicePlayers = []
+        for element in self._voicePlayers(post):
+            player = self._Player()
+            player.audio = next(element.iter('audio'), None)
+            player.time = next(element.iter('time'), None)
+            player.bar = first(self._bar, element)
+            player.bars = [] if player.bar is None else list(player.bar.iter('s'))
+            self.voicePlayers.append(player)
+        self.videoPlayers = []
+        for element in self._videoPlayers(post):
+            player = self._Player()
+            player.i = next(element.iter('i'), None)
+            player.video = next(element.iter('video'), None)
+            player.time = next(element.iter('time'), None)
+            self.videoPlayers.append(player)
+        self.linkPreview = first(self._linkPreview, post)
+        self.linkPreviewParts = None
+        if self.linkPreview is not None:
+            self.linkPreviewParts = parts = self._LinkPreview()
+            parts.siteName = first(self._linkPreviewSiteName, self.linkPreview)
+            parts.title = first(self._linkPreviewTitle, self.linkPreview)
+            parts.description = first(self._linkPreviewDescription, self.linkPreview)
+            parts.image = first(self._linkPreviewImage, self.linkPreview)
+        self.views = first(self._views, post)
+
+    @staticmethod
+    def _first(xpath, el):
+        return next(iter(xpath(el)), None)
+
+    @staticmethod
+    def text(node):
+        return ''.join(node.itertext())
+
+    @staticmethod
+    def parent_classes(node):
+        return node.getparent().get('class', '').split()
+
+    def content(self, postFormat):
+        if postFormat == 'text':
+            return '\n'.join(self.message.itertext())
+        if postFormat == 'html':
+            return lxml.html.tostring(self.message, encoding='unicode', with_tail=False)
+        return _lxmlMarkdownConverter.markdown(self.message)
+
+
+def _post_to_item(nodes, postFormat, pageUrl):
+    '''Extract the TelegramPost from the _PostNodes of a post'''
+
+    rawUrl = nodes.attr(nodes.date, 'href')
+    if not rawUrl.startswith('https://t.me/') or sum(x == '/' for x in rawUrl) != 4 or rawUrl.rsplit('/', 1)[
+        1].strip('0123456789') != '':
+        _logger.warning(f'Possibly incorrect URL: {rawUrl!r}')
+    url = rawUrl.replace('//t.me/', '//t.me/s/')
+    date = datetime.datetime.strptime(
+        nodes.attr(nodes.time, 'datetime').replace('-', '', 2).replace(':', ''), '%Y%m%dT%H%M%S%z')
+    media = []
+    outlinks = {}  # Ordered set
+    mentions = []
+    hashtags = []
+    forwarded = None
+    forwardedUrl = None
+
+    if nodes.forwardedFrom is not None:
+        forwardedUrl = nodes.attr(nodes.forwardedFrom, 'href')
+        forwardedName = forwardedUrl.split('t.me/')[1].split('/')[0]
+        forwarded = Channel(username=forwardedName)
+
+    content = nodes.content(postFormat) if nodes.message is not None else None
+
+    for link in nodes.links:
+        if any(x in nodes.parent_classes(link) for x in
+               ('tgme_widget_message_user', 'tgme_widget_message_author')):
+            # Author links at the top (avatar and name)
+            continue
+        href = nodes.attr(link, 'href')
+        if href == rawUrl or href == url:
+            style = nodes.get(link, 'style', '')
+            # Generic filter of links to the post itself, catches videos, photos, and the date link
+            if style != '':
+                imageUrls = _STYLE_MEDIA_URL_PATTERN.findall(style)
+                if len(imageUrls) == 1:
+                    media.append(Photo(url=imageUrls[0]))
+                continue
+        if _SINGLE_MEDIA_LINK_PATTERN.match(href):
+            # Individual photo or video link
+            imageUrls = _STYLE_MEDIA_URL_PATTERN.findall(nodes.get(link, 'style', ''))
+            if len(imageUrls) == 1:
+                media.append(Photo(url=imageUrls[0]))
+            continue
+        linkText = nodes.text(link)
+        if linkText.startswith('@'):
+            mentions.append(linkText.strip('@'))
+            continue
+        if linkText.startswith('#'):
+            hashtags.append(linkText.strip('#'))
+            continue
+        href = urllib.parse.urljoin(pageUrl, href)
+        if (href != rawUrl) and (href != forwardedUrl):
+            outlinks[href] = None
+
+    for voicePlayer in nodes.voicePlayers:
+        audioUrl = nodes.attr(voicePlayer.audio, 'src')
+        duration = _durationStrToSeconds(nodes.text(voicePlayer.time))
+        barHeights = [float(nodes.attr(s, 'style').split(':')[-1].strip(';%')) for s in voicePlayer.bars]
+        media.append(VoiceMessage(url=audioUrl, duration=duration, bars=barHeights))
 
-    def __init__(self, name, post_format='markdown', **kwargs):
+    for videoPlayer in nodes.videoPlayers:
+        if videoPlayer.i is None:
+            videoUrl = None
+            videoThumbnailUrl = None
+        else:
+            videoThumbnailUrl = _STYLE_MEDIA_URL_PATTERN.findall(nodes.attr(videoPlayer.i, 'style'))[0]
+            videoUrl = None if videoPlayer.video is None else nodes.attr(videoPlayer.video, 'src')
+        mKwargs = {
+            'thumbnailUrl': videoThumbnailUrl,
+            'url': videoUrl,
+        }
+        if videoPlayer.time is None:
+            cls = Gif
+        else:
+            cls = Video
+            mKwargs['duration'] = _durationStrToSeconds(nodes.text(videoPlayer.time))
+        media.append(cls(**mKwargs))
+
+    linkPreview = None
+    if nodes.linkPreview is not None:
+        preview = nodes.linkPreviewParts
+        kwargs = {}
+        kwargs['href'] = urllib.parse.urljoin(pageUrl, nodes.attr(nodes.linkPreview, 'href'))
+        if preview.siteName is not None:
+            kwargs['siteName'] = nodes.text(preview.siteName)
+        if preview.title is not None:
+            kwargs['title'] = nodes.text(preview.title)
+        if preview.description is not None:
+            kwargs['description'] = nodes.text(preview.description)
+        if preview.image is not None:
+            style = nodes.attr(preview.image, 'style')
+            if style.startswith("background-image:url('"):
+                kwargs['image'] = style[22: style.index("'", 22)]
+            else:
+                _logger.warning(f'Could not process link preview image on {url}')
+        linkPreview = LinkPreview(**kwargs)
+        outlinks.pop(kwargs['href'], None)
+
+    views = None if nodes.views is None else _parse_num(nodes.text(nodes.views))
+
+    message_id = int(url.split('/')[-1].split('?')[0]) if url else 0
+    return TelegramPost(url=url, date=date, content=content, outlinks=list(outlinks) or None, mentions=mentions or None,
+                        hashtags=hashtags or None, linkPreview=linkPreview, media=media or None, forwarded=forwarded,
+                        forwardedUrl=forwardedUrl, views=views, message_id=message_id)
+
+
+@functools.lru_cache(maxsize=None)
+def _lxml_html_parser(encoding):
+    return lxml.html.HTMLParser(encoding=encoding)
+
+
+_PAGE_PARSERS = {
+    'bs4': _Bs4PageParser,
+    'lxml': _LxmlPageParser,
+    'lxml-stream': _StreamingPageParser,
+}
+
+
+class _TelegramCommonScraper(snscrape.base.Scraper):
+    def __init__(self, post_format='markdown', parser='bs4', **kwargs):
         super().__init__(**kwargs)
-        self._format = post_format
-        self._name = name
+        if parser not in _PAGE_PARSERS:
+            raise ValueError(f'unknown parser {parser!r}')
+        self._parser = _PAGE_PARSERS[parser]()
         self._headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.138 Safari/537.36'}
-        self._initialPage = None
-        self._initialPageSoup = None
         if post_format == 'html' or post_format == 'text':
             self._format = post_format
         elif post_format == 'markdown' or post_format == 'md':
@@ -123,180 +844,147 @@ class TelegramChannelScraper(snscrape.base.Scraper):
 
         assert (self._format in ('text', 'markdown', 'html'))
 
+    def _soup_to_items(self, soup, pageUrl, onlyUsername=False):
+        posts = soup.find_all('div', attrs={'class': 'tgme_widget_message', 'data-post': True})
+        for post in reversed(posts):
+            if onlyUsername:
+                yield post['data-post'].split('/')[0]
+                return
+            yield _post_to_item(_Bs4PostNodes(post), self._format, pageUrl)
+
+    def _get_page(self, url):
+        r = self._get(url, headers=self._headers, responseOkCallback=_telegramResponseOkCallback, stream=self._parser.stream)
+        if r.status_code != 200:
+            raise snscrape.base.ScraperException(f'Got status code {r.status_code}')
+        return r, self._parser.parse(r)
+
+    def _get_after_range(self, channel, lo, hi):
+        '''Retrieve the posts in channel with IDs from lo to hi (inclusive), oldest first'''
+        items = []
+        after = lo - 1
+        while True:
+            r, doc = self._get_page(f'https://t.me/s/{channel}?after={after}')
+            pageItems = list(self._parser.page_to_items(self, doc, r.url))
+            items.extend(item for item in reversed(pageItems) if after < item.message_id <= hi)
+            newestId = max((item.message_id for item in pageItems), default=None)
+            if newestId is None or newestId >= hi or newestId <= after:
+                return items
+            after = newestId
+
+
+class TelegramChannelScraper(_TelegramCommonScraper):
+    name = 'telegram-channel'
+
+    def __init__(self, name, post_format='markdown', pipeline=False, parser='bs4', backfill=0, after_id=None, before_id=None,
+                 dedup_filter=None, **kwargs):
+        super().__init__(post_format=post_format, parser=parser, **kwargs)
+        if backfill < 0:
+            raise ValueError('backfill must not be negative')
+        if after_id is not None and before_id is not None and after_id >= before_id:
+            raise ValueError('after_id must be smaller than before_id')
+        self._name = name
+        self._pipeline = pipeline
+        self._backfill = backfill
+        self._afterId = after_id
+        self._beforeId = before_id
+        self._dedupFilter = dedup_filter
+        self._initialPage = None
+        self._initialPageSoup = None
+
     def _initial_page(self, with_posts=True):
         url = f'https://t.me/s/{self._name}' if with_posts else f'https://t.me/{self._name}'
-        r = self._get(url, headers=self._headers)
+        if with_posts and self._beforeId is not None:
+            url = f'{url}?before={self._beforeId}'
+        r = self._get(url, headers=self._headers, stream=with_posts and self._parser.stream)
         if r.status_code != 200:
             raise snscrape.base.ScraperException(f'Got status code {r.status_code}')
 
-        soup =  bs4.BeautifulSoup(r.text, 'lxml')
+        soup = self._parser.parse(r)
         if with_posts and self._initialPage is None:
             self._initialPage = r
             self._initialPageSoup = soup
 
         return r, soup
 
-    def _soup_to_items(self, soup, pageUrl, onlyUsername=False):
-        posts = soup.find_all('div', attrs={'class': 'tgme_widget_message', 'data-post': True})
-        for post in reversed(posts):
-            if onlyUsername:
-                yield post['data-post'].split('/')[0]
-                return
-            dateDiv = post.find('div', class_='tgme_widget_message_footer').find('a', class_='tgme_widget_message_date')
-            rawUrl = dateDiv['href']
-            if not rawUrl.startswith('https://t.me/') or sum(x == '/' for x in rawUrl) != 4 or rawUrl.rsplit('/', 1)[
-                1].strip('0123456789') != '':
-                _logger.warning(f'Possibly incorrect URL: {rawUrl!r}')
-            url = rawUrl.replace('//t.me/', '//t.me/s/')
-            date = datetime.datetime.strptime(
-                dateDiv.find('time', datetime=True)['datetime'].replace('-', '', 2).replace(':', ''), '%Y%m%dT%H%M%S%z')
-            media = []
-            outlinks = []
-            mentions = []
-            hashtags = []
-            forwarded = None
-            forwardedUrl = None
-
-            if (forwardTag := post.find('a', class_='tgme_widget_message_forwarded_from_name')):
-                forwardedUrl = forwardTag['href']
-                forwardedName = forwardedUrl.split('t.me/')[1].split('/')[0]
-                forwarded = Channel(username=forwardedName)
-
-            if (message := post.find('div', class_='tgme_widget_message_text')):
-                if self._format == 'text':
-                    content = message.get_text(separator="\n")
-                elif self._format == 'html':
-                    content = str(message)
-                elif self._format == 'markdown':
-                    content = markdownify.markdownify(str(message), heading_style="ATX")
-            else:
-                content = None
-
-            for link in post.find_all('a'):
-                if any(x in link.parent.attrs.get('class', []) for x in
-                       ('tgme_widget_message_user', 'tgme_widget_message_author')):
-                    # Author links at the top (avatar and name)
-                    continue
-                if link['href'] == rawUrl or link['href'] == url:
-                    style = link.attrs.get('style', '')
-                    # Generic filter of links to the post itself, catches videos, photos, and the date link
-                    if style != '':
-                        imageUrls = _STYLE_MEDIA_URL_PATTERN.findall(style)
-                        if len(imageUrls) == 1:
-                            media.append(Photo(url=imageUrls[0]))
-                        continue
-                if _SINGLE_MEDIA_LINK_PATTERN.match(link['href']):
-                    style = link.attrs.get('style', '')
-                    imageUrls = _STYLE_MEDIA_URL_PATTERN.findall(style)
-                    if len(imageUrls) == 1:
-                        media.append(Photo(url=imageUrls[0]))
-                    # resp = self._get(image[0])
-                    # encoded_string = base64.b64encode(resp.content)
-                    # Individual photo or video link
-                    continue
-                if link.text.startswith('@'):
-                    mentions.append(link.text.strip('@'))
-                    continue
-                if link.text.startswith('#'):
-                    hashtags.append(link.text.strip('#'))
-                    continue
-                href = urllib.parse.urljoin(pageUrl, link['href'])
-                if (href not in outlinks) and (href != rawUrl) and (href != forwardedUrl):
-                    outlinks.append(href)
-
-            for voicePlayer in post.find_all('a', {'class': 'tgme_widget_message_voice_player'}):
-                audioUrl = voicePlayer.find('audio')['src']
-                durationStr = voicePlayer.find('time').text
-                duration = _durationStrToSeconds(durationStr)
-                barHeights = [float(s['style'].split(':')[-1].strip(';%')) for s in
-                              voicePlayer.find('div', {'class': 'bar'}).find_all('s')]
-
-                media.append(VoiceMessage(url=audioUrl, duration=duration, bars=barHeights))
-
-            for videoPlayer in post.find_all('a', {'class': 'tgme_widget_message_video_player'}):
-                iTag = videoPlayer.find('i')
-                if iTag is None:
-                    videoUrl = None
-                    videoThumbnailUrl = None
-                else:
-                    style = iTag['style']
-                    videoThumbnailUrl = _STYLE_MEDIA_URL_PATTERN.findall(style)[0]
-                    videoTag = videoPlayer.find('video')
-                    videoUrl = None if videoTag is None else videoTag['src']
-                mKwargs = {
-                    'thumbnailUrl': videoThumbnailUrl,
-                    'url': videoUrl,
-                }
-                timeTag = videoPlayer.find('time')
-                if timeTag is None:
-                    cls = Gif
-                else:
-                    cls = Video
-                    durationStr = videoPlayer.find('time').text
-                    mKwargs['duration'] = _durationStrToSeconds(durationStr)
-                media.append(cls(**mKwargs))
-
-            linkPreview = None
-            if (linkPreviewA := post.find('a', class_='tgme_widget_message_link_preview')):
-                kwargs = {}
-                kwargs['href'] = urllib.parse.urljoin(pageUrl, linkPreviewA['href'])
-                if (siteNameDiv := linkPreviewA.find('div', class_='link_preview_site_name')):
-                    kwargs['siteName'] = siteNameDiv.text
-                if (titleDiv := linkPreviewA.find('div', class_='link_preview_title')):
-                    kwargs['title'] = titleDiv.text
-                if (descriptionDiv := linkPreviewA.find('div', class_='link_preview_description')):
-                    kwargs['description'] = descriptionDiv.text
-                if (imageI := linkPreviewA.find('i', class_='link_preview_image')):
-                    if imageI['style'].startswith("background-image:url('"):
-                        kwargs['image'] = imageI['style'][22: imageI['style'].index("'", 22)]
-                    else:
-                        _logger.warning(f'Could not process link preview image on {url}')
-                linkPreview = LinkPreview(**kwargs)
-                if kwargs['href'] in outlinks:
-                    outlinks.remove(kwargs['href'])
-
-            viewsSpan = post.find('span', class_='tgme_widget_message_views')
-            views = None if viewsSpan is None else _parse_num(viewsSpan.text)
-
-            outlinks = outlinks if outlinks else None
-            media = media if media else None
-            mentions = mentions if mentions else None
-            hashtags = hashtags if hashtags else None
-
-            message_id = int(url.split('/')[-1].split('?')[0]) if url else 0
-            yield TelegramPost(url=url, date=date, content=content, outlinks=outlinks, mentions=mentions,
-                               hashtags=hashtags, linkPreview=linkPreview, media=media, forwarded=forwarded,
-                               forwardedUrl=forwardedUrl, views=views, message_id=message_id)
-
     def get_items(self):
+        if self._dedupFilter is None:
+            yield from self._iter_items()
+            return
+        # Skip posts already recorded by the filter, e.g. a persistent one from previous runs
+        for item in self._iter_items():
+            if self._dedupFilter.add(item.url):
+                yield item
+
+    def _iter_items(self):
         r, soup = self._initial_page(with_posts=True)
         if '/s/' not in r.url:
             _logger.warning('No public post list for this user')
             return
-        nextPageUrl = ''
-        while True:
-            yield from self._soup_to_items(soup, r.url)
-            try:
-                if soup.find('a', attrs={'class': 'tgme_widget_message_date'}, href=True)['href'].split('/')[-1] == '1':
-                    # if message 1 is the first message in the page, terminate scraping
-                    break
-            except:
-                pass
-            pageLink = soup.find('a', attrs={'class': 'tme_messages_more', 'data-before': True})
-            if not pageLink:
-                # some pages are missing a "tme_messages_more" tag, causing early termination
-                if '=' not in nextPageUrl:
-                    nextPageUrl = soup.find('link', attrs={'rel': 'canonical'}, href=True)['href']
-                nextPostIndex = int(nextPageUrl.split('=')[-1]) - 20
-                if nextPostIndex > 20:
-                    pageLink = {'href': nextPageUrl.split('=')[0] + f'={nextPostIndex}'}
-                else:
-                    break
-            nextPageUrl = urllib.parse.urljoin(r.url, pageLink['href'])
-            r = self._get(nextPageUrl, headers=self._headers, responseOkCallback=_telegramResponseOkCallback)
-            if r.status_code != 200:
-                raise snscrape.base.ScraperException(f'Got status code {r.status_code}')
-            soup = bs4.BeautifulSoup(r.text, 'lxml')
+        if self._backfill:
+            yield from self._backfill_items(r, soup)
+            return
+        for r, doc in self._iter_pages((r, soup), self._next_page_url, self._get_page, pipeline=self._pipeline):
+            for item in self._parser.page_to_items(self, doc, r.url):
+                if self._afterId is not None and item.message_id <= self._afterId:
+                    return
+                yield item
+
+    def _next_page_url(self, page):
+        r, doc = page
+        try:
+            firstPostId = self._parser.first_post_href(doc).split('/')[-1]
+            if firstPostId == '1':
+                # if message 1 is the first message in the page, terminate scraping
+                return None
+            if self._afterId is not None and int(firstPostId) <= self._afterId:
+                # the page reaches the lower bound
+                return None
+        except:
+            pass
+        pageHref = self._parser.older_page_href(doc)
+        if not pageHref:
+            # some pages are missing a "tme_messages_more" tag, causing early termination
+            nextPageUrl = r.url
+            if '=' not in nextPageUrl:
+                nextPageUrl = self._parser.canonical_href(doc)
+            nextPostIndex = int(nextPageUrl.split('=')[-1]) - 20
+            if nextPostIndex > 20:
+                pageHref = nextPageUrl.split('=')[0] + f'={nextPostIndex}'
+            else:
+                return None
+        return urllib.parse.urljoin(r.url, pageHref)
+
+    def _backfill_items(self, r, doc):
+        '''Yield the posts of the first page and then those of all older ID ranges, which are retrieved concurrently'''
+        items = list(self._parser.page_to_items(self, doc, r.url))
+        lowestId = 1 if self._afterId is None else self._afterId + 1
+        yield from (item for item in items if item.message_id >= lowestId)
+        if not items:
+            return
+        pageUrl = r.url.split('?')[0]
+        oldestId = items[-1].message_id
+        ranges = ((max(hi - _BACKFILL_RANGE_SIZE + 1, lowestId), hi) for hi in range(oldestId - 1, lowestId - 1, -_BACKFILL_RANGE_SIZE))
+        for rangeItems in snscrape.base._map_ordered(lambda bounds: self._get_id_range(pageUrl, *bounds), ranges, self._backfill):
+            yield from rangeItems
+
+    def _get_id_range(self, pageUrl, lo, hi):
+        '''Retrieve the posts with IDs from lo to hi (inclusive), newest first'''
+        items = []
+        seenIds = set()
+        url = f'{pageUrl}?before={hi + 1}'
+        while url is not None:
+            r, doc = self._get_page(url)
+            url = self._next_page_url((r, doc))
+            pageItems = list(self._parser.page_to_items(self, doc, r.url))
+            for item in pageItems:
+                # Pages overlap the neighbouring ranges and, where the more link is missing, each other
+                if lo <= item.message_id <= hi and item.message_id not in seenIds:
+                    seenIds.add(item.message_id)
+                    items.append(item)
+            if not pageItems or min(item.message_id for item in pageItems) <= lo:
+                break
+        _logger.info(f'Retrieved {len(items)} posts with IDs {lo} to {hi}')
+        return items
 
     def _parse_channel_info(self, text):
         kwargs = {}
@@ -372,11 +1060,249 @@ class TelegramChannelScraper(snscrape.base.Scraper):
 
     @classmethod
     def _cli_setup_parser(cls, subparser):
+        subparser.add_argument('--pipeline', action='store_true', default=False,
+                               help='Retrieve the next page in the background while processing the current one')
+        subparser.add_argument('--parser', choices=sorted(_PAGE_PARSERS), default='bs4', help='HTML parser backend')
+        subparser.add_argument('--backfill', type=int, default=0, metavar='WORKERS',
+                               help=f'Retrieve older posts in message ID ranges of {_BACKFILL_RANGE_SIZE} with this many concurrent workers')
+        subparser.add_argument('--rate-limit', type=float, default=None, metavar='RPS', help='Make at most this many requests per second')
+        subparser.add_argument('--after-id', type=int, default=None, metavar='ID', help='Only retrieve posts with a message ID greater than this')
+        subparser.add_argument('--before-id', type=int, default=None, metavar='ID', help='Only retrieve posts with a message ID smaller than this')
         subparser.add_argument('channel', type=snscrape.base.nonempty_string('channel'), help='A channel name')
 
     @classmethod
     def _cli_from_args(cls, args):
-        return cls._cli_construct(args, args.channel)
+        rateLimiter = snscrape.base._RateLimiter(args.rate_limit) if args.rate_limit else None
+        return cls._cli_construct(args, args.channel, pipeline=args.pipeline, parser=args.parser, backfill=args.backfill,
+                                  after_id=args.after_id, before_id=args.before_id, rateLimiter=rateLimiter)
+
+
+class TelegramChannelsScraper(snscrape.base.Scraper):
+    '''Retrieve the posts of many channels
+
+    Up to workers channels are scraped concurrently over one pooled session, so connections to t.me are reused across channels; pass a rateLimiter to bound the combined request rate.
+    The posts are yielded as they are retrieved, so the channels are interleaved; each channel's own posts remain in newest-first order.
+    With with_entities, each channel's Channel entity is yielded before its posts; it is retrieved concurrently with the first page of posts.
+    Channels that cannot be retrieved are logged and skipped.'''
+
+    name = 'telegram-channels'
+
+    def __init__(self, names, post_format='markdown', parser='bs4', workers=8, with_entities=False, **kwargs):
+        if parser not in _PAGE_PARSERS:
+            raise ValueError(f'unknown parser {parser!r}')
+        if workers < 1:
+            raise ValueError('workers must be positive')
+        # Channel and entity requests run concurrently, so the pool needs room for two connections per worker
+        kwargs.setdefault('session', snscrape.base._pooled_session(2 * workers))
+        super().__init__(**kwargs)
+        self._names = names
+        self._postFormat = post_format
+        self._parserName = parser
+        self._workers = workers
+        self._withEntities = with_entities
+
+    def get_items(self):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._workers) as entityExecutor:
+            channels = (self._channel_items(name, entityExecutor) for name in self._names)
+            yield from snscrape.base._iter_merged(channels, self._workers)
+
+    def _channel_items(self, name, entityExecutor):
+        scraper = TelegramChannelScraper(name, post_format=self._postFormat, parser=self._parserName, retries=self._retries,
+                                         proxies=self._proxies, rateLimiter=self._rateLimiter, session=self._session)
+        try:
+            if self._withEntities:
+                entityFuture = entityExecutor.submit(scraper._get_entity)
+            items = scraper.get_items()
+            first = next(items, None)
+            if self._withEntities and (entity := entityFuture.result()) is not None:
+                yield entity
+            if first is not None:
+                yield first
+                yield from items
+        except Exception as e:  # Not only ScraperException: a malformed page of one channel must not end the other channels' threads
+            _logger.error(f'Could not retrieve channel {name}: {type(e).__name__}: {e}')
+
+    @classmethod
+    def _cli_setup_parser(cls, subparser):
+        subparser.add_argument('--parser', choices=sorted(_PAGE_PARSERS), default='bs4', help='HTML parser backend')
+        subparser.add_argument('--workers', type=int, default=8, help='Number of channels to retrieve concurrently')
+        subparser.add_argument('--rate-limit', type=float, default=None, metavar='RPS', help='Make at most this many requests per second in total')
+        subparser.add_argument('--channel-entities', action='store_true', default=False, help='Output each channel\'s entity before its posts')
+        subparser.add_argument('--channels-file', metavar='FILE', help='Read further channel names from this file, one per line')
+        subparser.add_argument('channels', nargs='*', metavar='channel', help='A channel name')
+
+    @classmethod
+    def _cli_from_args(cls, args):
+        names = list(args.channels)
+        if args.channels_file:
+            with open(args.channels_file, 'r') as fp:
+                names.extend(line.strip() for line in fp if line.strip())
+        if not names:
+            raise ValueError('no channels given')
+        rateLimiter = snscrape.base._RateLimiter(args.rate_limit) if args.rate_limit else None
+        return cls._cli_construct(args, names, parser=args.parser, workers=args.workers, with_entities=args.channel_entities,
+                                  rateLimiter=rateLimiter)
+
+
+class TelegramPostScraper(_TelegramCommonScraper):
+    '''Retrieve posts by channel and message ID
+
+    posts is an iterable of post URLs (https://t.me/channel/123), channel/ID strings, or (channel, ID) tuples.
+    The IDs are grouped by channel and covered by windows of 20 consecutive IDs, each of which is retrieved from ?after= pages, normally a single one; up to workers windows are fetched concurrently.
+    Posts are yielded by channel (in order of first appearance) in ascending ID order. Requested IDs for which no post exists are logged and collected as (channel, ID) pairs in the missing attribute.'''
+
+    name = 'telegram-post'
+
+    def __init__(self, posts, post_format='markdown', parser='bs4', workers=4, **kwargs):
+        super().__init__(post_format=post_format, parser=parser, **kwargs)
+        if workers < 1:
+            raise ValueError('workers must be positive')
+        self._posts = [_parse_post_reference(post) for post in posts]
+        self._workers = workers
+        self.missing = []
+
+    def get_items(self):
+        channels = {}
+        for channel, id_ in self._posts:
+            channels.setdefault(channel.lower(), (channel, set()))[1].add(id_)
+        windows = []
+        for channel, ids in channels.values():
+            start = None
+            for id_ in sorted(ids):
+                if start is None or id_ >= start + _HYDRATION_WINDOW_SIZE:
+                    start = id_
+                    windows.append((channel, start, []))
+                windows[-1][2].append(id_)
+        _logger.info(f'Retrieving {sum(len(ids) for _, ids in channels.values())} posts from {len(channels)} channels in {len(windows)} windows')
+
+        for channel, items, missing in snscrape.base._map_ordered(self._get_window, windows, self._workers):
+            if missing:
+                _logger.warning(f'No posts with IDs {", ".join(map(str, missing))} in {channel}')
+                self.missing.extend((channel, id_) for id_ in missing)
+            yield from items
+
+    def _get_window(self, window):
+        channel, start, ids = window
+        posts = {item.message_id: item for item in self._get_after_range(channel, start, ids[-1])}
+        return channel, [posts[id_] for id_ in ids if id_ in posts], [id_ for id_ in ids if id_ not in posts]
+
+    @classmethod
+    def _cli_setup_parser(cls, subparser):
+        subparser.add_argument('--parser', choices=sorted(_PAGE_PARSERS), default='bs4', help='HTML parser backend')
+        subparser.add_argument('--workers', type=int, default=4, help='Number of pages to retrieve concurrently')
+        subparser.add_argument('posts', nargs='+', metavar='post', help='A post URL (https://t.me/channel/123) or channel/ID')
+
+    @classmethod
+    def _cli_from_args(cls, args):
+        return cls._cli_construct(args, args.posts, parser=args.parser, workers=args.workers)
+
+
+class TelegramGapScraper(_TelegramCommonScraper):
+    '''Retrieve the posts missing from an archive of a channel
+
+    ids are the message IDs already in the archive. Each run of IDs from first_id to the highest archived ID that are not in ids is a gap.
+    Only the pages covering the gaps are retrieved, walking forward from the start of each gap with ?after=; large gaps are split into ranges of 1000 IDs, and up to workers ranges are retrieved concurrently.
+    The recovered posts are yielded in ascending ID order. Afterwards, the gaps attribute holds a MessageIdGap for every gap, which tells recovered posts apart from IDs without a post (deleted ones).'''
+
+    name = 'telegram-gaps'
+
+    def __init__(self, channel, ids, post_format='markdown', parser='bs4', workers=4, first_id=1, **kwargs):
+        super().__init__(post_format=post_format, parser=parser, **kwargs)
+        if workers < 1:
+            raise ValueError('workers must be positive')
+        self._channel = channel
+        self._ids = ids
+        self._workers = workers
+        self._firstId = first_id
+        self.gaps = []
+
+    def get_items(self):
+        gaps = []
+        previousId = self._firstId - 1
+        for id_ in sorted(set(self._ids)):
+            if id_ > previousId + 1:
+                gaps.append(MessageIdGap(first=previousId + 1, last=id_ - 1, recovered=[], deleted=[]))
+            previousId = max(previousId, id_)
+        _logger.info(f'Found {len(gaps)} gaps with {sum(gap.last - gap.first + 1 for gap in gaps)} missing IDs in {self._channel}')
+        ranges = [(gap, lo, min(lo + _BACKFILL_RANGE_SIZE - 1, gap.last)) for gap in gaps for lo in
+                  range(gap.first, gap.last + 1, _BACKFILL_RANGE_SIZE)]
+
+        for gap, lo, hi, items in snscrape.base._map_ordered(self._fill_range, ranges, self._workers):
+            foundIds = {item.message_id for item in items}
+            gap.recovered.extend(item.message_id for item in items)
+            gap.deleted.extend(id_ for id_ in range(lo, hi + 1) if id_ not in foundIds)
+            if hi == gap.last:
+                _logger.info(f'IDs {gap.first} to {gap.last}: {len(gap.recovered)} recovered, {len(gap.deleted)} deleted')
+                self.gaps.append(gap)
+            yield from items
+        _logger.info(f'Recovered {sum(len(gap.recovered) for gap in self.gaps)} posts, '
+                     f'{sum(len(gap.deleted) for gap in self.gaps)} IDs have no post')
+
+    def _fill_range(self, range_):
+        gap, lo, hi = range_
+        return gap, lo, hi, self._get_after_range(self._channel, lo, hi)
+
+    @classmethod
+    def _cli_setup_parser(cls, subparser):
+        subparser.add_argument('--parser', choices=sorted(_PAGE_PARSERS), default='bs4', help='HTML parser backend')
+        subparser.add_argument('--workers', type=int, default=4, help='Number of ID ranges to retrieve concurrently')
+        subparser.add_argument('--first-id', type=int, default=1, metavar='ID', help='Lowest message ID the archive should contain')
+        group = subparser.add_mutually_exclusive_group(required=True)
+        group.add_argument('--from-jsonl', metavar='FILE', help='Read the archived posts from JSONL output of this scraper')
+        group.add_argument('--from-sqlite', metavar='DATABASE', help='Read the archived message IDs or post URLs from an SQLite database')
+        subparser.add_argument('--table', help='SQLite table with the archived posts')
+        subparser.add_argument('--column', default='message_id', help='SQLite column with the message IDs or post URLs')
+        subparser.add_argument('channel', type=snscrape.base.nonempty_string('channel'), help='A channel name')
+
+    @classmethod
+    def _cli_from_args(cls, args):
+        if args.from_jsonl:
+            ids = list(_archive_ids_from_jsonl(args.from_jsonl, args.channel))
+        else:
+            if not args.table:
+                raise ValueError('--table is required with --from-sqlite')
+            ids = list(_archive_ids_from_sqlite(args.from_sqlite, args.table, args.column))
+        return cls._cli_construct(args, args.channel, ids, parser=args.parser, workers=args.workers, first_id=args.first_id)
+
+
+def _archive_id(value):
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return _parse_post_reference(value)[1]
+
+
+def _archive_ids_from_jsonl(path, channel):
+    with open(path, 'r', encoding='utf-8') as fp:
+        for line in fp:
+            if not line.strip():
+                continue
+            o = json.loads(line)
+            if o.get('url'):
+                postChannel, id_ = _parse_post_reference(o['url'])
+                if postChannel.lower() != channel.lower():
+                    continue
+                yield id_
+            elif o.get('message_id'):
+                yield o['message_id']
+
+
+def _archive_ids_from_sqlite(path, table, column):
+    quote = lambda identifier: '"' + identifier.replace('"', '""') + '"'
+    with contextlib.closing(sqlite3.connect(path)) as connection:
+        for value, in connection.execute(f'SELECT {quote(column)} FROM {quote(table)}'):
+            if value is not None:
+                yield _archive_id(value)
+
+
+def _parse_post_reference(post):
+    if isinstance(post, tuple):
+        channel, id_ = post
+        return channel, int(id_)
+    if not (match := _POST_REFERENCE_PATTERN.match(post.strip())):
+        raise ValueError(f'Not a Telegram post URL or channel/ID: {post!r}')
+    return match.group(1), int(match.group(2))
 
 
 def _parse_num(s):
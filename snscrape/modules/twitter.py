@@ -15,6 +15,8 @@ __all__ = [
 
 
 import collections
+import concurrent.futures
+import contextlib
 import dataclasses
 import datetime
 import email.utils
@@ -25,9 +27,11 @@ import json
 import random
 import logging
 import os
+import queue
 import re
 import snscrape.base
 import string
+import threading
 import time
 import typing
 import urllib.parse
@@ -49,6 +53,8 @@ _logger = logging.getLogger(__name__)
 _API_AUTHORIZATION_HEADER = 'Bearer AAAAAAAAAAAAAAAAAAAAANRILgAAAAAAnNwIzUejRCOuH5E6I8xnZz4puTs=1Zv7ttfk8LF81IUq16cHjhLTvJu4FA33AGWWjCpTnA'
 _globalGuestTokenManager = None
 _GUEST_TOKEN_VALIDITY = 10800
+_GUEST_TOKEN_REFRESH_MARGIN = 600  # A new guest token is retrieved in the background when the current one expires within this many seconds
+_RECURSE_FRONTIER_MEMORY_LIMIT = 10000  # Number of focal tweets kept in memory in RECURSE mode; the rest of the frontier is spilled to disk
 
 
 @dataclasses.dataclass
@@ -541,53 +547,77 @@ class GuestTokenManager:
 		self._token = None
 		self._setTime = 0.0
 
+	def _refresh_lock(self):
+		'''A lock held while a new token is retrieved to replace the current one, for managers whose token is shared with other processes'''
+		return contextlib.nullcontext()
+
 
 class _CLIGuestTokenManager(GuestTokenManager):
+	# The token is shared between CLI processes through a file that is only ever replaced atomically, so reading it needs no lock.
+	# Changes by other processes are detected by comparing the file's content to the one last read, so the file is only parsed when it changed.
+	# Writes and deletions are serialised with a lock file; deletion only happens if the file still holds the token being reset, so a fresh token written by another process survives.
+	# Background refreshes are serialised across processes with a second lock file, so that only one process retrieves a new token when the shared one nears its expiry.
+
 	def __init__(self):
 		super().__init__()
-		cacheHome = os.environ.get('XDG_CACHE_HOME')
-		if not cacheHome or not os.path.isabs(cacheHome):
-			# This should be ${HOME}/.cache, but the HOME environment variable may not exist on non-POSIX-compliant systems.
-			# On POSIX-compliant systems, the XDG Base Directory specification is followed exactly since ~ expands to $HOME if it is present.
-			cacheHome = os.path.join(os.path.expanduser('~'), '.cache')
-		dir = os.path.join(cacheHome, 'snscrape')
-		if not os.path.isdir(dir):
-			# os.makedirs does not apply mode recursively anymore. https://bugs.python.org/issue42367
-			# This ensures that the XDG_CACHE_HOME is created with the right permissions.
-			os.makedirs(os.path.dirname(dir), mode = 0o700, exist_ok = True)
-			os.mkdir(dir, mode = 0o700)
-		self._file = os.path.join(dir, 'cli-twitter-guest-token.json')
+		self._file = os.path.join(snscrape.base._cache_dir(), 'cli-twitter-guest-token.json')
 		self._lockFile = f'{self._file}.lock'
 		self._lock = filelock.FileLock(self._lockFile)
+		self._refreshFileLock = filelock.FileLock(f'{self._file}.refresh.lock')
+		self._fileContent = None
+
+	def _read_content(self):
+		try:
+			with open(self._file, 'rb') as fp:
+				return fp.read()
+		except FileNotFoundError:
+			return None
+
+	def _parse(self, content):
+		try:
+			return json.loads(content)
+		except json.JSONDecodeError as e:
+			_logger.warning(f'Malformed guest token file {self._file}: {e!s}')
+			return None
+
+	def _load(self):
+		content = self._read_content()
+		return self._parse(content) if content is not None else None
 
 	def _read(self):
-		with self._lock:
-			if not os.path.exists(self._file):
-				return None
-			_logger.info(f'Reading guest token from {self._file}')
-			with open(self._file, 'r') as fp:
-				try:
-					o = json.load(fp)
-				except json.JSONDecodeError as e:
-					_logger.warning(f'Malformed guest token file {self._file}: {e!s}')
-					self.reset()
-					return None
-		self._token = o['token']
-		self._setTime = o['setTime']
-		if self._setTime < time.time() - _GUEST_TOKEN_VALIDITY:
+		self._read_file()
+		# Checked on every read, not only when the file changed: a token read earlier or set by this process expires as well
+		if self._token is not None and self._setTime < time.time() - _GUEST_TOKEN_VALIDITY:
+			_logger.info('Guest token expired')
+			self._token = None
+			self._setTime = 0.0
+
+	def _read_file(self):
+		content = self._read_content()
+		if content is None or content == self._fileContent:
+			return
+		self._fileContent = content
+		_logger.info(f'Reading guest token from {self._file}')
+		o = self._parse(content)
+		if o is None:
+			return
+		if o['setTime'] < time.time() - _GUEST_TOKEN_VALIDITY:
 			_logger.info('Guest token expired')
-			self.reset()
+			return
+		if o['setTime'] > self._setTime:
+			self._token = o['token']
+			self._setTime = o['setTime']
 
 	def _write(self):
 		with self._lock:
 			_logger.info(f'Writing guest token to {self._file}')
-			with open(self._file, 'w') as fp:
-				json.dump({'token': self.token, 'setTime': self.setTime}, fp)
+			with open(f'{self._file}.tmp', 'w') as fp:
+				json.dump({'token': self._token, 'setTime': self._setTime}, fp)
+			os.replace(f'{self._file}.tmp', self._file)
 
 	@property
 	def token(self):
-		if not self._token:
-			self._read()
+		self._read()
 		return self._token
 
 	@token.setter
@@ -597,18 +627,26 @@ class _CLIGuestTokenManager(GuestTokenManager):
 
 	@property
 	def setTime(self):
-		self.token  # Implicitly reads from the file if necessary
+		self._read()
 		return self._setTime
 
+	def _refresh_lock(self):
+		return self._refreshFileLock
+
 	def reset(self):
+		token = self._token
 		super().reset()
+		self._fileContent = None
 		with self._lock:
-			_logger.info(f'Deleting guest token file {self._file}')
-			try:
-				os.remove(self._file)
-			except FileNotFoundError:
+			o = self._load()
+			if o is None:
 				# Another process likely already removed the file
-				pass
+				return
+			if o['token'] != token:
+				_logger.info(f'Keeping guest token file {self._file} with a different token')
+				return
+			_logger.info(f'Deleting guest token file {self._file}')
+			os.remove(self._file)
 
 
 class _TwitterAPIType(enum.Enum):
@@ -616,16 +654,111 @@ class _TwitterAPIType(enum.Enum):
 	GRAPHQL = 1
 
 
+class _TimelinePage:
+	'''The timeline entries of an API response, decoded in a single pass over its instructions
+
+	tweetEntries lists (entryId, entry, inConversationThread) for each tweet entry in page order. entry is the entry or item content for V2 and the tweet result for GraphQL; it is None for unrecognised GraphQL tweet items.
+	tweetCount is the number of top-level tweet entries.
+	cursors lists (kind, value, stopOnEmptyResponse) for each cursor entry in page order; kind is 'top', 'bottom', 'showMoreThreadsPrompt', or None for other cursors.
+	'''
+
+	def __init__(self, instructions, apiType, obj = None):
+		self.obj = obj
+		self.apiType = apiType
+		self.instructions = instructions
+		self.tweetEntries = []
+		self.tweetCount = 0
+		self.cursors = []
+		for instruction in instructions:
+			if 'addEntries' in instruction:
+				entries = instruction['addEntries']['entries']
+			elif 'replaceEntry' in instruction:
+				entries = [instruction['replaceEntry']['entry']]
+			elif instruction.get('type') == 'TimelineAddEntries':
+				entries = instruction['entries']
+			else:
+				continue
+			# The GraphQL conversion has only ever used TimelineAddEntries instructions; the others only count towards pagination there.
+			withTweets = apiType is _TwitterAPIType.V2 or instruction.get('type') == 'TimelineAddEntries'
+			for entry in entries:
+				entryId = entry['entryId']
+				if entryId.startswith('sq-I-t-') or entryId.startswith('tweet-'):
+					self.tweetCount += 1
+					if withTweets:
+						self.tweetEntries.append((entryId, self._tweet_entry(entry), False))
+				elif entryId.startswith('sq-cursor-') or entryId.startswith('cursor-'):
+					self.cursors.append(self._cursor(entry))
+				elif withTweets:
+					self._add_conversation_thread(entry)
+
+	@classmethod
+	def from_response(cls, obj, apiType):
+		if apiType is _TwitterAPIType.V2:
+			instructions = obj['timeline']['instructions']
+		elif apiType is _TwitterAPIType.GRAPHQL:
+			if 'user' in obj['data']:
+				# UserTweets, UserTweetsAndReplies
+				instructions = obj['data']['user']['result']['timeline']['timeline']['instructions']
+			else:
+				# TweetDetail
+				instructions = obj['data'].get('threaded_conversation_with_injections', {}).get('instructions', [])
+		return cls(instructions, apiType, obj)
+
+	def _tweet_entry(self, entry):
+		if self.apiType is _TwitterAPIType.V2:
+			return entry['content']
+		if entry['content']['entryType'] == 'TimelineTimelineItem' and entry['content']['itemContent']['itemType'] == 'TimelineTweet':
+			return entry['content']['itemContent']['tweet_results']['result']
+		return None
+
+	def _add_conversation_thread(self, entry):
+		entryId = entry['entryId']
+		if self.apiType is _TwitterAPIType.V2:
+			if entryId.startswith('conversationThread-') and not entryId.endswith('-show_more_cursor'):
+				for item in entry['content']['timelineModule']['items']:
+					if item['entryId'].startswith('tweet-'):
+						self.tweetEntries.append((item['entryId'], item, True))
+		elif entryId.startswith('conversationthread-'):  #TODO show more cursor?
+			for item in entry['content']['items']:
+				if item['entryId'].startswith(f'{entryId}-tweet-'):
+					self.tweetEntries.append((item['entryId'], item['item']['itemContent']['tweet_results']['result'], True))
+
+	def _cursor(self, entry):
+		if self.apiType is _TwitterAPIType.V2:
+			value = entry['content']['operation']['cursor']['value']
+			stop = entry['content']['operation']['cursor'].get('stopOnEmptyResponse', None)
+		elif self.apiType is _TwitterAPIType.GRAPHQL:
+			cursorContent = entry['content']
+			while cursorContent.get('itemType') == 'TimelineTimelineItem' or cursorContent.get('entryType') == 'TimelineTimelineItem':
+				cursorContent = cursorContent['itemContent']
+			value, stop = cursorContent['value'], cursorContent.get('stopOnEmptyResponse', None)
+		entryId = entry['entryId']
+		if entryId == 'sq-cursor-top' or entryId.startswith('cursor-top-'):
+			kind = 'top'
+		elif entryId == 'sq-cursor-bottom' or entryId.startswith('cursor-bottom-'):
+			kind = 'bottom'
+		elif entryId.startswith('cursor-showMoreThreadsPrompt-'): # E.g. 'offensive' replies button
+			kind = 'showMoreThreadsPrompt'
+		else:
+			kind = None
+		return kind, value, stop
+
+
 class _TwitterAPIScraper(snscrape.base.Scraper):
-	def __init__(self, baseUrl, *, guestTokenManager = None, **kwargs):
+	def __init__(self, baseUrl, *, guestTokenManager = None, prefetch = 0, **kwargs):
 		super().__init__(**kwargs)
+		if not 0 <= prefetch <= 3:
+			raise ValueError('prefetch must be between 0 and 3')
 		self._baseUrl = baseUrl
+		self._prefetch = prefetch
 		if guestTokenManager is None:
 			global _globalGuestTokenManager
 			if _globalGuestTokenManager is None:
 				_globalGuestTokenManager = GuestTokenManager()
 			guestTokenManager = _globalGuestTokenManager
 		self._guestTokenManager = guestTokenManager
+		self._guestTokenLock = threading.RLock()  # Guards the guest token state in _apiHeaders and the session cookies
+		self._guestTokenRefresh = None
 		self._apiHeaders = {
 			'User-Agent': None,
 			'Authorization': _API_AUTHORIZATION_HEADER,
@@ -645,6 +778,10 @@ class _TwitterAPIScraper(snscrape.base.Scraper):
 		return True, None
 
 	def _ensure_guest_token(self, url = None):
+		with self._guestTokenLock:
+			self._ensure_guest_token_locked(url)
+
+	def _ensure_guest_token_locked(self, url):
 		if self._guestTokenManager.token is None:
 			_logger.info('Retrieving guest token')
 			r = self._get(self._baseUrl if url is None else url, headers = {'User-Agent': self._userAgent}, responseOkCallback = self._check_guest_token_response)
@@ -656,26 +793,62 @@ class _TwitterAPIScraper(snscrape.base.Scraper):
 				self._guestTokenManager.token = r.cookies['gt']
 			if not self._guestTokenManager.token:
 				_logger.debug('No guest token in response')
-				_logger.info('Retrieving guest token via API')
-				r = self._post('https://api.twitter.com/1.1/guest/activate.json', data = b'', headers = self._apiHeaders, responseOkCallback = self._check_guest_token_response)
-				o = r.json()
-				if not o.get('guest_token'):
-					raise snscrape.base.ScraperException('Unable to retrieve guest token')
-				self._guestTokenManager.token = o['guest_token']
+				self._guestTokenManager.token = self._activate_guest_token(self._apiHeaders)
 			assert self._guestTokenManager.token
+		elif self._guestTokenManager.setTime < time.time() - _GUEST_TOKEN_VALIDITY + _GUEST_TOKEN_REFRESH_MARGIN:
+			self._refresh_guest_token_in_background()
 		_logger.debug(f'Using guest token {self._guestTokenManager.token}')
 		self._session.cookies.set('gt', self._guestTokenManager.token, domain = '.twitter.com', path = '/', secure = True, expires = self._guestTokenManager.setTime + _GUEST_TOKEN_VALIDITY)
 		self._apiHeaders['x-guest-token'] = self._guestTokenManager.token
 
+	def _activate_guest_token(self, headers):
+		_logger.info('Retrieving guest token via API')
+		r = self._post('https://api.twitter.com/1.1/guest/activate.json', data = b'', headers = headers, responseOkCallback = self._check_guest_token_response)
+		o = r.json()
+		if not o.get('guest_token'):
+			raise snscrape.base.ScraperException('Unable to retrieve guest token')
+		return o['guest_token']
+
+	def _refresh_guest_token_in_background(self):
+		# Called with the lock held. Requests keep using the current token until the new one is in place; _ensure_guest_token then picks it up.
+		if self._guestTokenRefresh is not None and self._guestTokenRefresh.is_alive():
+			return
+		setTime = self._guestTokenManager.setTime
+		headers = self._apiHeaders.copy()
+		headers.pop('x-guest-token', None)
+
+		def refresh():
+			with self._guestTokenManager._refresh_lock():
+				with self._guestTokenLock:
+					# Another process sharing the token may have refreshed it while this one waited for the lock
+					if self._guestTokenManager.setTime != setTime:
+						return
+				try:
+					token = self._activate_guest_token(headers)
+				except snscrape.base.ScraperException as e:
+					_logger.warning(f'Could not refresh guest token: {e!s}')
+					return
+				with self._guestTokenLock:
+					# Skip if the token was replaced in the meantime, e.g. reset after a block or refreshed by another process
+					if self._guestTokenManager.setTime == setTime:
+						self._guestTokenManager.token = token
+
+		_logger.info('Refreshing guest token in the background')
+		self._guestTokenRefresh = threading.Thread(target = refresh, daemon = True)
+		self._guestTokenRefresh.start()
+
 	def _unset_guest_token(self):
-		self._guestTokenManager.reset()
-		del self._session.cookies['gt']
-		del self._apiHeaders['x-guest-token']
+		with self._guestTokenLock:
+			self._guestTokenManager.reset()
+			# Another thread may have unset it already
+			self._session.cookies.pop('gt', None)
+			self._apiHeaders.pop('x-guest-token', None)
 
 	def _check_api_response(self, r):
 		if r.status_code in (403, 429):
-			self._unset_guest_token()
-			self._ensure_guest_token()
+			with self._guestTokenLock:
+				self._unset_guest_token()
+				self._ensure_guest_token()
 			return False, f'blocked ({r.status_code})'
 		if r.headers.get('content-type', '').replace(' ', '') != 'application/json;charset=utf-8':
 			return False, 'content type is not JSON'
@@ -684,17 +857,27 @@ class _TwitterAPIScraper(snscrape.base.Scraper):
 		return True, None
 
 	def _get_api_data(self, endpoint, apiType, params):
-		self._ensure_guest_token()
+		with self._guestTokenLock:
+			self._ensure_guest_token()
+			headers = self._apiHeaders.copy()
 		if apiType is _TwitterAPIType.GRAPHQL:
 			params = urllib.parse.urlencode({'variables': json.dumps(params, separators = (',', ':'))}, quote_via = urllib.parse.quote)
-		r = self._get(endpoint, params = params, headers = self._apiHeaders, responseOkCallback = self._check_api_response)
+		r = self._get(endpoint, params = params, headers = headers, responseOkCallback = self._check_api_response)
 		try:
 			obj = r.json()
 		except json.JSONDecodeError as e:
 			raise snscrape.base.ScraperException('Received invalid JSON from Twitter') from e
 		return obj
 
-	def _iter_api_data(self, endpoint, apiType, params, paginationParams = None, cursor = None, direction = _ScrollDirection.BOTTOM):
+	def _iter_api_pages(self, endpoint, apiType, params, paginationParams = None, cursor = None, direction = _ScrollDirection.BOTTOM):
+		# Yields the decoded _TimelinePage of each response, which the *_instructions_to_tweets methods accept directly; the response itself is its obj.
+		# With prefetching enabled, the following pages are retrieved and decoded in a background thread while the caller processes the current one.
+		it = self._iter_api_data_pages(endpoint, apiType, params, paginationParams, cursor = cursor, direction = direction)
+		if self._prefetch:
+			it = snscrape.base._iter_in_background(it, self._prefetch)
+		yield from it
+
+	def _iter_api_data_pages(self, endpoint, apiType, params, paginationParams = None, cursor = None, direction = _ScrollDirection.BOTTOM):
 		# Iterate over endpoint with params/paginationParams, optionally starting from a cursor
 		# Handles guest token extraction using the baseUrl passed to __init__ etc.
 		# Order from params and paginationParams is preserved. To insert the cursor at a particular location, insert a 'cursor' key into paginationParams there (value is overwritten).
@@ -718,51 +901,23 @@ class _TwitterAPIScraper(snscrape.base.Scraper):
 		while True:
 			_logger.info(f'Retrieving scroll page {cursor}')
 			obj = self._get_api_data(endpoint, apiType, reqParams)
-			yield obj
+			page = _TimelinePage.from_response(obj, apiType)
+			yield page
 
 			# No data format test, just a hard and loud crash if anything's wrong :-)
 			newCursor = None
 			promptCursor = None
 			newBottomCursorAndStop = None
-			if apiType is _TwitterAPIType.V2:
-				instructions = obj['timeline']['instructions']
-			elif apiType is _TwitterAPIType.GRAPHQL:
-				if 'user' in obj['data']:
-					# UserTweets, UserTweetsAndReplies
-					instructions = obj['data']['user']['result']['timeline']['timeline']['instructions']
-				else:
-					# TweetDetail
-					instructions = obj['data'].get('threaded_conversation_with_injections', {}).get('instructions', [])
-			tweetCount = 0
-			for instruction in instructions:
-				if 'addEntries' in instruction:
-					entries = instruction['addEntries']['entries']
-				elif 'replaceEntry' in instruction:
-					entries = [instruction['replaceEntry']['entry']]
-				elif instruction.get('type') == 'TimelineAddEntries':
-					entries = instruction['entries']
-				else:
-					continue
-				tweetCount += self._count_tweets(entries)
-				for entry in entries:
-					if not (entry['entryId'].startswith('sq-cursor-') or entry['entryId'].startswith('cursor-')):
-						continue
-					if apiType is _TwitterAPIType.V2:
-						entryCursor = entry['content']['operation']['cursor']['value']
-						entryCursorStop = entry['content']['operation']['cursor'].get('stopOnEmptyResponse', None)
-					elif apiType is _TwitterAPIType.GRAPHQL:
-						cursorContent = entry['content']
-						while cursorContent.get('itemType') == 'TimelineTimelineItem' or cursorContent.get('entryType') == 'TimelineTimelineItem':
-							cursorContent = cursorContent['itemContent']
-						entryCursor, entryCursorStop = cursorContent['value'], cursorContent.get('stopOnEmptyResponse', None)
-					if entry['entryId'] == f'sq-cursor-{dir}' or entry['entryId'].startswith(f'cursor-{dir}-'):
-						newCursor = entryCursor
-						if entryCursorStop is not None:
-							stopOnEmptyResponse = entryCursorStop
-					elif entry['entryId'].startswith('cursor-showMoreThreadsPrompt-'): # E.g. 'offensive' replies button
-						promptCursor = entryCursor
-					elif direction is _ScrollDirection.BOTH and bottomCursorAndStop is None and (entry['entryId'] == 'sq-cursor-bottom' or entry['entryId'].startswith('cursor-bottom-')):
-						newBottomCursorAndStop = (entryCursor, entryCursorStop or False)
+			tweetCount = page.tweetCount
+			for kind, entryCursor, entryCursorStop in page.cursors:
+				if kind == dir:
+					newCursor = entryCursor
+					if entryCursorStop is not None:
+						stopOnEmptyResponse = entryCursorStop
+				elif kind == 'showMoreThreadsPrompt':
+					promptCursor = entryCursor
+				elif direction is _ScrollDirection.BOTH and bottomCursorAndStop is None and kind == 'bottom':
+					newBottomCursorAndStop = (entryCursor, entryCursorStop or False)
 			if bottomCursorAndStop is None and newBottomCursorAndStop is not None:
 				bottomCursorAndStop = newBottomCursorAndStop
 			if newCursor == cursor and tweetCount == 0:
@@ -787,27 +942,16 @@ class _TwitterAPIScraper(snscrape.base.Scraper):
 			reqParams = paginationParams.copy()
 			reqParams['cursor'] = cursor
 
-	def _count_tweets(self, entries):
-		return sum(entry['entryId'].startswith('sq-I-t-') or entry['entryId'].startswith('tweet-') for entry in entries)
-
 	def _v2_timeline_instructions_to_tweets(self, obj, includeConversationThreads = False):
+		# obj is either an API response or its _TimelinePage
 		# No data format test, just a hard and loud crash if anything's wrong :-)
-		for instruction in obj['timeline']['instructions']:
-			if 'addEntries' in instruction:
-				entries = instruction['addEntries']['entries']
-			elif 'replaceEntry' in instruction:
-				entries = [instruction['replaceEntry']['entry']]
-			else:
-				continue
-			for entry in entries:
-				if entry['entryId'].startswith('sq-I-t-') or entry['entryId'].startswith('tweet-'):
-					yield from self._v2_instruction_tweet_entry_to_tweet(entry['entryId'], entry['content'], obj)
-				elif includeConversationThreads and entry['entryId'].startswith('conversationThread-') and not entry['entryId'].endswith('-show_more_cursor'):
-					for item in entry['content']['timelineModule']['items']:
-						if item['entryId'].startswith('tweet-'):
-							yield from self._v2_instruction_tweet_entry_to_tweet(item['entryId'], item, obj)
-
-	def _v2_instruction_tweet_entry_to_tweet(self, entryId, entry, obj):
+		page = obj if isinstance(obj, _TimelinePage) else _TimelinePage.from_response(obj, _TwitterAPIType.V2)
+		embeddedTweets = {}
+		for entryId, entry, inConversationThread in page.tweetEntries:
+			if includeConversationThreads or not inConversationThread:
+				yield from self._v2_instruction_tweet_entry_to_tweet(entryId, entry, page.obj, embeddedTweets)
+
+	def _v2_instruction_tweet_entry_to_tweet(self, entryId, entry, obj, embeddedTweets = None):
 		if 'tweet' in entry['item']['content']:
 			if 'promotedMetadata' in entry['item']['content']['tweet']: # Promoted tweet aka ads
 				return
@@ -824,7 +968,7 @@ class _TwitterAPIScraper(snscrape.base.Scraper):
 			tweet = obj['globalObjects']['tweets'][entry['item']['content']['tombstone']['tweet']['id']]
 		else:
 			raise snscrape.base.ScraperException(f'Unable to handle entry {entryId!r}')
-		yield self._tweet_to_tweet(tweet, obj)
+		yield self._tweet_to_tweet(tweet, obj, embeddedTweets)
 
 	def _get_tweet_id(self, tweet):
 		return tweet['id'] if 'id' in tweet else int(tweet['id_str'])
@@ -1258,18 +1402,37 @@ class _TwitterAPIScraper(snscrape.base.Scraper):
 
 		_logger.warning(f'Unsupported card type on tweet {tweetId}: {cardName!r}')
 
-	def _tweet_to_tweet(self, tweet, obj):
+	def _embedded_tweet(self, embeddedTweets, key, convert):
+		# embeddedTweets memoises the conversion of retweeted and quoted tweets within one page, where viral tweets are often embedded many times.
+		# key is the tweet ID, or for GraphQL results a key from _graphql_result_memo_key. The resulting Tweet object is shared by all tweets embedding it.
+		if embeddedTweets is None or key is None:
+			return convert()
+		if key not in embeddedTweets:
+			embeddedTweets[key] = convert()
+		return embeddedTweets[key]
+
+	def _tweet_to_tweet(self, tweet, obj, embeddedTweets = None):
 		user = self._user_to_user(obj['globalObjects']['users'][tweet['user_id_str']])
 		kwargs = {}
 		if 'retweeted_status_id_str' in tweet:
-			kwargs['retweetedTweet'] = self._tweet_to_tweet(obj['globalObjects']['tweets'][tweet['retweeted_status_id_str']], obj)
+			retweetedId = tweet['retweeted_status_id_str']
+			kwargs['retweetedTweet'] = self._embedded_tweet(embeddedTweets, retweetedId, lambda: self._tweet_to_tweet(obj['globalObjects']['tweets'][retweetedId], obj, embeddedTweets))
 		if 'quoted_status_id_str' in tweet and tweet['quoted_status_id_str'] in obj['globalObjects']['tweets']:
-			kwargs['quotedTweet'] = self._tweet_to_tweet(obj['globalObjects']['tweets'][tweet['quoted_status_id_str']], obj)
+			quotedId = tweet['quoted_status_id_str']
+			kwargs['quotedTweet'] = self._embedded_tweet(embeddedTweets, quotedId, lambda: self._tweet_to_tweet(obj['globalObjects']['tweets'][quotedId], obj, embeddedTweets))
 		if 'card' in tweet:
 			kwargs['card'] = self._make_card(tweet['card'], _TwitterAPIType.V2, self._get_tweet_id(tweet))
 		return self._make_tweet(tweet, user, **kwargs)
 
-	def _graphql_timeline_tweet_item_result_to_tweet(self, result):
+	def _graphql_result_memo_key(self, result):
+		# The same tweet is embedded with its own quoted tweet in full (e.g. when retweeted) or only referenced (e.g. when quoted), which convert differently.
+		if result['__typename'] == 'TweetWithVisibilityResults':
+			result = result['tweet']
+		if (tweetId := result.get('rest_id')) is None:
+			return None
+		return tweetId, 'quoted_status_result' in result, 'quotedRefResult' in result
+
+	def _graphql_timeline_tweet_item_result_to_tweet(self, result, embeddedTweets = None):
 		if result['__typename'] == 'Tweet':
 			pass
 		elif result['__typename'] == 'TweetWithVisibilityResults':
@@ -1282,12 +1445,14 @@ class _TwitterAPIScraper(snscrape.base.Scraper):
 		user = self._user_to_user(result['core']['user_results']['result']['legacy'], id_ = userId)
 		kwargs = {}
 		if 'retweeted_status_result' in tweet:
-			kwargs['retweetedTweet'] = self._graphql_timeline_tweet_item_result_to_tweet(tweet['retweeted_status_result']['result'])
+			retweetedResult = tweet['retweeted_status_result']['result']
+			kwargs['retweetedTweet'] = self._embedded_tweet(embeddedTweets, self._graphql_result_memo_key(retweetedResult), lambda: self._graphql_timeline_tweet_item_result_to_tweet(retweetedResult, embeddedTweets))
 		if 'quoted_status_result' in result:
 			if result['quoted_status_result']['result']['__typename'] == 'TweetTombstone':
 				kwargs['quotedTweet'] = TweetRef(id = int(tweet['quoted_status_id_str']))
 			else:
-				kwargs['quotedTweet'] = self._graphql_timeline_tweet_item_result_to_tweet(result['quoted_status_result']['result'])
+				quotedResult = result['quoted_status_result']['result']
+				kwargs['quotedTweet'] = self._embedded_tweet(embeddedTweets, self._graphql_result_memo_key(quotedResult), lambda: self._graphql_timeline_tweet_item_result_to_tweet(quotedResult, embeddedTweets))
 		elif 'quotedRefResult' in result:
 			if result['quotedRefResult']['result']['__typename'] == 'TweetTombstone':
 				kwargs['quotedTweet'] = TweetRef(id = int(tweet['quoted_status_id_str']))
@@ -1300,19 +1465,16 @@ class _TwitterAPIScraper(snscrape.base.Scraper):
 		return self._make_tweet(tweet, user, **kwargs)
 
 	def _graphql_timeline_instructions_to_tweets(self, instructions, includeConversationThreads = False):
-		for instruction in instructions:
-			if instruction['type'] != 'TimelineAddEntries':
+		# instructions is either the list of instructions or a _TimelinePage
+		page = instructions if isinstance(instructions, _TimelinePage) else _TimelinePage(instructions, _TwitterAPIType.GRAPHQL)
+		embeddedTweets = {}
+		for entryId, result, inConversationThread in page.tweetEntries:
+			if inConversationThread and not includeConversationThreads:
 				continue
-			for entry in instruction['entries']:
-				if entry['entryId'].startswith('tweet-'):
-					if entry['content']['entryType'] == 'TimelineTimelineItem' and entry['content']['itemContent']['itemType'] == 'TimelineTweet':
-						yield self._graphql_timeline_tweet_item_result_to_tweet(entry['content']['itemContent']['tweet_results']['result'])
-					else:
-						logger.warning('Got unrecognised timeline tweet item(s)')
-				elif includeConversationThreads and entry['entryId'].startswith('conversationthread-'):  #TODO show more cursor?
-					for item in entry['content']['items']:
-						if item['entryId'].startswith(f'{entry["entryId"]}-tweet-'):
-							yield self._graphql_timeline_tweet_item_result_to_tweet(item['item']['itemContent']['tweet_results']['result'])
+			if result is None:
+				_logger.warning('Got unrecognised timeline tweet item(s)')
+				continue
+			yield self._graphql_timeline_tweet_item_result_to_tweet(result, embeddedTweets)
 
 	def _render_text_with_urls(self, text, urls):
 		if not urls:
@@ -1375,9 +1537,14 @@ class _TwitterAPIScraper(snscrape.base.Scraper):
 			labelKwargs['longDescription'] = label['longDescription']['text']
 		return UserLabel(**labelKwargs)
 
+	@classmethod
+	def _cli_setup_parser(cls, subparser):
+		subparser.add_argument('--prefetch', metavar = 'N', type = int, choices = range(4), default = 0, help = 'Retrieve up to N pages ahead in the background (0 to 3)')
+
 	@classmethod
 	def _cli_construct(cls, argparseArgs, *args, **kwargs):
 		kwargs['guestTokenManager'] = _CLIGuestTokenManager()
+		kwargs['prefetch'] = argparseArgs.prefetch
 		return super()._cli_construct(argparseArgs, *args, **kwargs)
 
 
@@ -1446,11 +1613,12 @@ class TwitterSearchScraper(_TwitterAPIScraper):
 			del params['tweet_search_mode']
 			del paginationParams['tweet_search_mode']
 
-		for obj in self._iter_api_data('https://api.twitter.com/2/search/adaptive.json', _TwitterAPIType.V2, params, paginationParams, cursor = self._cursor):
-			yield from self._v2_timeline_instructions_to_tweets(obj)
+		for page in self._iter_api_pages('https://api.twitter.com/2/search/adaptive.json', _TwitterAPIType.V2, params, paginationParams, cursor = self._cursor):
+			yield from self._v2_timeline_instructions_to_tweets(page)
 
 	@classmethod
 	def _cli_setup_parser(cls, subparser):
+		_TwitterAPIScraper._cli_setup_parser(subparser)
 		subparser.add_argument('--cursor', metavar = 'CURSOR')
 		subparser.add_argument('--top', action = 'store_true', default = False, help = 'Enable fetching top tweets instead of live/chronological')
 		subparser.add_argument('query', type = snscrape.base.nonempty_string('query'), help = 'A Twitter search string')
@@ -1544,6 +1712,7 @@ class TwitterUserScraper(TwitterSearchScraper):
 				return s
 			raise ValueError('Invalid username or ID')
 
+		_TwitterAPIScraper._cli_setup_parser(subparser)
 		subparser.add_argument('--user-id', dest = 'isUserId', action = 'store_true', default = False, help = 'Use user ID instead of username')
 		subparser.add_argument('user', type = user, help = 'A Twitter username (without @)')
 
@@ -1578,14 +1747,13 @@ class TwitterProfileScraper(TwitterUserScraper):
 		del variables['cursor']
 
 		gotPinned = False
-		for obj in self._iter_api_data('https://twitter.com/i/api/graphql/BSKxQ9_IaCoVyIvQHQROIQ/UserTweetsAndReplies', _TwitterAPIType.GRAPHQL, variables, paginationVariables):
-			instructions = obj['data']['user']['result']['timeline']['timeline']['instructions']
+		for page in self._iter_api_pages('https://twitter.com/i/api/graphql/BSKxQ9_IaCoVyIvQHQROIQ/UserTweetsAndReplies', _TwitterAPIType.GRAPHQL, variables, paginationVariables):
 			if not gotPinned:
-				for instruction in instructions:
+				for instruction in page.instructions:
 					if instruction['type'] == 'TimelinePinEntry':
 						gotPinned = True
 						yield self._graphql_timeline_tweet_item_result_to_tweet(instruction['entry']['content']['itemContent']['tweet_results']['result'])
-			yield from self._graphql_timeline_instructions_to_tweets(instructions)
+			yield from self._graphql_timeline_instructions_to_tweets(page)
 
 
 class TwitterHashtagScraper(TwitterSearchScraper):
@@ -1597,6 +1765,7 @@ class TwitterHashtagScraper(TwitterSearchScraper):
 
 	@classmethod
 	def _cli_setup_parser(cls, subparser):
+		_TwitterAPIScraper._cli_setup_parser(subparser)
 		subparser.add_argument('hashtag', type = snscrape.base.nonempty_string('hashtag'), help = 'A Twitter hashtag (without #)')
 
 	@classmethod
@@ -1621,9 +1790,23 @@ class TwitterTweetScraperMode(enum.Enum):
 class TwitterTweetScraper(_TwitterAPIScraper):
 	name = 'twitter-tweet'
 
-	def __init__(self, tweetId, *, mode = TwitterTweetScraperMode.SINGLE, **kwargs):
+	def __init__(self, tweetId, *, mode = TwitterTweetScraperMode.SINGLE, dedupFilter = None, workers = 1, maxDepth = None, maxBreadth = None, **kwargs):
+		'''
+		In RECURSE mode, up to workers conversations are retrieved concurrently.
+		maxDepth limits how many levels of conversations are retrieved beyond the one of tweetId, and maxBreadth how many conversations are retrieved per level.
+		The frontier of conversations still to retrieve is spilled to disk when it grows large; pass an SQLiteDedupFilter as dedupFilter to also keep the seen tweets on disk.
+		'''
+		if workers < 1:
+			raise ValueError('workers must be positive')
 		self._tweetId = tweetId
 		self._mode = mode
+		self._dedupFilter = dedupFilter
+		self._workers = workers
+		self._maxDepth = maxDepth
+		self._maxBreadth = maxBreadth
+		self._closeDedupFilter = False # Set for the filter created by the CLI from --seen-db, which belongs to the scraper
+		if workers > 1:
+			kwargs.setdefault('session', snscrape.base._pooled_session(2 * workers))
 		super().__init__(f'https://twitter.com/i/web/status/{self._tweetId}', **kwargs)
 
 	def get_items(self):
@@ -1661,40 +1844,108 @@ class TwitterTweetScraper(_TwitterAPIScraper):
 						yield self._graphql_timeline_tweet_item_result_to_tweet(entry['content']['itemContent']['tweet_results']['result'])
 						break
 		elif self._mode is TwitterTweetScraperMode.SCROLL:
-			for obj in self._iter_api_data(url, _TwitterAPIType.GRAPHQL, variables, paginationVariables, direction = _ScrollDirection.BOTH):
-				if not obj['data']:
+			for page in self._iter_api_pages(url, _TwitterAPIType.GRAPHQL, variables, paginationVariables, direction = _ScrollDirection.BOTH):
+				if not page.obj['data']:
 					continue
-				yield from self._graphql_timeline_instructions_to_tweets(obj['data']['threaded_conversation_with_injections']['instructions'], includeConversationThreads = True)
+				yield from self._graphql_timeline_instructions_to_tweets(page, includeConversationThreads = True)
 		elif self._mode is TwitterTweetScraperMode.RECURSE:
-			seenTweets = set()
-			queue = collections.deque()
-			queue.append(self._tweetId)
-			while queue:
-				tweetId = queue.popleft()
-				thisPagVariables = paginationVariables.copy()
-				thisPagVariables['focalTweetId'] = str(tweetId)
-				thisVariables = thisPagVariables.copy()
-				del thisPagVariables['cursor'], thisPagVariables['referrer']
-				for obj in self._iter_api_data(url, _TwitterAPIType.GRAPHQL, thisVariables, thisPagVariables, direction = _ScrollDirection.BOTH):
-					if not obj['data']:
+			yield from self._recurse(url, paginationVariables)
+
+	def _iter_conversation(self, url, paginationVariables, tweetId):
+		thisPagVariables = paginationVariables.copy()
+		thisPagVariables['focalTweetId'] = str(tweetId)
+		thisVariables = thisPagVariables.copy()
+		del thisPagVariables['cursor'], thisPagVariables['referrer']
+		for page in self._iter_api_pages(url, _TwitterAPIType.GRAPHQL, thisVariables, thisPagVariables, direction = _ScrollDirection.BOTH):
+			if not page.obj['data']:
+				continue
+			yield from self._graphql_timeline_instructions_to_tweets(page, includeConversationThreads = True)
+
+	def _recurse(self, url, paginationVariables):
+		# The conversations of the focal tweets in the frontier are retrieved by the workers, which stream their tweets back to this thread.
+		# Only this thread touches the seen filter and the frontier, so neither needs to be thread-safe.
+		# With a bounded filter, tweets forgotten by it are retrieved and recursed into again; with a Bloom filter, false positives are skipped.
+		seenTweets = self._dedupFilter if self._dedupFilter is not None else snscrape.base.SetDedupFilter()
+		frontier = snscrape.base._SpillableQueue(_RECURSE_FRONTIER_MEMORY_LIMIT)
+		frontier.put((self._tweetId, 0))
+		focalTweetsPerDepth = collections.Counter()
+		results = queue.Queue(100)
+		stop = threading.Event()
+		end = object()
+
+		def put(result):
+			while not stop.is_set():
+				try:
+					results.put(result, timeout = 0.1)
+				except queue.Full:
+					continue
+				return True
+			return False
+
+		def crawl(tweetId, depth):
+			try:
+				for tweet in self._iter_conversation(url, paginationVariables, tweetId):
+					if not put((tweet, depth, None)):
+						return
+			except BaseException as e:
+				put((None, depth, e))
+			else:
+				put((end, depth, None))
+
+		with concurrent.futures.ThreadPoolExecutor(max_workers = self._workers) as executor:
+			running = 0
+			try:
+				while True:
+					while frontier and running < self._workers:
+						executor.submit(crawl, *frontier.get())
+						running += 1
+					if not running:
+						break
+					tweet, depth, exc = results.get()
+					if exc is not None:
+						raise exc
+					if tweet is end:
+						running -= 1
+						continue
+					if not seenTweets.add(tweet.id):
+						continue
+					yield tweet
+					if tweet.id == self._tweetId:  # Already queued at the beginning
 						continue
-					for tweet in self._graphql_timeline_instructions_to_tweets(obj['data']['threaded_conversation_with_injections']['instructions'], includeConversationThreads = True):
-						if tweet.id not in seenTweets:
-							yield tweet
-							seenTweets.add(tweet.id)
-							if tweet.id != self._tweetId:  # Already queued at the beginning
-								queue.append(tweet.id)
+					if self._maxDepth is not None and depth >= self._maxDepth:
+						continue
+					if self._maxBreadth is not None:
+						if focalTweetsPerDepth[depth + 1] >= self._maxBreadth:
+							continue
+						focalTweetsPerDepth[depth + 1] += 1
+					frontier.put((tweet.id, depth + 1))
+			finally:
+				stop.set()
+				frontier.close()
+				if self._closeDedupFilter:
+					seenTweets.close()
+				else:
+					# The filter belongs to the caller, but what it recorded must not be lost when this run ends
+					seenTweets.flush()
 
 	@classmethod
 	def _cli_setup_parser(cls, subparser):
+		_TwitterAPIScraper._cli_setup_parser(subparser)
 		group = subparser.add_mutually_exclusive_group(required = False)
 		group.add_argument('--scroll', action = 'store_true', default = False, help = 'Enable scrolling in both directions')
-		group.add_argument('--recurse', '--recursive', action = 'store_true', default = False, help = 'Enable recursion through all tweets encountered (warning: slow, potentially memory-intensive!)')
+		group.add_argument('--recurse', '--recursive', action = 'store_true', default = False, help = 'Enable recursion through all tweets encountered (warning: slow!)')
+		subparser.add_argument('--workers', type = int, default = 1, help = 'Number of conversations to retrieve concurrently with --recurse')
+		subparser.add_argument('--max-depth', dest = 'maxDepth', type = int, default = None, help = 'Maximum number of levels to recurse into with --recurse')
+		subparser.add_argument('--max-breadth', dest = 'maxBreadth', type = int, default = None, help = 'Maximum number of conversations to retrieve per level with --recurse')
+		subparser.add_argument('--seen-db', dest = 'seenDb', metavar = 'FILE', default = None, help = 'With --recurse, keep track of the tweets already retrieved in this SQLite database instead of in memory. Tweets recorded there by an earlier run are skipped and not recursed into, including the tweet given here, so running again on the same database only follows new replies to it; an interrupted run is not resumed')
 		subparser.add_argument('tweetId', type = int, help = 'A tweet ID')
 
 	@classmethod
 	def _cli_from_args(cls, args):
-		return cls._cli_construct(args, args.tweetId, mode = TwitterTweetScraperMode._cli_from_args(args))
+		dedupFilter = snscrape.base.SQLiteDedupFilter(args.seenDb, namespace = f'twitter-tweet-{args.tweetId}') if args.seenDb is not None else None
+		scraper = cls._cli_construct(args, args.tweetId, mode = TwitterTweetScraperMode._cli_from_args(args), dedupFilter = dedupFilter, workers = args.workers, maxDepth = args.maxDepth, maxBreadth = args.maxBreadth)
+		scraper._closeDedupFilter = dedupFilter is not None
+		return scraper
 
 
 class TwitterListPostsScraper(TwitterSearchScraper):
@@ -1706,6 +1957,7 @@ class TwitterListPostsScraper(TwitterSearchScraper):
 
 	@classmethod
 	def _cli_setup_parser(cls, subparser):
+		_TwitterAPIScraper._cli_setup_parser(subparser)
 		subparser.add_argument('list', type = snscrape.base.nonempty_string('list'), help = 'A Twitter list ID or a string of the form "username/listname" (replace spaces with dashes)')
 
 	@classmethod
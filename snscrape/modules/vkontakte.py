@@ -2,7 +2,7 @@ __all__ = ['VKontaktePost', 'Photo', 'PhotoVariant', 'Video', 'User', 'VKontakte
 
 
 import bs4
-import collections
+import concurrent.futures
 import dataclasses
 import datetime
 import itertools
@@ -29,6 +29,7 @@ else:
 
 
 _logger = logging.getLogger(__name__)
+_GEOBLOCK_RESPONSE = '"\\/blank.php?block=119910902"'
 _months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
 _datePattern = re.compile(r'^(?P<date>today'
                                   r'|yesterday'
@@ -101,9 +102,17 @@ class Video:
 class VKontakteUserScraper(snscrape.base.Scraper):
 	name = 'vkontakte-user'
 
-	def __init__(self, username, **kwargs):
+	def __init__(self, username, *, pipeline = False, workers = 1, dedupFilter = None, **kwargs):
 		super().__init__(**kwargs)
+		if workers < 1:
+			raise ValueError('workers must be positive')
+		if pipeline and workers > 1:
+			raise ValueError('pipeline and workers > 1 are mutually exclusive')
 		self._username = username
+		self._pipeline = pipeline
+		self._workers = workers
+		self._dedupFilter = dedupFilter
+		self.geoblockRecoveryRequests = 0
 		self._baseUrl = f'https://vk.com/{self._username}'
 		self._headers = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:52.0) Gecko/20100101 Firefox/52.0', 'Accept-Language': 'en-US,en;q=0.5'}
 		self._initialPage = None
@@ -273,43 +282,120 @@ class VKontakteUserScraper(snscrape.base.Scraper):
 		else:
 			fixedPostID = ''
 
-		last1000PostIDs = collections.deque(maxlen = 1000)
+		# Pages overlap, especially around geoblocks, so recently seen posts are skipped
+		dedupFilter = self._dedupFilter if self._dedupFilter is not None else snscrape.base.LRUDedupFilter(1000)
 
 		def _process_soup(soup):
-			nonlocal last1000PostIDs
 			for item in self._soup_to_items(soup):
 				postID = int(item.url.rsplit('_', 1)[1])
-				if postID not in last1000PostIDs:
+				if dedupFilter.add(postID):
 					yield item
-					last1000PostIDs.append(postID)
 
-		yield from _process_soup(soup)
+		def _next_offset(page):
+			offset, posts = page
+			if posts is not None and posts.startswith('<div class="page_block no_posts">'):
+				return None
+			return offset + 10
 
-		lastWorkingOffset = 0
-		for offset in itertools.count(start = 10, step = 10):
-			posts = self._get_wall_offset(fixedPostID, ownerID, offset)
+		def _get_page(offset):
+			return offset, self._get_wall_offset(fixedPostID, ownerID, offset)
+
+		if self._workers > 1:
+			# The offsets are known in advance, so the pages are retrieved concurrently and processed in order; the end of the wall is only noticed on the page after it, so up to workers requests are wasted there.
+			pages = itertools.chain([(0, None)], snscrape.base._map_ordered(_get_page, itertools.count(10, 10), self._workers))
+		else:
+			pages = self._iter_pages((0, None), _next_offset, _get_page, pipeline = self._pipeline)
+
+		covered, clean = 9, True # See _recover_geoblock
+		for offset, posts in pages:
+			if posts is None:
+				# Initial page
+				yield from _process_soup(soup)
+				continue
 			if posts.startswith('<div class="page_block no_posts">'):
 				# Reached the end
 				break
 			if not posts.startswith('<div id="post'):
-				if posts == '"\\/blank.php?block=119910902"':
+				if posts == _GEOBLOCK_RESPONSE:
 					_logger.warning(f'Encountered geoblock on offset {offset}, trying to work around the block but might be missing content')
-					for geoblockOffset in range(lastWorkingOffset + 1, offset + 10):
-						geoPosts = self._get_wall_offset(fixedPostID, ownerID, geoblockOffset)
-						if geoPosts.startswith('<div class="page_block no_posts">'):
-							# No breaking the outer loop, it'll just make one extra request and exit as well
-							break
-						if not geoPosts.startswith('<div id="post'):
-							if geoPosts == '"\\/blank.php?block=119910902"':
-								continue
-							raise snscrape.base.ScraperException(f'Got an unknown response: {geoPosts[:200]!r}...')
+					recovered, covered, clean = self._recover_geoblock(lambda offset: self._get_wall_offset(fixedPostID, ownerID, offset), offset, posts, covered, clean)
+					for geoPosts in recovered:
 						yield from _process_soup(soup = bs4.BeautifulSoup(geoPosts, 'lxml'))
 					continue
 				raise snscrape.base.ScraperException(f'Got an unknown response: {posts[:200]!r}...')
-			lastWorkingOffset = offset
+			if offset + 9 >= covered:
+				covered, clean = offset + 9, True
 			soup = bs4.BeautifulSoup(posts, 'lxml')
 			yield from _process_soup(soup)
 
+	def _recover_geoblock(self, get_posts, offset, posts, covered, clean):
+		'''Retrieve what can be retrieved of the wall positions offset to offset + 9, where posts is the geoblock response for offset.
+
+		The response for an offset o contains the posts at positions o to o + 9 unless one of them is geoblocked. covered is the highest position retrieved so far, and clean tells whether the ten positions up to it are known not to be geoblocked.
+		When clean, the windows ending at positions covered + 1 to covered + 10 only fail from the first geoblocked position on, so that position is found with a k-ary search. The positions after it can only be retrieved by a window starting after it, so these are probed in ascending order until one succeeds. The positions in between are unreachable.
+		Up to self._workers probes are made concurrently; their number is added to self.geoblockRecoveryRequests.
+		Returns the successful responses in offset order and the new values of covered and clean.'''
+
+		end = offset + 9
+		responses = {offset: posts}
+		requests = 0
+
+		def probe(offsets):
+			nonlocal requests
+			offsets = [o for o in offsets if o not in responses]
+			requests += len(offsets)
+			with concurrent.futures.ThreadPoolExecutor(max_workers = self._workers) as executor:
+				responses.update(zip(offsets, executor.map(get_posts, offsets)))
+
+		def status(o):
+			posts = responses[o]
+			if posts.startswith('<div class="page_block no_posts">'):
+				return 'end'
+			if posts.startswith('<div id="post'):
+				return 'ok'
+			if posts == _GEOBLOCK_RESPONSE:
+				return 'blocked'
+			raise snscrape.base.ScraperException(f'Got an unknown response: {posts[:200]!r}...')
+
+		while covered < end:
+			start = covered + 1
+			if clean:
+				# Search the first position first whose window ending there (i.e. at offset first - 9) is blocked
+				lo, first = covered + 1, covered + 11
+				if lo <= end < first:
+					first = end
+				while lo < first:
+					n = min(self._workers, first - lo)
+					points = sorted({lo + (first - lo) * (i + 1) // (n + 1) for i in range(n)})
+					probe([e - 9 for e in points])
+					for e in points:
+						if status(e - 9) == 'blocked':
+							first = e
+							break
+						lo = e + 1
+				if first == covered + 11:
+					covered += 10
+					continue
+				start = first + 1
+			success = None
+			for batchStart in range(start, end + 1, self._workers):
+				batch = list(range(batchStart, min(batchStart + self._workers, end + 1)))
+				probe(batch)
+				if (stati := [(o, status(o)) for o in batch if status(o) != 'blocked']):
+					success = stati[0]
+					break
+			if success is None:
+				covered, clean = end, False
+			elif success[1] == 'end':
+				covered, clean = end, False
+				break
+			else:
+				covered, clean = success[0] + 9, True
+
+		self.geoblockRecoveryRequests += requests
+		_logger.info(f'Geoblock recovery at offset {offset} took {requests} requests')
+		return [responses[o] for o in sorted(responses) if status(o) == 'ok'], covered, clean
+
 	def _get_wall_offset(self, fixedPostID, ownerID, offset):
 		headers = self._headers.copy()
 		headers['X-Requested-With'] = 'XMLHttpRequest'
@@ -399,8 +485,10 @@ class VKontakteUserScraper(snscrape.base.Scraper):
 
 	@classmethod
 	def _cli_setup_parser(cls, subparser):
+		subparser.add_argument('--pipeline', action = 'store_true', default = False, help = 'Retrieve the next page in the background while processing the current one')
+		subparser.add_argument('--workers', type = int, default = 1, help = 'Retrieve up to this many pages concurrently; cannot be combined with --pipeline')
 		subparser.add_argument('username', type = snscrape.base.nonempty_string('username'), help = 'A VK username')
 
 	@classmethod
 	def _cli_from_args(cls, args):
-		return cls._cli_construct(args, args.username)
\ No newline at end of file
+		return cls._cli_construct(args, args.username, pipeline = args.pipeline, workers = args.workers)
\ No newline at end of file
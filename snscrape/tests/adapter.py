@@ -0,0 +1,59 @@
+'''A requests transport adapter serving canned responses, for tests that go through Scraper._request and Session.send'''
+
+import io
+import threading
+
+import requests
+import requests.adapters
+import requests.structures
+
+
+class _Body(io.BytesIO):
+	# Response.close always calls release_conn on the raw body, so this records whether the response was closed
+	released = False
+
+	def release_conn(self):
+		self.released = True
+
+
+class FakeAdapter(requests.adapters.BaseAdapter):
+	'''Serves responses from handler(request), which returns (status, body, headers) or raises a requests exception
+
+	Every sent request is recorded in requests as (method, url, stream), and every response body in bodies; a body's released attribute tells whether its response was closed.'''
+
+	def __init__(self, handler):
+		super().__init__()
+		self._handler = handler
+		self._lock = threading.Lock()
+		self.requests = []
+		self.bodies = []
+
+	def send(self, request, stream = False, timeout = None, verify = True, cert = None, proxies = None):
+		with self._lock:
+			self.requests.append((request.method, request.url, stream))
+		status, body, headers = self._handler(request)
+		if isinstance(body, str):
+			body = body.encode('utf-8')
+		r = requests.Response()
+		r.status_code = status
+		r.headers = requests.structures.CaseInsensitiveDict(headers or {})
+		r.raw = _Body(body)
+		r.encoding = 'utf-8'
+		r.url = request.url
+		r.request = request
+		r.connection = self
+		with self._lock:
+			self.bodies.append(r.raw)
+		return r
+
+	def close(self):
+		pass
+
+
+def mount(session, handler):
+	'''Mount a FakeAdapter with handler for all http and https URLs of session and return it'''
+
+	adapter = FakeAdapter(handler)
+	session.mount('http://', adapter)
+	session.mount('https://', adapter)
+	return adapter
@@ -0,0 +1,204 @@
+import contextlib
+import sqlite3
+import threading
+import time
+
+import pytest
+import snscrape.base
+import snscrape.tests.adapter
+
+
+class _Scraper(snscrape.base.Scraper):
+	def get_items(self):
+		return iter(())
+
+
+def _paged(lastPage, delay = 0):
+	fetched = []
+	def fetch_page(pageNumber):
+		time.sleep(delay)
+		fetched.append(pageNumber)
+		return pageNumber
+	def next_page(pageNumber):
+		return pageNumber + 1 if pageNumber < lastPage else None
+	return fetched, next_page, fetch_page
+
+
+@pytest.mark.parametrize('pipeline', [False, True])
+def test_iter_pages_order(pipeline):
+	fetched, next_page, fetch_page = _paged(9)
+	assert list(_Scraper()._iter_pages(0, next_page, fetch_page, pipeline = pipeline)) == list(range(10))
+	assert fetched == list(range(1, 10))
+
+
+def test_iter_pages_pipeline_stops_on_close():
+	fetched, next_page, fetch_page = _paged(100, delay = 0.01)
+	pages = _Scraper()._iter_pages(0, next_page, fetch_page, pipeline = True)
+	assert [next(pages) for _ in range(3)] == [0, 1, 2]
+	pages.close()
+	# At most the page following the last one consumed was retrieved ahead; it is cancelled if it had not started yet
+	time.sleep(0.1)
+	assert fetched in ([1, 2], [1, 2, 3])
+
+
+def _counting_iterable(count, failAt = None):
+	state = {'produced': 0, 'closed': False}
+	def gen():
+		try:
+			for i in range(count):
+				if i == failAt:
+					raise ValueError(i)
+				state['produced'] += 1
+				yield i
+		finally:
+			state['closed'] = True
+	return state, gen()
+
+
+def test_iter_in_background_yields_all_items():
+	state, it = _counting_iterable(20)
+	assert list(snscrape.base._iter_in_background(it, 3)) == list(range(20))
+	assert state['closed']
+
+
+def test_iter_in_background_stops_producer_on_close():
+	state, it = _counting_iterable(1000)
+	items = snscrape.base._iter_in_background(it, 2)
+	assert next(items) == 0
+	items.close()
+	time.sleep(0.1)
+	assert state['closed']
+	# The consumed item, the read-ahead, and at most one item in progress when stopping
+	assert state['produced'] <= 4
+
+
+def test_iter_in_background_reraises_in_caller():
+	state, it = _counting_iterable(10, failAt = 5)
+	items = snscrape.base._iter_in_background(it, 2)
+	assert [next(items) for _ in range(5)] == list(range(5))
+	with pytest.raises(ValueError):
+		next(items)
+	time.sleep(0.1)
+	assert state['closed']
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_request_goes_through_session(stream):
+	scraper = _Scraper()
+	adapter = snscrape.tests.adapter.mount(scraper._session, lambda request: (200, b'hello', {'Content-Type': 'text/plain'}))
+	r = scraper._get('https://example.org/page', params = {'a': 1}, stream = stream)
+	assert r.status_code == 200
+	assert r.text == 'hello'
+	assert adapter.requests == [('GET', 'https://example.org/page?a=1', stream)]
+
+
+def test_request_retries_until_callback_accepts(monkeypatch):
+	monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+	statuses = iter([503, 503, 200])
+	scraper = _Scraper(retries = 3)
+	adapter = snscrape.tests.adapter.mount(scraper._session, lambda request: (next(statuses), b'', {}))
+	r = scraper._get('https://example.org/', responseOkCallback = lambda r: (r.status_code == 200, f'status {r.status_code}'), stream = True)
+	assert r.status_code == 200
+	assert len(adapter.requests) == 3
+	# Rejected streamed responses are closed before retrying
+	assert [body.released for body in adapter.bodies] == [True, True, False]
+
+
+def test_request_gives_up(monkeypatch):
+	monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+	scraper = _Scraper(retries = 2)
+	adapter = snscrape.tests.adapter.mount(scraper._session, lambda request: (500, b'', {}))
+	with pytest.raises(snscrape.base.ScraperException):
+		scraper._get('https://example.org/', responseOkCallback = lambda r: (r.status_code == 200, None))
+	assert len(adapter.requests) == 3
+
+
+def test_spillable_queue_fifo_across_spills():
+	q = snscrape.base._SpillableQueue(3)
+	expected = []
+	counter = 0
+	spilled = False
+	# Interleave puts and gets so that items are spilled, read back, and spilled again
+	for puts, gets in [(5, 2), (4, 6), (7, 3), (0, 5)]:
+		for _ in range(puts):
+			q.put((counter, f'tweet-{counter}'))
+			expected.append([counter, f'tweet-{counter}'])
+			counter += 1
+		spilled = spilled or q._file is not None
+		for _ in range(gets):
+			assert list(q.get()) == expected.pop(0) # Spilled tuples come back as lists
+		assert len(q) == len(expected)
+	assert spilled
+	assert not q and q._file is None # The file is closed once drained
+
+
+def test_spillable_queue_close():
+	q = snscrape.base._SpillableQueue(1)
+	for i in range(5):
+		q.put(i)
+	file = q._file
+	q.close()
+	assert file.closed
+
+
+def test_lru_dedup_filter_evicts_least_recently_seen():
+	f = snscrape.base.LRUDedupFilter(3)
+	assert [f.add(key) for key in 'abc'] == [True, True, True]
+	assert not f.add('a') # Now the most recently seen
+	assert f.add('d') # Evicts b
+	assert [f.add(key) for key in 'acd'] == [False, False, False]
+	assert f.add('b') # Forgotten, so new again; evicts a, the least recently seen after the lookups above
+	assert f.add('a')
+
+
+def test_bloom_dedup_filter_sizing():
+	# m = -n ln p / (ln 2)^2 bits and k = m / n ln 2 hash functions
+	f = snscrape.base.BloomDedupFilter(1000, errorRate = 0.001)
+	assert (f._size, f._hashCount) == (14378, 10)
+	assert len(f._bits) == 1798
+	f = snscrape.base.BloomDedupFilter(10000, errorRate = 0.01)
+	assert (f._size, f._hashCount) == (95851, 7)
+
+
+def test_bloom_dedup_filter_no_false_negatives():
+	f = snscrape.base.BloomDedupFilter(1000, errorRate = 0.01)
+	keys = [f'key-{i}' for i in range(1000)]
+	newKeys = sum(f.add(key) for key in keys)
+	assert newKeys >= 980 # Only false positives, at about the error rate
+	assert not any(f.add(key) for key in keys)
+	f.add('123')
+	assert not f.add(123) # Keys are compared by their string representation
+	# Each addition raises the rate, so only a few more keys are checked
+	assert sum(not f.add(f'other-{i}') for i in range(200)) <= 10
+
+
+def test_sqlite_dedup_filter_persists_across_runs(tmp_path):
+	path = str(tmp_path / 'seen.sqlite')
+	with snscrape.base.SQLiteDedupFilter(path, namespace = 'a') as f:
+		assert [f.add(key) for key in ['1', 2, '1']] == [True, True, False]
+	with snscrape.base.SQLiteDedupFilter(path, namespace = 'a') as f:
+		assert not f.add(1) and not f.add('2')
+		assert f.add('3')
+	with snscrape.base.SQLiteDedupFilter(path, namespace = 'b') as f:
+		assert f.add('1')
+
+
+def test_sqlite_dedup_filter_flush(tmp_path):
+	path = str(tmp_path / 'seen.sqlite')
+	def committed():
+		with contextlib.closing(sqlite3.connect(path)) as connection:
+			return connection.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+	f = snscrape.base.SQLiteDedupFilter(path)
+	for i in range(5):
+		f.add(i)
+	assert committed() == 0
+	f.flush()
+	assert committed() == 5
+	for i in range(5, 1004):
+		f.add(i)
+	assert committed() == 5
+	f.add(1004) # The 1000th key since the flush
+	f.add(1005)
+	assert committed() == 1005
+	f.close()
+	assert committed() == 1006
@@ -0,0 +1,346 @@
+import datetime
+import json
+import os
+import time
+
+import pytest
+import requests
+import snscrape.base
+import snscrape.tests.adapter
+from snscrape.modules.mastodon import Boost, MastodonProfileScraper, MastodonProfilesScraper, Toot, _InstanceRateLimiter, _RateLimitStore
+
+
+def _rate_limit_headers():
+	reset = datetime.datetime.fromtimestamp(time.time() + 300, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+	return {'X-RateLimit-Limit': '300', 'X-RateLimit-Remaining': '299', 'X-RateLimit-Reset': reset}
+
+
+def _entry(tootId):
+	return f'''<div class="entry"><div class="status">
+<div class="status__info"><a class="status__relative-time" href="https://example.org/@alice/{tootId}"><data class="dt-published" value="2022-10-19T12:00:{tootId % 60:02d}+00:00"></data></a>
+<a class="status__display-name" href="https://example.org/@alice"><img class="u-photo" src="/avatar.png"><span class="display-name"><strong>Alice</strong> <span>@alice@example.org</span></span></a></div>
+<div class="status__content"><p>Toot {tootId} with <a href="https://example.com/{tootId}">a link</a></p></div>
+</div></div>'''
+
+
+def _profile_page(tootIds, nextMaxId):
+	loadMore = f'<div class="entry"><a class="load-more" href="/@alice/with_replies?max_id={nextMaxId}">Load more</a></div>' if nextMaxId else ''
+	return f'<html><body><div class="activity-stream">{"".join(map(_entry, tootIds))}{loadMore}</div></body></html>'
+
+
+def _profile_handler(pages, failAt = None):
+	# pages maps max_id (None for the first page) to the toot IDs on that page, newest first
+	def handler(request):
+		maxId = request.url.split('max_id=')[1] if 'max_id=' in request.url else None
+		if failAt is not None and maxId == failAt:
+			return 500, 'Internal Server Error', _rate_limit_headers()
+		tootIds = pages[maxId]
+		nextMaxId = str(tootIds[-1]) if str(tootIds[-1]) in pages else None
+		return 200, _profile_page(tootIds, nextMaxId), _rate_limit_headers()
+	return handler
+
+
+_PAGES = {None: [30, 29, 28], '28': [27, 26, 25], '25': [24, 23]}
+
+
+def _scraper(**kwargs):
+	return MastodonProfileScraper('@alice@example.org', rateLimits = _RateLimitStore(), retries = 0, **kwargs)
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'pipeline': True}, {'stream': True}])
+def test_profile_pages(kwargs):
+	scraper = _scraper(**kwargs)
+	adapter = snscrape.tests.adapter.mount(scraper._session, _profile_handler(_PAGES))
+	toots = list(scraper.get_items())
+	assert [toot.id for toot in toots] == [str(i) for i in range(30, 22, -1)]
+	assert all(isinstance(toot, Toot) and toot.links == [f'https://example.com/{toot.id}'] for toot in toots)
+	assert [stream for _, _, stream in adapter.requests] == [kwargs.get('stream', False)] * 3
+	if kwargs.get('stream'):
+		assert all(body.released for body in adapter.bodies)
+
+
+def test_profile_stream_matches_html():
+	html = _scraper()
+	snscrape.tests.adapter.mount(html._session, _profile_handler(_PAGES))
+	streamed = _scraper(stream = True)
+	snscrape.tests.adapter.mount(streamed._session, _profile_handler(_PAGES))
+	assert list(streamed.get_items()) == list(html.get_items())
+
+
+_VARIED_ENTRIES = [
+	# Custom emoji in the display name, mention, hashtag, and a comment in the content
+	'''<div class="entry"><div class="status"><div class="status__info"><a class="status__relative-time" href="https://example.org/@alice/40"><data class="dt-published" value="2022-10-19T12:00:40+00:00"></data></a>
+<a class="status__display-name" href="https://example.org/@alice"><img class="u-photo" src="/avatar.png"><span class="display-name"><strong>Alice <img class="custom-emoji" alt=":blob:" data-original="/emoji/blob.png" data-static="/emoji/blob_static.png"> &amp; co</strong> <span>@alice@example.org</span></span></a></div>
+<div class="status__content"><p>Hi <span class="h-card"><a class="u-url mention" href="https://other.example/@bob">@<span>bob</span></a></span> <a class="mention hashtag" href="/tags/tag">#<span>tag</span></a><!-- hidden --></p><p>Second <a href="/relative">paragraph</a></p></div></div></div>''',
+	# Spoiler, attachments, and a poll
+	'''<div class="entry"><div class="status"><div class="status__info"><a class="status__relative-time" href="https://example.org/@alice/39"><data class="dt-published" value="2022-10-19T12:00:39+00:00"></data></a>
+<a class="status__display-name" href="https://example.org/@alice"><img class="u-photo" src="/avatar.png"><span class="display-name"><strong>Alice</strong> <span>@alice@example.org</span></span></a></div>
+<div class="status__content"><p><span class="p-summary">Spoiler </span><a class="status__content__spoiler-link" href="#">Show more</a></p><div class="e-content"><p>Hidden</p><p>text</p></div></div>
+<div class="attachment-list"><ul><li><a href="/media/1.png"> one.png </a></li><li><a href="/media/2.png">two.png</a></li></ul></div>
+<div data-component="Poll" data-props='{"poll": {"id": "7", "expires_at": "2022-10-20T12:00:00.000Z", "multiple": false, "options": [{"title": "Yes", "votes_count": 3}], "votes_count": 3, "voters_count": 3}}'></div></div></div>''',
+	# A boost of a toot by an account on an ancient instance
+	'''<div class="entry"><div class="status__prepend"><i class="fa fa-retweet"></i><a class="status__display-name" href="/@alice"><strong>Alice</strong></a></div>
+<div class="status"><div class="status__info"><a class="status__relative-time" href="https://old.example/@carol/38"><data class="dt-published" value="2022-10-19T12:00:38+00:00"></data></a>
+<a class="status__display-name" href="https://old.example/@carol"><img class="u-photo" src="https://old.example/avatar.png"><span class="display-name"><strong>Carol</strong> <span>@carol</span></span></a></div>
+<div class="status__content"><p>Boosted</p></div></div></div>''',
+]
+
+
+def test_profile_stream_matches_html_on_varied_entries():
+	def handler(request):
+		return 200, f'<html><body><div class="activity-stream">{"".join(_VARIED_ENTRIES)}</div></body></html>', _rate_limit_headers()
+	html = _scraper()
+	snscrape.tests.adapter.mount(html._session, handler)
+	streamed = _scraper(stream = True)
+	snscrape.tests.adapter.mount(streamed._session, handler)
+	toots = list(html.get_items())
+	assert [toot.toot.id if isinstance(toot, Boost) else toot.id for toot in toots] == ['40', '39', '38']
+	assert toots[0].user.displayNameWithCustomEmojis[1].shortName == ':blob:'
+	assert toots[1].spoilerText == 'Hidden\n\ntext' and len(toots[1].attachments) == 2 and toots[1].poll.id == '7'
+	assert list(streamed.get_items()) == toots
+
+
+def test_profile_stream_closes_responses_on_error():
+	scraper = _scraper(stream = True)
+	adapter = snscrape.tests.adapter.mount(scraper._session, _profile_handler(_PAGES, failAt = '28'))
+	items = scraper.get_items()
+	assert [next(items).id for _ in range(3)] == ['30', '29', '28']
+	with pytest.raises(snscrape.base.ScraperException):
+		next(items)
+	assert len(adapter.bodies) == 2 and all(body.released for body in adapter.bodies)
+
+
+def test_profile_stream_closes_response_when_abandoned():
+	scraper = _scraper(stream = True)
+	adapter = snscrape.tests.adapter.mount(scraper._session, _profile_handler(_PAGES))
+	items = scraper.get_items()
+	next(items)
+	items.close()
+	assert len(adapter.bodies) == 1 and adapter.bodies[0].released
+
+
+def test_profile_pipeline_and_stream_are_exclusive():
+	with pytest.raises(ValueError):
+		_scraper(pipeline = True, stream = True)
+
+
+def _api_status(tootId):
+	return {
+		'id': str(tootId),
+		'url': f'https://example.org/@alice/{tootId}',
+		'uri': f'https://example.org/users/alice/statuses/{tootId}',
+		'created_at': f'2022-10-19T12:00:{tootId % 60:02d}.000Z',
+		'account': {'id': '1', 'acct': 'alice', 'username': 'alice', 'display_name': 'Alice', 'avatar': 'https://example.org/avatar.png', 'url': 'https://example.org/@alice', 'emojis': []},
+		'content': f'<p>Toot {tootId}</p>',
+		'spoiler_text': '',
+		'media_attachments': [],
+		'poll': None,
+	}
+
+
+def _api_handler(lookupStatus = 200, failStatusesAt = None):
+	# Serves the account lookup and statuses API endpoints and, for the fallback, the HTML pages from _PAGES
+	htmlHandler = _profile_handler(_PAGES)
+	def handler(request):
+		if '/api/v1/accounts/lookup' in request.url:
+			if lookupStatus == 404:
+				return 404, '{"error":"Record not found"}', _rate_limit_headers()
+			return 200, '{"id":"1","acct":"alice"}', _rate_limit_headers()
+		if '/api/v1/accounts/1/statuses' in request.url:
+			maxId = int(request.url.split('max_id=')[1]) if 'max_id=' in request.url else 31
+			if failStatusesAt is not None and maxId == failStatusesAt:
+				return 403, '{"error":"This method requires an authenticated user"}', _rate_limit_headers()
+			statuses = [_api_status(i) for i in range(maxId - 1, max(maxId - 4, 22), -1)]
+			return 200, json.dumps(statuses), _rate_limit_headers()
+		return htmlHandler(request)
+	return handler
+
+
+def test_profile_api():
+	scraper = _scraper(api = True)
+	adapter = snscrape.tests.adapter.mount(scraper._session, _api_handler())
+	assert [toot.id for toot in scraper.get_items()] == [str(i) for i in range(30, 22, -1)]
+	assert all('/api/v1/' in url for _, url, _ in adapter.requests)
+
+
+def test_profile_api_lookup_not_found_falls_back_to_html():
+	# Instances before 3.4.0 answer the lookup with a 404 because they treat "lookup" as an account ID
+	scraper = _scraper(api = True)
+	adapter = snscrape.tests.adapter.mount(scraper._session, _api_handler(lookupStatus = 404))
+	assert [toot.id for toot in scraper.get_items()] == [str(i) for i in range(30, 22, -1)]
+	assert any(url.endswith('/@alice/with_replies') for _, url, _ in adapter.requests)
+
+
+def test_profile_api_unavailable_mid_pagination_does_not_start_over():
+	scraper = _scraper(api = True)
+	adapter = snscrape.tests.adapter.mount(scraper._session, _api_handler(failStatusesAt = 28))
+	items = scraper.get_items()
+	assert [next(items).id for _ in range(3)] == ['30', '29', '28']
+	with pytest.raises(snscrape.base.ScraperException):
+		next(items)
+	assert all('/api/v1/' in url for _, url, _ in adapter.requests)
+
+
+class _Clock:
+	def __init__(self, monkeypatch, now = 1_700_000_000.0):
+		self.now = now
+		self.sleeps = []
+		monkeypatch.setattr(time, 'time', lambda: self.now)
+		monkeypatch.setattr(time, 'sleep', self.sleep)
+
+	def sleep(self, seconds):
+		self.sleeps.append(seconds)
+		self.now += seconds
+
+
+class _Response:
+	def __init__(self, status_code = 200, headers = None):
+		self.status_code = status_code
+		self.headers = headers or {}
+
+
+def _iso(timestamp):
+	return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def test_rate_limiter_default_spacing(monkeypatch):
+	clock = _Clock(monkeypatch)
+	limiter = _InstanceRateLimiter()
+	for _ in range(3):
+		limiter.wait()
+	assert clock.sleeps == [3, 3]
+
+
+def test_rate_limiter_learns_mastodon_headers(monkeypatch):
+	clock = _Clock(monkeypatch)
+	limiter = _InstanceRateLimiter()
+	limiter.wait()
+	limiter.update(_Response(headers = {'X-RateLimit-Limit': '300', 'X-RateLimit-Remaining': '299', 'X-RateLimit-Reset': _iso(clock.now + 300)}))
+	assert (limiter.limit, limiter.remaining, limiter.reset) == (300, 299, int(clock.now) + 300)
+	# The default spacing no longer applies once the limit is known
+	for _ in range(10):
+		limiter.wait()
+	assert clock.sleeps == []
+	assert limiter.remaining == 289
+
+
+@pytest.mark.parametrize('reset, expected', [('60', 1_700_000_060), ('1700000120', 1_700_000_120)])
+def test_rate_limiter_numeric_reset(monkeypatch, reset, expected):
+	_Clock(monkeypatch)
+	limiter = _InstanceRateLimiter()
+	limiter.update(_Response(headers = {'X-RateLimit-Limit': '100', 'X-RateLimit-Remaining': '50', 'X-RateLimit-Reset': reset}))
+	assert limiter.reset == expected
+
+
+def test_rate_limiter_ignores_malformed_headers(monkeypatch):
+	_Clock(monkeypatch)
+	limiter = _InstanceRateLimiter()
+	limiter.update(_Response(headers = {'X-RateLimit-Limit': '100', 'X-RateLimit-Remaining': 'many', 'X-RateLimit-Reset': '60'}))
+	limiter.update(_Response(headers = {'X-RateLimit-Limit': '100', 'X-RateLimit-Remaining': '50', 'X-RateLimit-Reset': 'tomorrow'}))
+	assert limiter.limit is None
+
+
+def test_rate_limiter_keeps_lowest_remaining_within_window(monkeypatch):
+	clock = _Clock(monkeypatch)
+	limiter = _InstanceRateLimiter()
+	reset = _iso(clock.now + 300)
+	limiter.update(_Response(headers = {'X-RateLimit-Limit': '300', 'X-RateLimit-Remaining': '50', 'X-RateLimit-Reset': reset}))
+	limiter.update(_Response(headers = {'X-RateLimit-Limit': '300', 'X-RateLimit-Remaining': '60', 'X-RateLimit-Reset': reset}))
+	assert limiter.remaining == 50
+
+
+def test_rate_limiter_spreads_reserve_until_reset(monkeypatch):
+	clock = _Clock(monkeypatch)
+	start = clock.now
+	limiter = _InstanceRateLimiter(limit = 100, remaining = 10, reset = start + 100)
+	for _ in range(10):
+		limiter.wait()
+	# The ten remaining requests are spread over the window instead of being made at once
+	assert len(clock.sleeps) == 9 and all(sleep > 5 for sleep in clock.sleeps)
+	assert clock.now < start + 100
+	# With nothing left, the next request waits for the reset
+	limiter.wait()
+	assert clock.now == start + 100
+	# After which the full limit is available again
+	limiter.wait()
+	assert clock.now == start + 100
+	assert limiter.remaining == 99
+
+
+def test_rate_limiter_waits_on_429(monkeypatch):
+	clock = _Clock(monkeypatch)
+	start = clock.now
+	limiter = _InstanceRateLimiter()
+	assert limiter.response_ok(_Response(429, {'Retry-After': '30'})) == (False, 'rate-limited')
+	assert clock.sleeps == [30]
+	assert limiter.remaining == 0 and limiter.reset == start + 30
+	assert limiter.response_ok(_Response(200)) == (True, None)
+
+
+def test_rate_limiter_429_uses_advertised_reset(monkeypatch):
+	clock = _Clock(monkeypatch)
+	start = clock.now
+	limiter = _InstanceRateLimiter()
+	assert limiter.response_ok(_Response(429, {'X-RateLimit-Limit': '300', 'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': _iso(start + 120), 'Retry-After': '30'}))[0] is False
+	assert clock.now == start + 120
+
+
+def test_rate_limit_store_persists(monkeypatch, tmp_path):
+	clock = _Clock(monkeypatch)
+	file = str(tmp_path / 'limits.json')
+	store = _RateLimitStore(file)
+	store.limiter('a.example').update(_Response(headers = {'X-RateLimit-Limit': '300', 'X-RateLimit-Remaining': '200', 'X-RateLimit-Reset': '60'}))
+	store.limiter('b.example') # Nothing learned, not persisted
+	store.save()
+	assert not os.path.exists(file) # At most every 10 seconds
+	clock.now += 10
+	store.save()
+	with open(file, 'r') as fp:
+		assert json.load(fp) == {'a.example': {'limit': 300, 'remaining': 200, 'reset': clock.now - 10 + 60}}
+
+	# Another process's domains are kept
+	other = _RateLimitStore(file)
+	other.limiter('c.example').update(_Response(headers = {'X-RateLimit-Limit': '100', 'X-RateLimit-Remaining': '100', 'X-RateLimit-Reset': '60'}))
+	other.save(force = True)
+	restored = _RateLimitStore(file)
+	assert (restored.limiter('a.example').limit, restored.limiter('a.example').remaining) == (300, 200)
+	assert restored.limiter('c.example').limit == 100
+	assert restored.limiter('b.example').limit is None
+
+
+def test_profiles_failing_accounts_do_not_stop_other_instances(monkeypatch):
+	# Each account yields three toots; the accounts named fail* raise after the first one
+	errors = {'@fail1@b.example': snscrape.base.ScraperException('boom'), '@fail2@b.example': KeyError('content'), '@fail3@b.example': ValueError('bad date')}
+	def get_items(self):
+		account = self._url.split('/')[-1] + '@' + self._url.split('/')[2]
+		for i in range(3):
+			yield f'{account}/{i}'
+			if account in errors:
+				raise errors[account]
+	monkeypatch.setattr(MastodonProfileScraper, '_get_items', get_items)
+	accounts = ['@alice@a.example', '@fail1@b.example', '@fail2@b.example', '@bob@c.example', '@fail3@b.example', '@carol@b.example', '@dave@b.example', '@erin@a.example']
+	scraper = MastodonProfilesScraper(accounts, workers = 3, rateLimits = _RateLimitStore())
+	items = list(scraper._get_items())
+	assert len(items) == len(set(items))
+	expected = {f'{account}/{i}' for account in ('@alice@a.example', '@erin@a.example', '@bob@c.example') for i in range(3)}
+	expected |= {f'{account}/0' for account in errors}
+	# After three consecutive failures, the remaining accounts on that instance are skipped
+	assert set(items) == expected
+
+
+def test_profiles_closes_instance_sessions(monkeypatch):
+	sessions = set()
+	closed = set()
+	def get_items(self):
+		sessions.add(self._session)
+		yield self._url
+	originalClose = requests.Session.close
+	def close(self):
+		closed.add(self)
+		originalClose(self)
+	monkeypatch.setattr(MastodonProfileScraper, '_get_items', get_items)
+	monkeypatch.setattr(requests.Session, 'close', close)
+	scraper = MastodonProfilesScraper(['@alice@a.example', '@bob@b.example', '@carol@a.example'], workers = 2, rateLimits = _RateLimitStore())
+	assert len(list(scraper._get_items())) == 3
+	assert len(sessions) == 2
+	assert sessions <= closed
@@ -0,0 +1,227 @@
+import datetime
+import json
+import random
+import threading
+import urllib.parse
+
+import pytest
+from snscrape.modules.reddit import Comment, RedditSubredditScraper, Submission, _iter_tree_order
+import snscrape.tests.adapter
+
+
+def _base36(n):
+	digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+	s = ''
+	while n:
+		n, r = divmod(n, 36)
+		s = digits[r] + s
+	return s or '0'
+
+
+def _comments(times):
+	'''Pushshift comment objects with the given creation times and increasing IDs'''
+	return [{'id': _base36(1_000_000 + i), 'created_utc': t, 'body': f'Comment {i}', 'subreddit': 'example', 'permalink': f'/r/example/comments/abc/_/{_base36(1_000_000 + i)}/'} for i, t in enumerate(sorted(times))]
+
+
+def _fake_get_api(objs):
+	'''A fake Pushshift search endpoint: after and before are exclusive, and items of the same second are returned in a fixed order'''
+	def get_api(url, params = None):
+		after, before = params.get('after', float('-inf')), params.get('before', float('inf'))
+		data = [d for d in objs if after < d['created_utc'] < before]
+		data.sort(key = lambda d: (d['created_utc'], int(d['id'], 36)), reverse = params['sort'] == 'desc')
+		return {'data': data[:int(params['size'])]}
+	return get_api
+
+
+_SIZE = 10
+
+
+def _scrape(objs, workers, after = None, sharded = True):
+	scraper = RedditSubredditScraper('example', submissions = False, workers = workers, before = 3000, after = after)
+	scraper._get_api = _fake_get_api(objs)
+	iterApi = scraper._iter_api_sharded if sharded else scraper._iter_api
+	return list(iterApi('https://api.pushshift.io/reddit/search/comment/', {'subreddit': 'example', 'size': str(_SIZE)}))
+
+
+def _ordered_ids(objs, after = None):
+	return [f't1_{d["id"]}' for d in sorted(objs, key = lambda d: (d['created_utc'], int(d['id'], 36)), reverse = True) if after is None or d['created_utc'] > after]
+
+
+def _bursty_times(seed, burstSize, bursts = 20):
+	rng = random.Random(seed)
+	burstTimes = rng.sample(range(1000, 2000), bursts)
+	# Isolated items in the other seconds and same-second bursts of up to burstSize items, some of them spanning two pages
+	times = rng.sample(sorted(set(range(1000, 2000)) - set(burstTimes)), 300)
+	for t in burstTimes:
+		times.extend([t] * rng.randrange(2, burstSize + 1))
+	return times
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+@pytest.mark.parametrize('after', [None, 1200])
+@pytest.mark.parametrize('seed', range(5))
+def test_sharded_newest_first_without_gaps(workers, after, seed):
+	objs = _comments(_bursty_times(seed, _SIZE))
+	expected = _ordered_ids(objs, after)
+	items = _scrape(objs, workers, after)
+	assert sorted((item.date for item in items), reverse = True) == [item.date for item in items]
+	assert len({item.id for item in items}) == len(items)
+	assert {item.id for item in items} == set(expected)
+
+
+_PATHS = pytest.mark.parametrize('workers, sharded', [(1, False), (1, True), (4, True)])
+
+
+@_PATHS
+def test_second_spanning_two_pages(workers, sharded):
+	# The second page starts with the last second of the first one again
+	objs = _comments([1400] * 3 + [1500] * 8 + [1600] * 5)
+	items = _scrape(objs, workers, sharded = sharded)
+	assert [item.id for item in items] == _ordered_ids(objs)
+
+
+@_PATHS
+def test_second_with_more_than_a_page(workers, sharded, caplog):
+	objs = _comments(list(range(1400, 1410)) + [1500] * (_SIZE + 5) + list(range(1600, 1603)))
+	items = _scrape(objs, workers, sharded = sharded)
+	ids = [item.id for item in items]
+	assert len(set(ids)) == len(ids)
+	assert sorted((item.date for item in items), reverse = True) == [item.date for item in items]
+	# Only the items of the crowded second can be missing, and at least a page of them is retrieved
+	burst = {f't1_{d["id"]}' for d in objs if d['created_utc'] == 1500}
+	assert set(ids) - burst == set(_ordered_ids(objs)) - burst
+	assert len(set(ids) & burst) >= _SIZE
+	assert f'More than {_SIZE} results at 1500, some may be missing' in caplog.text
+
+
+class _Page(dict):
+	'''An API response that reports when its data is read'''
+
+	def __init__(self, response, onRead):
+		super().__init__(response)
+		self._onRead = onRead
+
+	def __getitem__(self, key):
+		self._onRead()
+		return super().__getitem__(key)
+
+
+@pytest.mark.parametrize('workers', [2, 4])
+def test_sharded_bounds_windows_in_flight(workers):
+	objs = _comments(_bursty_times(0, _SIZE))
+	getApi = _fake_get_api(objs)
+	lock = threading.Lock()
+	counts = {'requested': 0, 'read': 0, 'maxInFlight': 0}
+	def read():
+		with lock:
+			counts['read'] += 1
+	def get_api(url, params = None):
+		with lock:
+			counts['requested'] += 1
+			counts['maxInFlight'] = max(counts['maxInFlight'], counts['requested'] - counts['read'])
+		return _Page(getApi(url, params), read)
+
+	scraper = RedditSubredditScraper('example', submissions = False, workers = workers, before = 3000, after = 999)
+	scraper._get_api = get_api
+	items = list(scraper._iter_api_sharded('https://api.pushshift.io/reddit/search/comment/', {'subreddit': 'example', 'size': str(_SIZE)}))
+
+	assert sorted(item.id for item in items) == sorted(_ordered_ids(objs))
+	assert counts['requested'] > 3 * workers
+	assert counts['maxInFlight'] <= workers
+
+
+def _submissions(times):
+	return [{'id': _base36(2_000_000 + i), 'created_utc': t, 'title': f'Submission {i}', 'url': f'https://example.org/{i}', 'subreddit': 'example', 'permalink': f'/r/example/comments/{_base36(2_000_000 + i)}/_/'} for i, t in enumerate(sorted(times))]
+
+
+def _pushshift_handler(submissions, comments, broken = None):
+	'''A FakeAdapter handler serving both Pushshift search endpoints; the endpoint broken returns a malformed body'''
+	getApis = {'submission': _fake_get_api(submissions), 'comment': _fake_get_api(comments)}
+	def handler(request):
+		url = urllib.parse.urlsplit(request.url)
+		endpoint = url.path.rstrip('/').split('/')[-1]
+		if endpoint == broken:
+			return 200, b'{"data": [', {}
+		params = {k: (v if k == 'sort' else int(v)) for k, v in urllib.parse.parse_qsl(url.query) if k in ('after', 'before', 'size', 'sort')}
+		return 200, json.dumps(getApis[endpoint](url, params)), {'Content-Type': 'application/json'}
+	return handler
+
+
+def _merge_scraper(handler):
+	scraper = RedditSubredditScraper('example', before = 3000)
+	adapter = snscrape.tests.adapter.mount(scraper._session, handler)
+	return adapter, scraper._iter_api_submissions_and_comments({'subreddit': 'example'})
+
+
+def test_submissions_and_comments_interleaved_by_date():
+	rng = random.Random(0)
+	submissions = _submissions(rng.sample(range(1000, 2000), 300))
+	comments = _comments(rng.sample(range(1000, 2000), 700) + [1500, 1500])
+	_, items = _merge_scraper(_pushshift_handler(submissions, comments))
+	items = list(items)
+
+	assert [item.date for item in items] == sorted((item.date for item in items), reverse = True)
+	assert sorted(item.id for item in items if isinstance(item, Submission)) == sorted(f't3_{d["id"]}' for d in submissions)
+	assert sorted(item.id for item in items if isinstance(item, Comment)) == sorted(f't1_{d["id"]}' for d in comments)
+	# Comments go first within a second
+	for newer, older in zip(items, items[1:]):
+		assert not (newer.date == older.date and isinstance(newer, Submission) and isinstance(older, Comment))
+
+
+@pytest.mark.parametrize('broken', ['submission', 'comment'])
+def test_submissions_and_comments_stream_error_reaches_consumer(broken):
+	_, items = _merge_scraper(_pushshift_handler(_submissions(range(1000, 1100)), _comments(range(1000, 1100)), broken = broken))
+	with pytest.raises(json.JSONDecodeError):
+		list(items)
+
+
+def test_submissions_and_comments_closed_on_early_stop():
+	threadsBefore = set(threading.enumerate())
+	adapter, items = _merge_scraper(_pushshift_handler(_submissions(range(1000, 6000)), _comments(range(1000, 6000))))
+	assert len([next(items) for _ in range(10)]) == 10
+	items.close()
+
+	for thread in set(threading.enumerate()) - threadsBefore:
+		thread.join(5)
+		assert not thread.is_alive()
+	# Each stream stopped after at most its read-ahead of two pages plus the page it was on
+	assert len(adapter.requests) <= 6
+
+
+def _tree_comment(id_, parentId):
+	return Comment(author = 'someone', body = id_, date = datetime.datetime(2022, 10, 19, tzinfo = datetime.timezone.utc), id = f't1_{id_}', parentId = parentId and f't{3 if parentId == "root" else 1}_{parentId}', subreddit = 'example', url = f'https://old.reddit.com/r/example/comments/root/_/{id_}/')
+
+
+def _tree_order(pairs):
+	return [comment.body for comment in _iter_tree_order('t3_root', (_tree_comment(id_, parentId) for id_, parentId in pairs))]
+
+
+def test_tree_order_keeps_ordered_input():
+	pairs = [('a', 'root'), ('b', 'a'), ('c', 'b'), ('d', 'root'), ('e', 'a')]
+	assert _tree_order(pairs) == ['a', 'b', 'c', 'd', 'e']
+
+
+def test_tree_order_holds_replies_until_their_parent():
+	pairs = [('c', 'b'), ('e', 'a'), ('b', 'a'), ('d', 'root'), ('f', 'c'), ('a', 'root')]
+	# d has its parent already; a releases its replies depth-first in their original order
+	assert _tree_order(pairs) == ['d', 'a', 'e', 'b', 'c', 'f']
+
+
+def test_tree_order_is_lazy():
+	consumed = []
+	def comments():
+		for id_, parentId in [('b', 'a'), ('a', 'root'), ('c', 'root')]:
+			consumed.append(id_)
+			yield _tree_comment(id_, parentId)
+	it = _iter_tree_order('t3_root', comments())
+	assert [next(it).body, next(it).body] == ['a', 'b']
+	assert consumed == ['b', 'a']
+
+
+def test_tree_order_orphans_at_the_end(caplog):
+	pairs = [('x2', 'x1'), ('a', 'root'), ('y1', 'gone2'), ('x1', 'gone1'), ('x3', 'x2'), ('z', None), ('y2', 'gone2')]
+	# Orphans follow in the order in which their missing parents were first referenced, each followed by its replies
+	assert _tree_order(pairs) == ['a', 'y1', 'y2', 'x1', 'x2', 'x3', 'z']
+	assert 'Parent t1_gone2 of 2 comments not found' in caplog.text
+	assert 'Parent t1_gone1 of 1 comments not found' in caplog.text
+
@@ -0,0 +1,34 @@
+'''Micro-benchmark of post extraction from an already parsed channel page.
+
+Run with `python -m snscrape.tests.telegram.bench_extraction [PAGE ...]`; by default, the saved posts-page.html is used, which has photos, videos, GIFs, voice messages, forwards, and link previews.
+Unlike bench_parsers, parsing is done once up front, so only the walk over the posts and the construction of the items is timed.
+'''
+
+import collections
+import os.path
+import sys
+import timeit
+
+import snscrape.modules.telegram
+from snscrape.tests.telegram.bench_parsers import load_response
+
+
+def main(paths):
+    for path in paths:
+        r = load_response(path)
+        for parser in ('bs4', 'lxml'):
+            for postFormat in ('text', 'markdown', 'html'):
+                scraper = snscrape.modules.telegram.TelegramChannelScraper('example_channel', post_format=postFormat, parser=parser)
+                doc = scraper._parser.parse(r)
+                items = list(scraper._parser.page_to_items(scraper, doc, r.url))
+                mediaCounts = collections.Counter(type(medium).__name__ for item in items for medium in item.media or ())
+                number, total = timeit.Timer(lambda: list(scraper._parser.page_to_items(scraper, doc, r.url))).autorange()
+                perPage = total / number
+                print(f'{os.path.basename(path)} {parser:4} {postFormat:8}  {len(items)} posts, '
+                      f'{", ".join(f"{count} {name}" for name, count in sorted(mediaCounts.items()))}, '
+                      f'{sum(item.linkPreview is not None for item in items)} link previews  '
+                      f'{perPage * 1000:.2f} ms/page  {perPage / len(items) * 1e6:.0f} µs/post')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or [os.path.join(os.path.dirname(__file__), 'posts-page.html')])
@@ -0,0 +1,49 @@
+'''Benchmark the Telegram page parser backends against each other.
+
+Run with `python -m snscrape.tests.telegram.bench_parsers [PAGE ...]`; by default, the saved posts-page.html is used.
+Each backend parses the page and extracts all posts; the results are checked for equivalence before the timings are printed.
+'''
+
+import dataclasses
+import os.path
+import sys
+import timeit
+
+import requests
+
+import snscrape.modules.telegram
+
+
+def load_response(path):
+    r = requests.Response()
+    with open(path, 'rb') as fp:
+        r._content = fp.read()
+    r.encoding = 'utf-8'
+    r.url = 'https://t.me/s/example_channel'
+    return r
+
+
+def extract(scraper, r):
+    return list(scraper._parser.page_to_items(scraper, scraper._parser.parse(r), r.url))
+
+
+def main(paths):
+    for path in paths:
+        r = load_response(path)
+        for postFormat in ('text', 'markdown', 'html'):
+            scrapers = {parser: snscrape.modules.telegram.TelegramChannelScraper('example_channel', post_format=postFormat, parser=parser)
+                        for parser in ('bs4', 'lxml')}
+            results = {parser: extract(scraper, r) for parser, scraper in scrapers.items()}
+            if postFormat == 'html':
+                results = {parser: [dataclasses.replace(item, content=None) for item in items] for parser, items in results.items()}
+            equivalent = results['bs4'] == results['lxml']
+            timings = {}
+            for parser, scraper in scrapers.items():
+                number, total = timeit.Timer(lambda: extract(scraper, r)).autorange()
+                timings[parser] = total / number
+            print(f'{os.path.basename(path)} {postFormat:8}  {len(results["bs4"])} posts  equivalent: {equivalent}  '
+                  f'bs4: {timings["bs4"] * 1000:.2f} ms  lxml: {timings["lxml"] * 1000:.2f} ms  speedup: {timings["bs4"] / timings["lxml"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or [os.path.join(os.path.dirname(__file__), 'posts-page.html')])
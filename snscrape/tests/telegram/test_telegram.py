@@ -1,5 +1,35 @@
+import dataclasses
+import io
+import json
+import os.path
+import sqlite3
+
+import bs4
+import lxml.html
+import markdownify
 import pytest
-from snscrape.modules.telegram import Channel, TelegramChannelScraper
+import requests
+import snscrape.base
+import snscrape.modules.telegram
+from snscrape.modules.telegram import Channel, MessageIdGap, TelegramChannelScraper, TelegramChannelsScraper, TelegramPostScraper, TelegramGapScraper, TelegramPost, Photo, Video, VoiceMessage, Gif
+from snscrape.modules.telegram import _PageParser, _bs4MarkdownConverter, _lxmlMarkdownConverter
+from snscrape.modules.telegram import _archive_ids_from_jsonl, _archive_ids_from_sqlite
+
+
+def _posts_page_response(stream=False):
+    r = requests.Response()
+    with open(os.path.join(os.path.dirname(__file__), 'posts-page.html'), 'rb') as file:
+        if stream:
+            r.raw = io.BytesIO(file.read())
+        else:
+            r._content = file.read()
+    r.encoding = 'utf-8'
+    r.url = 'https://t.me/s/example_channel'
+    return r
+
+
+def _page_items(scraper, r):
+    return list(scraper._parser.page_to_items(scraper, scraper._parser.parse(r), r.url))
 
 
 def test_parse_channel_html():
@@ -57,3 +87,302 @@ def test_get_items_online_channel():
     latest_post = next(gen)
     previous_post = next(gen)
     assert latest_post.message_id > previous_post.message_id
+
+
+def test_parse_posts_page():
+    items = _page_items(TelegramChannelScraper('example_channel'), _posts_page_response())
+
+    assert len(items) == 20
+    assert [item.message_id for item in items] == sorted((item.message_id for item in items), reverse=True)
+    posts = {item.message_id: item for item in items}
+    assert posts[102].media == [Photo(url='https://cdn4.cdn-telegram.org/file/photo102.jpg')]
+    assert isinstance(posts[104].media[0], Video) and posts[104].media[0].duration == 42
+    assert isinstance(posts[107].media[0], VoiceMessage) and posts[107].content is None
+    assert isinstance(posts[115].media[0], Gif)
+    assert len(posts[110].media) == 3
+    assert posts[106].mentions == ['friend_channel'] and posts[106].hashtags == ['news', 'daily']
+    assert posts[103].linkPreview.title == 'A headline about things' and posts[103].outlinks is None
+    assert posts[113].forwarded.username == 'other_channel'
+    assert posts[122].views is None
+
+
+@pytest.mark.parametrize('post_format', ['text', 'markdown', 'html'])
+def test_lxml_parser_matches_bs4(post_format):
+    r = _posts_page_response()
+    bs4Items = _page_items(TelegramChannelScraper('example_channel', post_format=post_format), r)
+    lxmlItems = _page_items(TelegramChannelScraper('example_channel', post_format=post_format, parser='lxml'), r)
+
+    if post_format == 'html':
+        # Serialisation of the post HTML differs between the backends
+        bs4Items = [dataclasses.replace(item, content=None) for item in bs4Items]
+        lxmlItems = [dataclasses.replace(item, content=None) for item in lxmlItems]
+    assert lxmlItems == bs4Items
+
+
+@pytest.mark.parametrize('post_format', ['text', 'markdown', 'html'])
+def test_streaming_parser_matches_lxml(post_format):
+    lxmlItems = _page_items(TelegramChannelScraper('example_channel', post_format=post_format, parser='lxml'), _posts_page_response())
+    streamedItems = _page_items(TelegramChannelScraper('example_channel', post_format=post_format, parser='lxml-stream'), _posts_page_response(stream=True))
+
+    assert streamedItems == lxmlItems
+
+
+def test_page_parser_is_abstract():
+    class IncompleteParser(_PageParser):
+        def parse(self, r):
+            return r
+
+    with pytest.raises(TypeError):
+        IncompleteParser()
+
+
+@pytest.mark.parametrize('parser', ['bs4', 'lxml', 'lxml-stream'])
+def test_parser_pagination_links(parser):
+    scraper = TelegramChannelScraper('example_channel', parser=parser)
+    r = _posts_page_response(stream=scraper._parser.stream)
+    doc = scraper._parser.parse(r)
+
+    assert scraper._next_page_url((r, doc)) == 'https://t.me/s/example_channel?before=101'
+    assert len(list(scraper._parser.page_to_items(scraper, doc, r.url))) == 20
+
+
+def test_streaming_parser_derives_older_page_from_first_post():
+    scraper = TelegramChannelScraper('example_channel', parser='lxml-stream')
+    r = _posts_page_response(stream=True)
+    r.raw = io.BytesIO(r.raw.getvalue().replace(b'class="tme_messages_more js-messages_more"', b'class="js-messages_more"'))
+    doc = scraper._parser.parse(r)
+
+    assert scraper._parser.older_page_href(doc) == '?before=101'
+    assert scraper._next_page_url((r, doc)) == 'https://t.me/s/example_channel?before=101'
+    lxmlItems = _page_items(TelegramChannelScraper('example_channel', parser='lxml'), _posts_page_response())
+    assert list(scraper._parser.page_to_items(scraper, doc, r.url)) == lxmlItems
+
+
+class _FakePage(list):
+    def __init__(self, channel, ids):
+        super().__init__(ids)
+        self.channel = channel
+
+
+class _FakeChannelParser(_PageParser):
+    '''Serves pages of 20 posts from a set of message IDs, as t.me/s/ does'''
+
+    def __init__(self, ids, pageSize=20):
+        self._ids = sorted(ids)
+        self._pageSize = pageSize
+
+    def parse(self, r):
+        channel = r.url.split('/s/')[1].split('?')[0]
+        if 'after=' in r.url:
+            after = int(r.url.split('after=')[1])
+            return _FakePage(channel, [i for i in self._ids if i > after][:self._pageSize])
+        before = int(r.url.split('before=')[1]) if 'before=' in r.url else self._ids[-1] + 1
+        return _FakePage(channel, [i for i in self._ids if i < before][-self._pageSize:])
+
+    def page_to_items(self, scraper, doc, pageUrl):
+        for i in reversed(doc):
+            yield TelegramPost(url=f'https://t.me/s/{doc.channel}/{i}', date=None, content=None, message_id=i)
+
+    def first_post_href(self, doc):
+        return f'https://t.me/{doc.channel}/{doc[0]}' if doc else None
+
+    def older_page_href(self, doc):
+        return f'/s/{doc.channel}?before={doc[0]}' if doc else None
+
+    def canonical_href(self, doc):
+        return f'https://t.me/s/{doc.channel}'
+
+
+def _fake_channel_scraper(ids, cls=TelegramChannelScraper, *args, **kwargs):
+    def get(url, **kwargs):
+        scraper.requestedUrls.append(url)
+        r = requests.Response()
+        r.status_code = 200
+        r.url = url
+        return r
+
+    scraper = cls(*(args or ('example_channel',)), **kwargs)
+    scraper._parser = _FakeChannelParser(ids)
+    scraper._get = get
+    scraper.requestedUrls = []
+    return scraper
+
+
+def test_channels_scraper_merges_channels(monkeypatch):
+    ids = [i for i in range(1, 95) if i % 7]
+    names = ['alpha', 'beta', 'gamma', 'delta', 'epsilon']
+
+    def get(self, url, **kwargs):
+        r = requests.Response()
+        r.status_code = 200
+        r.url = url
+        return r
+
+    monkeypatch.setattr(TelegramChannelScraper, '_get', get)
+    monkeypatch.setattr(TelegramChannelScraper, '_get_entity', lambda self: Channel(username=self._name))
+    monkeypatch.setitem(snscrape.modules.telegram._PAGE_PARSERS, 'bs4', lambda: _FakeChannelParser(ids))
+    scraper = TelegramChannelsScraper(names, workers=3, with_entities=True)
+    items = list(scraper.get_items())
+
+    for name in names:
+        channelItems = [item for item in items if getattr(item, 'username', None) == name or f'/s/{name}/' in getattr(item, 'url', '')]
+        assert isinstance(channelItems[0], Channel)
+        assert [item.message_id for item in channelItems[1:]] == sorted(ids, reverse=True)
+    assert len(items) == len(names) * (len(ids) + 1)
+
+
+def test_channels_scraper_skips_failing_channel(monkeypatch, caplog):
+    ids = list(range(1, 50))
+
+    class BrokenChannelParser(_FakeChannelParser):
+        def parse(self, r):
+            if '/s/beta' in r.url:
+                raise AttributeError('malformed page')
+            return super().parse(r)
+
+    def get(self, url, **kwargs):
+        r = requests.Response()
+        r.status_code = 200
+        r.url = url
+        return r
+
+    monkeypatch.setattr(TelegramChannelScraper, '_get', get)
+    monkeypatch.setitem(snscrape.modules.telegram._PAGE_PARSERS, 'bs4', lambda: BrokenChannelParser(ids))
+    items = list(TelegramChannelsScraper(['alpha', 'beta', 'gamma'], workers=3).get_items())
+
+    assert sorted(item.url.split('/')[-2] for item in items) == ['alpha'] * len(ids) + ['gamma'] * len(ids)
+    assert 'Could not retrieve channel beta: AttributeError: malformed page' in caplog.text
+
+
+@pytest.mark.parametrize('dedupFilter', [lambda path: snscrape.base.SetDedupFilter(), lambda path: snscrape.base.LRUDedupFilter(100),
+                                         lambda path: snscrape.base.BloomDedupFilter(1000), lambda path: snscrape.base.SQLiteDedupFilter(path)])
+def test_dedup_filter_skips_seen_posts(tmp_path, dedupFilter):
+    with dedupFilter(str(tmp_path / 'seen.sqlite')) as filter_:
+        first = [item.message_id for item in _fake_channel_scraper(range(1, 51), before_id=31, dedup_filter=filter_).get_items()]
+        second = [item.message_id for item in _fake_channel_scraper(range(1, 51), dedup_filter=filter_).get_items()]
+
+    assert first == list(range(30, 0, -1))
+    assert second == list(range(50, 30, -1))
+
+
+def test_backfill_matches_sequential_order():
+    ids = [i for i in range(1, 2346) if i % 7 and not 1000 <= i < 1100]
+    sequential = [item.message_id for item in _fake_channel_scraper(ids).get_items()]
+    backfilled = [item.message_id for item in _fake_channel_scraper(ids, backfill=4).get_items()]
+
+    assert sequential == sorted(ids, reverse=True)
+    assert backfilled == sequential
+
+
+_MARKDOWN_SNIPPETS = [
+    'plain text with * and _ and `ticks`',
+    '<b>bold</b> <i>italic</i> <u>underline</u> <s>strike</s> <tg-spoiler>spoiler</tg-spoiler>',
+    '<b> padded </b>x<i>\n</i>y<b><i>nested</i></b>',
+    'line<br>\nbreak<br><br>  <br/>end<br>',
+    '<a href="https://example.org/a_b">https://example.org/a_b</a> <a href="https://example.org/">text</a> <a>no href</a>',
+    '<a href="https://example.org/" title="say &quot;hi&quot;"> titled </a><a href="https://example.org/"></a>',
+    '<code>x = a * b</code> <code>`tick`</code> <code> padded </code>',
+    'before<pre>\n  indented\n\tcode * _ <b>bold</b>\n\n</pre>after',
+    '<pre><code class="language-python">print(1)</code></pre>',
+    '<blockquote>quoted<br>second line</blockquote>text <blockquote> </blockquote>',
+    '  lead\t\t and\xa0trail  \n\n  more  ',
+    '<i class="emoji" style="background-image:url(\'//telegram.org/img/emoji/40/F09F9880.png\')"><b>\U0001F600</b></i> emoji',
+    '<span>span</span><p>para</p><div>div</div>',
+    '<h3>heading</h3><img src="a.png" alt="image">',  # Not handled natively
+]
+
+
+@pytest.mark.parametrize('snippet', _MARKDOWN_SNIPPETS)
+def test_markdown_converter_matches_markdownify(snippet):
+    html = f'<html><body><div class="tgme_widget_message_text">{snippet}</div></body></html>'
+    div = bs4.BeautifulSoup(html, 'lxml').find('div', class_='tgme_widget_message_text')
+    expected = markdownify.markdownify(str(div), heading_style='ATX')
+
+    assert _bs4MarkdownConverter.markdown(div) == expected
+    assert _lxmlMarkdownConverter.markdown(lxml.html.document_fromstring(html).find('.//div')) == expected
+
+
+def test_markdown_converter_matches_markdownify_on_posts_page():
+    with open(os.path.join(os.path.dirname(__file__), 'posts-page.html'), 'r', encoding='utf8') as file:
+        html = file.read()
+    divs = bs4.BeautifulSoup(html, 'lxml').find_all('div', class_='tgme_widget_message_text')
+    lxmlDivs = lxml.html.document_fromstring(html).find_class('tgme_widget_message_text')
+
+    assert len(divs) == len(lxmlDivs) > 0
+    for div, lxmlDiv in zip(divs, lxmlDivs):
+        expected = markdownify.markdownify(str(div), heading_style='ATX')
+        # Called directly to make sure there is no fallback to markdownify
+        assert _bs4MarkdownConverter._process_tag(div, 'div', False, False).strip('\n') == expected
+        assert _lxmlMarkdownConverter._process_tag(lxmlDiv, 'div', False, False).strip('\n') == expected
+
+
+@pytest.mark.parametrize('backfill', [0, 3])
+def test_id_bounds(backfill):
+    ids = [i for i in range(1, 2346) if i % 7]
+    scraper = _fake_channel_scraper(ids, backfill=backfill, after_id=1200, before_id=2000)
+
+    assert [item.message_id for item in scraper.get_items()] == [i for i in reversed(ids) if 1200 < i < 2000]
+    assert scraper.requestedUrls[0] == 'https://t.me/s/example_channel?before=2000'
+    # No pages below the lower bound
+    assert all(int(url.split('before=')[1]) > 1200 for url in scraper.requestedUrls)
+
+
+def test_post_scraper_hydrates_windows():
+    ids = [i for i in range(1, 2346) if i % 7]
+    posts = ['https://t.me/example_channel/5', 't.me/s/example_channel/6?single', 'Example_Channel/30', ('example_channel', 31),
+             'example_channel/8', 'example_channel/14', 'example_channel/5', 'example_channel/5000']
+    scraper = _fake_channel_scraper(ids, TelegramPostScraper, posts, workers=2)
+
+    assert [item.message_id for item in scraper.get_items()] == [5, 6, 8, 30, 31]
+    assert scraper.missing == [('example_channel', 14), ('example_channel', 5000)]
+    assert sorted(scraper.requestedUrls) == ['https://t.me/s/example_channel?after=29', 'https://t.me/s/example_channel?after=4',
+                                             'https://t.me/s/example_channel?after=4999']
+
+
+def test_post_scraper_follows_short_pages():
+    ids = [i for i in range(1, 200) if i % 7]
+    scraper = _fake_channel_scraper(ids, TelegramPostScraper, ['example_channel/10', 'example_channel/28', 'example_channel/150'], workers=2)
+    scraper._parser = _FakeChannelParser(ids, pageSize=6)
+
+    assert [item.message_id for item in scraper.get_items()] == [10, 150]
+    assert scraper.missing == [('example_channel', 28)]
+    assert sorted(scraper.requestedUrls) == ['https://t.me/s/example_channel?after=149', 'https://t.me/s/example_channel?after=16',
+                                             'https://t.me/s/example_channel?after=23', 'https://t.me/s/example_channel?after=9']
+
+
+def test_post_scraper_rejects_invalid_references():
+    with pytest.raises(ValueError):
+        TelegramPostScraper(['https://t.me/c/123/456'])
+
+
+def test_gap_scraper_fills_gaps():
+    ids = [i for i in range(1, 3000) if i not in (105, 111) and not 2000 <= i <= 2010]
+    archived = [i for i in ids if not 100 <= i <= 110 and not 500 <= i <= 2600 and i != 2900]
+    scraper = _fake_channel_scraper(ids, TelegramGapScraper, 'example_channel', archived, first_id=10, workers=3)
+
+    assert [item.message_id for item in scraper.get_items()] == [i for i in ids if 100 <= i <= 110 or 500 <= i <= 2600 or i == 2900]
+    assert [(gap.first, gap.last) for gap in scraper.gaps] == [(100, 111), (500, 2600), (2900, 2900)]
+    assert scraper.gaps[0] == MessageIdGap(first=100, last=111, recovered=[100, 101, 102, 103, 104, 106, 107, 108, 109, 110],
+                                           deleted=[105, 111])
+    assert scraper.gaps[1].deleted == list(range(2000, 2011))
+    assert scraper.gaps[2].recovered == [2900]
+    # About one page per 20 missing posts
+    assert len(scraper.requestedUrls) <= 1 + 2100 // 20 + 3 + 1
+
+
+def test_archive_ids_from_jsonl_and_sqlite(tmp_path):
+    jsonlPath = tmp_path / 'archive.jsonl'
+    jsonlPath.write_text('\n'.join(json.dumps(o) for o in [
+        {'url': 'https://t.me/s/Example_Channel/5', 'message_id': 5},
+        {'url': 'https://t.me/s/other_channel/6', 'message_id': 6},
+        {'message_id': 7},
+    ]) + '\n\n', encoding='utf-8')
+    assert list(_archive_ids_from_jsonl(jsonlPath, 'example_channel')) == [5, 7]
+
+    databasePath = tmp_path / 'archive.sqlite'
+    connection = sqlite3.connect(databasePath)
+    connection.execute('CREATE TABLE "posts table" (url TEXT)')
+    connection.executemany('INSERT INTO "posts table" VALUES (?)', [('https://t.me/s/example_channel/8',), ('9',), (None,)])
+    connection.commit()
+    connection.close()
+    assert list(_archive_ids_from_sqlite(databasePath, 'posts table', 'url')) == [8, 9]
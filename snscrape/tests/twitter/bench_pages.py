@@ -0,0 +1,61 @@
+'''Benchmark the processing of Twitter API pages: decoding the instructions for pagination and converting the tweets.
+
+Run with `python -m snscrape.tests.twitter.bench_pages [PAGE.json ...]`; by default, the synthetic V2 search and GraphQL conversation pages from snscrape.tests.twitter.pages are used, once with the default mix of tweets and once mostly consisting of retweets.
+Recorded responses are recognised as V2 if they have globalObjects and as GraphQL otherwise.
+Each page is fed through the pagination loop ten times with a fake _get_api_data, and its tweets are converted as the scrapers do, so no requests are made.
+'''
+
+import json
+import os.path
+import sys
+import timeit
+
+import snscrape.modules.twitter
+from snscrape.modules.twitter import _TimelinePage, _TwitterAPIType, _ScrollDirection
+import snscrape.tests.twitter.pages
+
+
+_PAGES_PER_RUN = 10
+
+
+def process(scraper, obj, apiType):
+	responses = iter([obj] * _PAGES_PER_RUN)
+	scraper._get_api_data = lambda endpoint, apiType, params: next(responses, {'timeline': {'instructions': []}, 'data': {}})
+	tweets = []
+	for page in scraper._iter_api_pages('https://example.org/', apiType, {}, {'cursor': None}, direction = _ScrollDirection.BOTH):
+		if apiType is _TwitterAPIType.V2:
+			tweets.extend(scraper._v2_timeline_instructions_to_tweets(page))
+		elif page.obj['data']:
+			tweets.extend(scraper._graphql_timeline_instructions_to_tweets(page, includeConversationThreads = True))
+	return tweets
+
+
+def main(pages):
+	scraper = snscrape.modules.twitter.TwitterSearchScraper('example', guestTokenManager = snscrape.modules.twitter.GuestTokenManager(), retries = _PAGES_PER_RUN)
+	for name, obj in pages:
+		apiType = _TwitterAPIType.V2 if 'globalObjects' in obj else _TwitterAPIType.GRAPHQL
+		page = _TimelinePage.from_response(obj, apiType)
+		tweets = process(scraper, obj, apiType)
+		number, total = timeit.Timer(lambda: _TimelinePage.from_response(obj, apiType)).autorange()
+		decode = total / number
+		number, total = timeit.Timer(lambda: process(scraper, obj, apiType)).autorange()
+		perPage = total / number / _PAGES_PER_RUN
+		print(f'{name} {apiType.name:7}  {len(page.tweetEntries)} tweet entries, {len(page.cursors)} cursors, {len(tweets) // _PAGES_PER_RUN} tweets  '
+		      f'decode: {decode * 1e6:.0f} µs/page  total: {perPage * 1000:.2f} ms/page  {perPage / (len(tweets) / _PAGES_PER_RUN) * 1e6:.0f} µs/tweet')
+
+
+def load(path):
+	with open(path, 'r') as fp:
+		return os.path.basename(path), json.load(fp)
+
+
+if __name__ == '__main__':
+	if len(sys.argv) > 1:
+		main([load(path) for path in sys.argv[1:]])
+	else:
+		main([
+			('v2-search', snscrape.tests.twitter.pages.v2_search_page()),
+			('v2-search-retweets', snscrape.tests.twitter.pages.v2_search_page(retweetShare = 0.7, quoteShare = 0.2)),
+			('graphql-conversation', snscrape.tests.twitter.pages.graphql_conversation_page()),
+			('graphql-conversation-retweets', snscrape.tests.twitter.pages.graphql_conversation_page(retweetShare = 0.7, quoteShare = 0.2)),
+		])
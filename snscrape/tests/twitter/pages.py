@@ -0,0 +1,176 @@
+'''Synthetic Twitter API responses in the shape of the V2 adaptive search and the GraphQL TweetDetail endpoints
+
+The pages are built from a seeded random generator, so they are identical across runs. Every tweet has a user, URLs, mentions, and hashtags; some are replies, retweets, or quotes.
+Retweets and quotes reference a few popular tweets with photos; retweetShare and quoteShare set the fraction of the tweets that are retweets and quotes.
+'''
+
+import random
+
+
+_DATE = 'Wed Oct 19 12:00:00 +0000 2022'
+_SOURCE = '<a href="https://mobile.twitter.com" rel="nofollow">Twitter Web App</a>'
+
+
+def _legacy_user(userId):
+	return {
+		'id_str': str(userId),
+		'screen_name': f'user{userId}',
+		'name': f'User {userId}',
+		'description': f'Account number {userId}, see https://t.co/u{userId}',
+		'entities': {'description': {'urls': [{'url': f'https://t.co/u{userId}', 'expanded_url': f'https://example.org/{userId}', 'display_url': f'example.org/{userId}', 'indices': [len(f'Account number {userId}, see '), len(f'Account number {userId}, see https://t.co/u{userId}')]}]}},
+		'verified': userId % 7 == 0,
+		'created_at': _DATE,
+		'followers_count': userId * 3,
+		'friends_count': userId * 2,
+		'statuses_count': userId * 5,
+		'favourites_count': userId,
+		'listed_count': 1,
+		'media_count': 0,
+		'location': 'Somewhere',
+		'protected': False,
+		'profile_image_url_https': f'https://pbs.twimg.com/profile_images/{userId}/photo.jpg',
+	}
+
+
+def _legacy_tweet(tweetId, userId, rng):
+	text = f'Tweet {tweetId} mentioning @user{userId + 1} with #tag{tweetId % 5} and https://t.co/t{tweetId}'
+	urlStart = text.index('https://')
+	mentionStart = text.index('@')
+	tweet = {
+		'id_str': str(tweetId),
+		'user_id_str': str(userId),
+		'full_text': text,
+		'created_at': _DATE,
+		'entities': {
+			'urls': [{'url': f'https://t.co/t{tweetId}', 'expanded_url': f'https://example.com/{tweetId}', 'display_url': f'example.com/{tweetId}', 'indices': [urlStart, len(text)]}],
+			'user_mentions': [{'id_str': str(userId + 1), 'screen_name': f'user{userId + 1}', 'name': f'User {userId + 1}', 'indices': [mentionStart, mentionStart + len(f'@user{userId + 1}')]}],
+			'hashtags': [{'text': f'tag{tweetId % 5}'}],
+		},
+		'reply_count': rng.randrange(10),
+		'retweet_count': rng.randrange(100),
+		'favorite_count': rng.randrange(1000),
+		'quote_count': rng.randrange(10),
+		'conversation_id_str': str(tweetId),
+		'lang': 'en',
+		'source': _SOURCE,
+	}
+	if rng.random() < 0.3:
+		tweet['in_reply_to_status_id_str'] = str(tweetId - 1)
+		tweet['in_reply_to_user_id_str'] = str(userId + 1)
+		tweet['in_reply_to_screen_name'] = f'user{userId + 1}'
+	return tweet
+
+
+def _add_photos(tweet):
+	tweet['extended_entities'] = {'media': [{'type': 'photo', 'media_url_https': f'https://pbs.twimg.com/media/{tweet["id_str"]}-{i}.jpg'} for i in range(4)]}
+
+
+def _embedded_ids(rng, popular, retweetShare, quoteShare):
+	# Retweets and quotes reference a few popular tweets, as on a search page about a viral tweet
+	r = rng.random()
+	retweetedId = rng.choice(popular) if r < retweetShare else None
+	quotedId = rng.choice(popular) if retweetShare <= r < retweetShare + quoteShare else None
+	return retweetedId, quotedId
+
+
+def v2_search_page(tweets = 20, retweetShare = 0.3, quoteShare = 0.3, seed = 0):
+	'''A V2 adaptive search response with tweets search results, a promoted tweet, and top and bottom cursors'''
+	rng = random.Random(seed)
+	popular = list(range(1, 4))
+	globalTweets, globalUsers = {}, {}
+	def add(tweetId):
+		userId = 100 + tweetId % 37
+		globalUsers[str(userId)] = _legacy_user(userId)
+		globalTweets[str(tweetId)] = _legacy_tweet(tweetId, userId, rng)
+		return globalTweets[str(tweetId)]
+	for tweetId in popular:
+		_add_photos(add(tweetId))
+	entries = [{'entryId': 'sq-cursor-top', 'content': {'operation': {'cursor': {'value': 'refresh:top', 'cursorType': 'Top'}}}}]
+	for tweetId in range(1000, 1000 + tweets):
+		tweet = add(tweetId)
+		retweetedId, quotedId = _embedded_ids(rng, popular, retweetShare, quoteShare)
+		if retweetedId is not None:
+			tweet['retweeted_status_id_str'] = str(retweetedId)
+		if quotedId is not None:
+			tweet['quoted_status_id_str'] = str(quotedId)
+		entries.append({'entryId': f'sq-I-t-{tweetId}', 'content': {'item': {'content': {'tweet': {'id': str(tweetId), 'displayType': 'Tweet'}}}}})
+	entries.insert(3, {'entryId': 'sq-I-t-999', 'content': {'item': {'content': {'tweet': {'id': '999', 'promotedMetadata': {}}}}}})
+	entries.append({'entryId': 'sq-cursor-bottom', 'content': {'operation': {'cursor': {'value': 'scroll:bottom', 'cursorType': 'Bottom'}}}})
+	return {
+		'globalObjects': {'tweets': globalTweets, 'users': globalUsers},
+		'timeline': {'id': 'search', 'instructions': [{'clearCache': {}}, {'addEntries': {'entries': entries}}]},
+	}
+
+
+def _graphql_result(tweetId, rng, embedded = None):
+	# embedded is None for popular tweets, otherwise (popular, retweetShare, quoteShare)
+	userId = 100 + tweetId % 37
+	legacy = _legacy_tweet(tweetId, userId, rng)
+	if embedded is None:
+		_add_photos(legacy)
+	result = {
+		'__typename': 'Tweet',
+		'rest_id': str(tweetId),
+		'core': {'user_results': {'result': {'__typename': 'User', 'rest_id': str(userId), 'legacy': _legacy_user(userId)}}},
+		'legacy': legacy,
+	}
+	if embedded is not None:
+		retweetedId, quotedId = _embedded_ids(rng, *embedded)
+		if retweetedId is not None:
+			legacy['retweeted_status_result'] = {'result': _graphql_result(retweetedId, random.Random(retweetedId))}
+		if quotedId is not None:
+			legacy['quoted_status_id_str'] = str(quotedId)
+			result['quoted_status_result'] = {'result': _graphql_result(quotedId, random.Random(quotedId))}
+	return result
+
+
+def _graphql_tweet_content(tweetId, rng, embedded):
+	return {
+		'entryType': 'TimelineTimelineItem',
+		'itemContent': {'itemType': 'TimelineTweet', 'tweet_results': {'result': _graphql_result(tweetId, rng, embedded)}},
+	}
+
+
+def graphql_conversation_page(threads = 10, threadLength = 3, retweetShare = 0.3, quoteShare = 0.3, seed = 0):
+	'''A GraphQL TweetDetail response with the focal tweet, conversation threads, and top, bottom, and show more threads cursors'''
+	rng = random.Random(seed)
+	embedded = (list(range(1, 4)), retweetShare, quoteShare)
+	focalId = 2000
+	entries = [
+		{'entryId': f'cursor-top-{focalId}', 'content': {'entryType': 'TimelineTimelineItem', 'itemContent': {'itemType': 'TimelineTimelineCursor', 'value': 'top', 'cursorType': 'Top'}}},
+		{'entryId': f'tweet-{focalId}', 'content': _graphql_tweet_content(focalId, rng, embedded)},
+	]
+	tweetId = focalId + 1
+	for _ in range(threads):
+		threadId = f'conversationthread-{tweetId}'
+		items = []
+		for _ in range(threadLength):
+			items.append({'entryId': f'{threadId}-tweet-{tweetId}', 'item': _graphql_tweet_content(tweetId, rng, embedded)})
+			tweetId += 1
+		items.append({'entryId': f'{threadId}-cursor-showmore-{tweetId}', 'item': {'itemContent': {'itemType': 'TimelineTimelineCursor', 'value': 'more', 'cursorType': 'ShowMore'}}})
+		entries.append({'entryId': threadId, 'content': {'entryType': 'TimelineTimelineModule', 'items': items}})
+	entries.append({'entryId': f'cursor-bottom-{tweetId}', 'content': {'entryType': 'TimelineTimelineItem', 'itemContent': {'itemType': 'TimelineTimelineCursor', 'value': 'bottom', 'cursorType': 'Bottom'}}})
+	entries.append({'entryId': f'cursor-showMoreThreadsPrompt-{tweetId}', 'content': {'entryType': 'TimelineTimelineItem', 'itemContent': {'itemType': 'TimelineTimelineCursor', 'value': 'prompt', 'cursorType': 'ShowMoreThreadsPrompt'}}})
+	return {'data': {'threaded_conversation_with_injections': {'instructions': [{'type': 'TimelineAddEntries', 'entries': entries}]}}}
+
+
+def graphql_quoted_and_retweeted_page(retweetFirst = False):
+	'''A GraphQL TweetDetail response where tweet 3, which quotes tweet 4, is both quoted (by 2001) and retweeted (by 2002)
+
+	As in real responses, the quoted copy of tweet 3 only refers to tweet 4 with a quotedRefResult, while the retweeted copy embeds it in full.'''
+	def quoting(tweetId, full):
+		result = _graphql_result(tweetId, random.Random(tweetId))
+		result['legacy']['quoted_status_id_str'] = '4'
+		if full:
+			result['quoted_status_result'] = {'result': _graphql_result(4, random.Random(4))}
+		else:
+			result['quotedRefResult'] = {'result': {'__typename': 'Tweet', 'rest_id': '4'}}
+		return result
+	quoter = _graphql_result(2001, random.Random(2001))
+	quoter['legacy']['quoted_status_id_str'] = '3'
+	quoter['quoted_status_result'] = {'result': quoting(3, full = False)}
+	retweeter = _graphql_result(2002, random.Random(2002))
+	retweeter['legacy']['retweeted_status_result'] = {'result': quoting(3, full = True)}
+	results = [quoter, retweeter] if not retweetFirst else [retweeter, quoter]
+	entries = [{'entryId': f'tweet-{result["rest_id"]}', 'content': {'entryType': 'TimelineTimelineItem', 'itemContent': {'itemType': 'TimelineTweet', 'tweet_results': {'result': result}}}} for result in results]
+	return {'data': {'threaded_conversation_with_injections': {'instructions': [{'type': 'TimelineAddEntries', 'entries': entries}]}}}
@@ -0,0 +1,396 @@
+import argparse
+import collections
+import dataclasses
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import pytest
+import snscrape.base
+import snscrape.modules.twitter
+from snscrape.modules.twitter import Tweet, TweetRef, TwitterSearchScraper, TwitterTweetScraper, TwitterTweetScraperMode, GuestTokenManager, _CLIGuestTokenManager, _TimelinePage, _TwitterAPIType, _ScrollDirection
+from snscrape.tests.twitter.pages import v2_search_page, graphql_conversation_page, graphql_quoted_and_retweeted_page
+
+
+def _scraper():
+	return TwitterSearchScraper('example', guestTokenManager = GuestTokenManager())
+
+
+def test_timeline_page_v2():
+	page = _TimelinePage.from_response(v2_search_page(tweets = 5), _TwitterAPIType.V2)
+	assert page.tweetCount == 6  # Including the promoted tweet
+	assert [entryId for entryId, _, _ in page.tweetEntries] == ['sq-I-t-1000', 'sq-I-t-1001', 'sq-I-t-999', 'sq-I-t-1002', 'sq-I-t-1003', 'sq-I-t-1004']
+	assert page.cursors == [('top', 'refresh:top', None), ('bottom', 'scroll:bottom', None)]
+
+
+def test_timeline_page_graphql():
+	page = _TimelinePage.from_response(graphql_conversation_page(threads = 2, threadLength = 2), _TwitterAPIType.GRAPHQL)
+	assert page.tweetCount == 1
+	assert [(entryId, inThread) for entryId, _, inThread in page.tweetEntries] == [
+		('tweet-2000', False),
+		('conversationthread-2001-tweet-2001', True),
+		('conversationthread-2001-tweet-2002', True),
+		('conversationthread-2003-tweet-2003', True),
+		('conversationthread-2003-tweet-2004', True),
+	]
+	assert [kind for kind, _, _ in page.cursors] == ['top', 'bottom', 'showMoreThreadsPrompt']
+
+
+def test_v2_tweets_from_page():
+	scraper = _scraper()
+	obj = v2_search_page(tweets = 20)
+	tweets = list(scraper._v2_timeline_instructions_to_tweets(_TimelinePage.from_response(obj, _TwitterAPIType.V2)))
+	assert [tweet.id for tweet in tweets] == list(range(1000, 1020))
+	assert any(tweet.retweetedTweet for tweet in tweets) and any(tweet.quotedTweet for tweet in tweets)
+	assert tweets == list(scraper._v2_timeline_instructions_to_tweets(obj))
+
+
+@pytest.mark.parametrize('includeConversationThreads, expected', [(False, [2000]), (True, list(range(2000, 2007)))])
+def test_graphql_tweets_from_page(includeConversationThreads, expected):
+	obj = graphql_conversation_page(threads = 3, threadLength = 2)
+	page = _TimelinePage.from_response(obj, _TwitterAPIType.GRAPHQL)
+	tweets = list(_scraper()._graphql_timeline_instructions_to_tweets(page, includeConversationThreads = includeConversationThreads))
+	assert [tweet.id for tweet in tweets] == expected
+
+
+@pytest.mark.parametrize('retweetFirst', [False, True])
+def test_graphql_embedded_tweet_shapes_independent_of_order(retweetFirst):
+	scraper = _scraper()
+	page = _TimelinePage.from_response(graphql_quoted_and_retweeted_page(retweetFirst = retweetFirst), _TwitterAPIType.GRAPHQL)
+	tweets = {tweet.id: tweet for tweet in scraper._graphql_timeline_instructions_to_tweets(page)}
+	assert tweets[2001].quotedTweet.id == tweets[2002].retweetedTweet.id == 3
+	assert tweets[2001].quotedTweet.quotedTweet == TweetRef(id = 4)
+	assert isinstance(tweets[2002].retweetedTweet.quotedTweet, Tweet) and tweets[2002].retweetedTweet.quotedTweet.id == 4
+	# The same as without memoisation
+	assert list(tweets.values()) == [scraper._graphql_timeline_tweet_item_result_to_tweet(result) for _, result, _ in page.tweetEntries]
+
+
+@pytest.mark.parametrize('direction, expected', [
+	(_ScrollDirection.BOTTOM, [None, 'bottom', 'bottom', 'bottom']),
+	(_ScrollDirection.TOP, [None, 'top', 'top', 'top']),
+	(_ScrollDirection.BOTH, [None, 'top', 'top', 'top', 'bottom']),
+])
+def test_pagination_follows_page_cursors(direction, expected):
+	responses = iter([graphql_conversation_page(threads = 1)] * 3)
+	requestedCursors = []
+	def get_api_data(endpoint, apiType, params):
+		requestedCursors.append(params.get('cursor'))
+		return next(responses, {'data': {}})
+	scraper = _scraper()
+	scraper._get_api_data = get_api_data
+	pages = list(scraper._iter_api_pages('https://example.org/', _TwitterAPIType.GRAPHQL, {}, {'cursor': None}, direction = direction))
+	assert requestedCursors == expected
+	assert [page.tweetCount for page in pages] == [1, 1, 1] + [0] * (len(expected) - 3)
+
+
+def test_pagination_follows_show_more_threads_prompt():
+	# Without a bottom cursor, the show more threads prompt continues the pagination
+	obj = graphql_conversation_page(threads = 1)
+	entries = obj['data']['threaded_conversation_with_injections']['instructions'][0]['entries']
+	entries[:] = [entry for entry in entries if not entry['entryId'].startswith('cursor-bottom-')]
+	responses = iter([obj])
+	requestedCursors = []
+	def get_api_data(endpoint, apiType, params):
+		requestedCursors.append(params.get('cursor'))
+		return next(responses, {'data': {}})
+	scraper = _scraper()
+	scraper._get_api_data = get_api_data
+	list(scraper._iter_api_pages('https://example.org/', _TwitterAPIType.GRAPHQL, {}, {'cursor': None}))
+	assert requestedCursors == [None, 'prompt']
+
+
+@pytest.mark.parametrize('apiType', [_TwitterAPIType.V2, _TwitterAPIType.GRAPHQL])
+def test_embedded_tweets_converted_once_per_page(apiType):
+	scraper = _scraper()
+	if apiType is _TwitterAPIType.V2:
+		page = _TimelinePage.from_response(v2_search_page(retweetShare = 0.7, quoteShare = 0.2), apiType)
+		tweets = list(scraper._v2_timeline_instructions_to_tweets(page))
+		unmemoised = [scraper._tweet_to_tweet(page.obj['globalObjects']['tweets'][entryId[len('sq-I-t-'):]], page.obj) for entryId, _, _ in page.tweetEntries if entryId != 'sq-I-t-999']
+	else:
+		page = _TimelinePage.from_response(graphql_conversation_page(retweetShare = 0.7, quoteShare = 0.2), apiType)
+		tweets = list(scraper._graphql_timeline_instructions_to_tweets(page, includeConversationThreads = True))
+		unmemoised = [scraper._graphql_timeline_tweet_item_result_to_tweet(result) for _, result, _ in page.tweetEntries]
+	assert tweets == unmemoised
+	embedded = {}
+	for tweet in tweets:
+		for embeddedTweet in (tweet.retweetedTweet, tweet.quotedTweet):
+			if embeddedTweet is not None:
+				assert embedded.setdefault(embeddedTweet.id, embeddedTweet) is embeddedTweet
+	assert len(embedded) == 3
+
+
+def _cursor_entry(kind, value, stop = None):
+	content = {'itemType': 'TimelineTimelineCursor', 'value': value, 'cursorType': kind.capitalize()}
+	if stop is not None:
+		content['stopOnEmptyResponse'] = stop
+	return {'entryId': f'cursor-{kind}-{value}', 'content': {'entryType': 'TimelineTimelineItem', 'itemContent': content}}
+
+
+def _requested_cursors(prefetch, responses, direction):
+	responses = iter(responses)
+	requestedCursors = []
+	def get_api_data(endpoint, apiType, params):
+		requestedCursors.append(params.get('cursor'))
+		return next(responses, {'data': {}})
+	scraper = TwitterSearchScraper('example', guestTokenManager = GuestTokenManager(), prefetch = prefetch)
+	scraper._get_api_data = get_api_data
+	pages = list(scraper._iter_api_pages('https://example.org/', _TwitterAPIType.GRAPHQL, {}, {'cursor': None}, direction = direction))
+	return requestedCursors, [page.tweetCount for page in pages]
+
+
+@pytest.mark.parametrize('prefetch', [1, 2, 3])
+@pytest.mark.parametrize('direction', [_ScrollDirection.BOTTOM, _ScrollDirection.TOP, _ScrollDirection.BOTH])
+def test_prefetch_matches_synchronous_pagination(prefetch, direction):
+	responses = [graphql_conversation_page(threads = 1)] * 3
+	assert _requested_cursors(prefetch, responses, direction) == _requested_cursors(0, responses, direction)
+
+
+@pytest.mark.parametrize('prefetch', [0, 1, 3])
+def test_prefetch_stops_on_empty_response(prefetch):
+	withTweets = graphql_conversation_page(threads = 0)
+	entries = withTweets['data']['threaded_conversation_with_injections']['instructions'][0]['entries']
+	entries[:] = [entry for entry in entries if entry['entryId'].startswith('tweet-')] + [_cursor_entry('bottom', 'b1', stop = True)]
+	empty = {'data': {'threaded_conversation_with_injections': {'instructions': [{'type': 'TimelineAddEntries', 'entries': [_cursor_entry('bottom', 'b2')]}]}}}
+	assert _requested_cursors(prefetch, [withTweets, empty, withTweets], _ScrollDirection.BOTTOM) == ([None, 'b1'], [1, 0])
+
+
+@dataclasses.dataclass
+class _FakeTweet:
+	id: int
+	replyCount: int
+
+
+class _ReplyTree:
+	'''A random tree of tweets whose conversations consist of the parent, the focal tweet, and its replies'''
+
+	def __init__(self, size = 200, seed = 0):
+		rng = random.Random(seed)
+		self.parents = {1: None}
+		self.replies = collections.defaultdict(list)
+		for tweetId in range(2, size + 1):
+			# Biased towards recent tweets for deeper trees
+			parent = rng.randrange(max(1, tweetId - 20), tweetId)
+			self.parents[tweetId] = parent
+			self.replies[parent].append(tweetId)
+		self.requested = []
+
+	def depth(self, tweetId):
+		return 0 if self.parents[tweetId] is None else 1 + self.depth(self.parents[tweetId])
+
+	def iter_conversation(self, url, paginationVariables, tweetId):
+		self.requested.append(tweetId)
+		ids = ([self.parents[tweetId]] if self.parents[tweetId] is not None else []) + [tweetId] + self.replies[tweetId]
+		for id_ in ids:
+			yield _FakeTweet(id_, len(self.replies[id_]))
+
+
+def _recurse(tree, **kwargs):
+	scraper = TwitterTweetScraper(1, mode = TwitterTweetScraperMode.RECURSE, guestTokenManager = GuestTokenManager(), **kwargs)
+	scraper._iter_conversation = tree.iter_conversation
+	return [tweet.id for tweet in scraper.get_items()]
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_recurse_retrieves_every_conversation_once(workers):
+	tree = _ReplyTree()
+	ids = _recurse(tree, workers = workers)
+	assert sorted(ids) == list(tree.parents)
+	assert sorted(tree.requested) == list(tree.parents)
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+@pytest.mark.parametrize('maxDepth', [0, 1, 3])
+def test_recurse_max_depth(workers, maxDepth):
+	tree = _ReplyTree()
+	ids = _recurse(tree, workers = workers, maxDepth = maxDepth)
+	assert sorted(tree.requested) == sorted(tweetId for tweetId in tree.parents if tree.depth(tweetId) <= maxDepth)
+	assert sorted(ids) == sorted(tweetId for tweetId in tree.parents if tree.depth(tweetId) <= maxDepth + 1)
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_recurse_max_breadth(workers):
+	tree = _ReplyTree()
+	_recurse(tree, workers = workers, maxBreadth = 2)
+	perDepth = collections.Counter(tree.depth(tweetId) for tweetId in tree.requested)
+	assert perDepth[0] == 1
+	assert perDepth[1] == min(2, len(tree.replies[1]))
+	assert max(perDepth.values()) <= 2
+
+
+def test_recurse_spills_frontier(monkeypatch):
+	monkeypatch.setattr(snscrape.modules.twitter, '_RECURSE_FRONTIER_MEMORY_LIMIT', 3)
+	tree = _ReplyTree(size = 500, seed = 1)
+	assert sorted(_recurse(tree, workers = 2)) == list(tree.parents)
+
+
+def test_recurse_propagates_exceptions():
+	tree = _ReplyTree()
+	iterConversation = tree.iter_conversation
+	def iter_conversation(url, paginationVariables, tweetId):
+		if tweetId != 1:
+			raise snscrape.base.ScraperException('boom')
+		yield from iterConversation(url, paginationVariables, tweetId)
+	tree.iter_conversation = iter_conversation
+	with pytest.raises(snscrape.base.ScraperException, match = 'boom'):
+		_recurse(tree, workers = 2)
+
+
+def test_recurse_persists_seen_tweets(tmp_path):
+	path = str(tmp_path / 'seen.db')
+	tree = _ReplyTree()
+	# The filter is left open, as by the CLI; everything recorded must be committed nonetheless
+	dedupFilter = snscrape.base.SQLiteDedupFilter(path, namespace = 'twitter-tweet-1')
+	assert len(_recurse(tree, dedupFilter = dedupFilter)) == len(tree.parents)
+	with sqlite3.connect(path) as connection:
+		assert connection.execute('SELECT COUNT(*) FROM seen').fetchone()[0] == len(tree.parents)
+	dedupFilter.close()
+	with snscrape.base.SQLiteDedupFilter(path, namespace = 'twitter-tweet-1') as dedupFilter:
+		assert _recurse(_ReplyTree(), dedupFilter = dedupFilter) == []
+
+
+def test_recurse_closes_cli_seen_db(monkeypatch, tmp_path):
+	monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+	parser = argparse.ArgumentParser()
+	TwitterTweetScraper._cli_setup_parser(parser)
+	args = parser.parse_args(['--recurse', '--seen-db', str(tmp_path / 'seen.db'), '1'])
+	args.retries = 0
+	tree = _ReplyTree()
+	scraper = TwitterTweetScraper._cli_from_args(args)
+	scraper._iter_conversation = tree.iter_conversation
+	assert len(list(scraper.get_items())) == len(tree.parents)
+	with pytest.raises(sqlite3.ProgrammingError):
+		scraper._dedupFilter.add(0)
+
+
+@pytest.fixture
+def clock(monkeypatch, tmp_path):
+	'''A controllable time.time and a fresh cache directory for the CLI guest token file'''
+	monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+	clock = [1_700_000_000.0]
+	monkeypatch.setattr(time, 'time', lambda: clock[0])
+	return clock
+
+
+def _counting_loads(manager):
+	loads = []
+	parse = manager._parse
+	manager._parse = lambda content: loads.append(None) or parse(content)
+	return loads
+
+
+def test_cli_guest_token_shared_through_file(clock):
+	a, b = _CLIGuestTokenManager(), _CLIGuestTokenManager()
+	loads = _counting_loads(b)
+	assert b.token is None
+	a.token = '1'
+	assert (b.token, b.setTime) == ('1', clock[0])
+	# Unchanged file, so it is not parsed again
+	assert b.token == '1' and b.setTime == clock[0]
+	assert len(loads) == 1
+	clock[0] += 60
+	a.token = '22'
+	assert (b.token, b.setTime) == ('22', clock[0])
+	assert len(loads) == 2
+	# A rewrite of the same size within the file system's timestamp granularity is noticed as well
+	stat = os.stat(a._file)
+	clock[0] += 60
+	a.token = '33'
+	os.utime(a._file, ns = (stat.st_atime_ns, stat.st_mtime_ns))
+	assert (b.token, b.setTime) == ('33', clock[0])
+	assert len(loads) == 3
+
+
+def test_cli_guest_token_expires_in_memory(clock):
+	a, b = _CLIGuestTokenManager(), _CLIGuestTokenManager()
+	a.token = '1'
+	assert b.token == '1'
+	clock[0] += snscrape.modules.twitter._GUEST_TOKEN_VALIDITY - 1
+	assert a.token == '1' and b.token == '1'
+	# Neither the file nor the tokens held in memory are used once expired
+	clock[0] += 2
+	assert a.token is None and a.setTime == 0.0
+	assert b.token is None
+	assert _CLIGuestTokenManager().token is None
+
+
+def test_cli_guest_token_reset_keeps_newer_token(clock):
+	a, b = _CLIGuestTokenManager(), _CLIGuestTokenManager()
+	a.token = '1'
+	assert b.token == '1'
+	clock[0] += 60
+	a.token = '22'
+	# b was blocked with the old token; the file holds a's new one, which must survive
+	b.reset()
+	assert os.path.exists(a._file)
+	assert b.token == '22'
+	a.reset()
+	assert not os.path.exists(a._file)
+	assert b.token == '22' # Still in memory until it expires or is reset
+	b.reset()
+	assert b.token is None
+
+
+def _refreshing_scraper(manager, activate):
+	scraper = TwitterSearchScraper('example', guestTokenManager = manager)
+	scraper._activate_guest_token = activate
+	scraper._ensure_guest_token()
+	return scraper
+
+
+def test_guest_token_refreshed_in_background(clock):
+	manager = _CLIGuestTokenManager()
+	manager.token = 'old'
+	clock[0] += snscrape.modules.twitter._GUEST_TOKEN_VALIDITY - snscrape.modules.twitter._GUEST_TOKEN_REFRESH_MARGIN + 1
+	release = threading.Event()
+	def activate(headers):
+		assert 'x-guest-token' not in headers
+		release.wait()
+		return 'new'
+	scraper = _refreshing_scraper(manager, activate)
+	# The old token is used until the new one is in place
+	assert scraper._apiHeaders['x-guest-token'] == 'old'
+	scraper._ensure_guest_token()
+	release.set()
+	scraper._guestTokenRefresh.join()
+	assert manager.token == 'new' and manager.setTime == clock[0]
+	assert _CLIGuestTokenManager().token == 'new'
+	scraper._ensure_guest_token()
+	assert scraper._apiHeaders['x-guest-token'] == 'new'
+
+
+def test_guest_token_refresh_skipped_after_replacement(clock):
+	manager = _CLIGuestTokenManager()
+	manager.token = 'old'
+	clock[0] += snscrape.modules.twitter._GUEST_TOKEN_VALIDITY - snscrape.modules.twitter._GUEST_TOKEN_REFRESH_MARGIN + 1
+	release = threading.Event()
+	def activate(headers):
+		release.wait()
+		return 'stale'
+	scraper = _refreshing_scraper(manager, activate)
+	# Another process replaces the token while the refresh is in flight
+	clock[0] += 1
+	_CLIGuestTokenManager().token = 'other'
+	release.set()
+	scraper._guestTokenRefresh.join()
+	assert manager.token == 'other'
+
+
+def test_guest_token_refreshed_by_one_process(clock):
+	# Two managers stand for two processes sharing the token file
+	_CLIGuestTokenManager().token = 'old'
+	clock[0] += snscrape.modules.twitter._GUEST_TOKEN_VALIDITY - snscrape.modules.twitter._GUEST_TOKEN_REFRESH_MARGIN + 1
+	release = threading.Event()
+	activations = []
+	def activate(headers):
+		activations.append(None)
+		release.wait()
+		return f'new{len(activations)}'
+	first = _refreshing_scraper(_CLIGuestTokenManager(), activate)
+	second = _refreshing_scraper(_CLIGuestTokenManager(), activate)
+	release.set()
+	first._guestTokenRefresh.join()
+	second._guestTokenRefresh.join()
+	assert activations == [None]
+	assert first._guestTokenManager.token == second._guestTokenManager.token == 'new1'
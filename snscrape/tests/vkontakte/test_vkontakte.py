@@ -0,0 +1,131 @@
+import random
+import threading
+
+import bs4
+import pytest
+from snscrape.modules.vkontakte import VKontakteUserScraper
+
+
+_NO_POSTS = '<div class="page_block no_posts">No posts yet</div>'
+
+
+def _post_html(position):
+	# Newest first, so the post ID decreases with the position on the wall
+	postId = 10000 - position
+	return (f'<div id="post-1_{postId}" class="_post post page_block" data-post-id="-1_{postId}">'
+	        f'<h5 class="post_author"><a class="author" href="/example">Example</a></h5>'
+	        f'<div class="post_date"><a class="post_link" href="/wall-1_{postId}"><span class="rel_date" time="{1666180800 - position * 60}">today</span></a></div>'
+	        f'<div class="wall_text"><div class="wall_post_text">Post at {position}</div></div></div>')
+
+
+def _position(item):
+	return 10000 - int(item.url.rsplit('_', 1)[1])
+
+
+class _Wall:
+	'''A fake VK wall of length posts, retrieved in windows of ten positions starting at an offset
+
+	A window containing a position in blocked is geoblocked. Offsets in phantom return posts although they lie after the end of the wall, showing whether a response after the end is processed.'''
+
+	def __init__(self, length, blocked = (), phantom = ()):
+		self.length = length
+		self.blocked = set(blocked)
+		self.phantom = set(phantom)
+		self.requests = []
+		self._lock = threading.Lock()
+
+	def get_wall_offset(self, fixedPostID, ownerID, offset):
+		with self._lock:
+			self.requests.append(offset)
+		if offset in self.phantom:
+			return ''.join(_post_html(p) for p in range(offset, offset + 10))
+		if offset >= self.length:
+			return _NO_POSTS
+		window = range(offset, min(offset + 10, self.length))
+		if self.blocked.intersection(window):
+			return '"\\/blank.php?block=119910902"'
+		return ''.join(_post_html(p) for p in window)
+
+
+class _Response:
+	status_code = 200
+
+
+def _scrape(wall, scraper = None, **kwargs):
+	if scraper is None:
+		scraper = VKontakteUserScraper('example', **kwargs)
+	html = ''.join(_post_html(p) for p in range(min(10, wall.length)))
+	scraper._initialPage, scraper._initialPageSoup = _Response(), bs4.BeautifulSoup(f'<html><body><div id="page_wall_posts">{html}</div></body></html>', 'lxml')
+	scraper._get_wall_offset = wall.get_wall_offset
+	return [_position(item) for item in scraper.get_items()]
+
+
+@pytest.mark.parametrize('workers', [1, 2, 4, 8])
+def test_workers_process_pages_in_order(workers):
+	wall = _Wall(95)
+	assert _scrape(wall, workers = workers) == list(range(95))
+	# Each page once, and at most workers pages after the end of the wall
+	assert sorted(wall.requests) == list(range(10, max(wall.requests) + 10, 10))
+	assert max(wall.requests) < 100 + 10 * workers
+
+
+@pytest.mark.parametrize('workers', [2, 4])
+def test_workers_stop_at_the_end_of_the_wall(workers):
+	# Pages retrieved concurrently after the first no_posts page must not be emitted
+	wall = _Wall(50, phantom = range(60, 200, 10))
+	assert _scrape(wall, workers = workers) == list(range(50))
+
+
+def test_pipeline_and_workers_are_exclusive():
+	with pytest.raises(ValueError):
+		VKontakteUserScraper('example', pipeline = True, workers = 2)
+	VKontakteUserScraper('example', pipeline = True, workers = 1)
+
+
+def _probe_every_offset(wall):
+	'''The positions retrieved and the number of probes made by the geoblock workaround that preceded _recover_geoblock, which probed every offset after the last working page'''
+	positions, seen, probes = [], set(range(min(10, wall.length))), 0
+	positions.extend(sorted(seen))
+	def get(offset):
+		posts = wall.get_wall_offset(None, None, offset)
+		if posts.startswith('<div id="post'):
+			for p in range(offset, min(offset + 10, wall.length)):
+				if p not in seen:
+					seen.add(p)
+					positions.append(p)
+		return posts
+	lastWorkingOffset = 0
+	for offset in range(10, wall.length + 20, 10):
+		posts = get(offset)
+		if posts == _NO_POSTS:
+			break
+		if not posts.startswith('<div id="post'):
+			for geoblockOffset in range(lastWorkingOffset + 1, offset + 10):
+				probes += 1
+				if get(geoblockOffset) == _NO_POSTS:
+					break
+			continue
+		lastWorkingOffset = offset
+	return positions, probes
+
+
+def _random_blocks(rng, length):
+	# Single blocked posts and runs of them, some closer than ten positions to each other
+	blocked = set()
+	for _ in range(rng.randrange(1, 6)):
+		start = rng.randrange(10, length)
+		blocked.update(range(start, min(start + rng.choice([1, 1, 2, 5, 12]), length)))
+	return blocked
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+@pytest.mark.parametrize('seed', range(30))
+def test_geoblock_recovery_matches_probing_every_offset(workers, seed):
+	rng = random.Random(seed)
+	length = rng.randrange(30, 150)
+	blocked = _random_blocks(rng, length)
+	expected, oldProbes = _probe_every_offset(_Wall(length, blocked))
+	scraper = VKontakteUserScraper('example', workers = workers)
+	assert _scrape(_Wall(length, blocked), scraper = scraper) == expected
+	assert not blocked.intersection(expected)
+	assert scraper.geoblockRecoveryRequests < oldProbes